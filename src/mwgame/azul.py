@@ -1,16 +1,92 @@
 import sympy as sp
 import copy
-from typing import Callable, Optional
+import functools
+import itertools as it
+import pickle
+import random
+import struct
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Hashable, Iterator, Optional, Sequence
 from dataclasses import dataclass
 
 from icecream import ic  # type: ignore
 
-from util.debug import checkup, icp
-from mwmath.extensive_form import GameMove, GameOutcome, GameState
+from util.debug import TRACE_DETAIL, TRACE_INFO, checkup, trace
+from mwmath.numeric import backend, numeric_backend
+from mwmath.extensive_form import (
+    GameMove,
+    GameOutcome,
+    GameState,
+    RationalStrategy,
+    RolloutSummary,
+    active_search_stats,
+    run_rollouts,
+)
 
 ic.disable()
 
 
+_ZOBRIST_RANDOM = random.Random(0x5EED_A2B1)
+
+
+def _zobrist_table(*shape: int) -> list:
+    """
+
+    :param shape: the dimensions of the table
+    :return: nested lists of random 64-bit values with those dimensions
+    """
+    if len(shape) == 1:
+        return [_ZOBRIST_RANDOM.getrandbits(64) for _ in range(shape[0])]
+    return [_zobrist_table(*shape[1:]) for _ in range(shape[0])]
+
+
+class AzulZobrist:
+    """
+    Random 64-bit values which are XORed together into the position key of an AzulState.
+
+    Each move only changes a few piles, one pattern line, and the broken tiles of one board,
+    so the key can be updated by XORing out the old values and XORing in the new ones.
+    """
+
+    MASK = (1 << 64) - 1
+    """ keys are 64-bit """
+
+    MAX_PLAYERS = 4
+    """ the most players the tables support """
+    MAX_PILES = 10
+    """ the most piles (factories and center) the tables support """
+    MAX_COUNT = 20
+    """ the most tiles of a single color in a pile """
+    CELLS = 25
+    """ the number of cells on a wall """
+
+    PLAYER = _zobrist_table(MAX_PLAYERS)
+    """ PLAYER[player] is XORed in for the player to move """
+    PILE = _zobrist_table(MAX_PILES, 6, MAX_COUNT + 1)
+    """ PILE[pile][color][count] """
+    WALL = _zobrist_table(MAX_PLAYERS, CELLS)
+    """ WALL[player][row * 5 + column] is XORed in for each tile on a wall """
+    PATTERN = _zobrist_table(MAX_PLAYERS, 5, 6, 6)
+    """ PATTERN[player][row][color + 1][count] """
+    SCORE = _zobrist_table(MAX_PLAYERS)
+    """ salts the mixed score of each player """
+    BROKEN = _zobrist_table(MAX_PLAYERS)
+    """ salts the mixed broken tile count of each player """
+
+    @staticmethod
+    def mix(value: int) -> int:
+        """
+        Scores and broken tile counts are unbounded, so they are mixed (splitmix64) rather than looked up.
+
+        :param value: the value to mix
+        :return: a 64-bit key for that value
+        """
+        z = (value + 0x9E3779B97F4A7C15) & AzulZobrist.MASK
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & AzulZobrist.MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & AzulZobrist.MASK
+        return z ^ (z >> 31)
+
+
 class AzulTiles:
     """ Reprents the five factory piles and the center pile of tiles in an Azul game. """
 
@@ -33,11 +109,29 @@ class AzulTiles:
     COLOR_COUNT = 6
     """ number of tile colors that can be in a pile """
 
+    COLORS = range(FIRST_PLAYER)
+    """ the colors of the tiles, leaving out the first player tile """
+
+    EMPTY_PILE = [0, 0, 0, 0, 0, 0]
+    """ a pile with no tiles, such as a factory that was taken (only for comparisons, so never changed) """
+
     CENTER_PILE = 5
-    """ the index for the center pile of tiles """
+    """ the index for the center pile of tiles in a two player game """
 
     FACTORY_COUNT = 6
-    """ the number of factories """
+    """ the number of piles (five factories and the center) in a two player game """
+
+    STRUCT = struct.Struct(f"<B{10 * 6}B")
+    """ the encoding of the tiles: the number of piles, then the counts of every color in ten piles """
+
+    @staticmethod
+    def pile_count(players: int) -> int:
+        """
+
+        :param players: the number of players
+        :return: the number of piles (the factories and the center) for that many players
+        """
+        return 2 * players + 2
 
     @staticmethod
     def color_string(color: int) -> str:
@@ -58,15 +152,88 @@ class AzulTiles:
     def piles(self) -> list[list[int]]:
         return self._piles
 
+    @property
+    def center(self) -> int:
+        """ the index of the center pile, which follows the factories """
+        return len(self._piles) - 1
+
     def __hash__(self) -> int:
         raise NotImplementedError
 
     def hash(self) -> int:
-        piles = tuple(tuple(pile) for pile in self._piles)
-        return hash(piles)
+        return hash(self.key())
+
+    def key(self) -> int:
+        """
+
+        :return: the Zobrist key of all the piles
+        """
+        key = 0
+        for index in range(len(self._piles)):
+            key ^= self.pile_key(index)
+        return key
+
+    def pile_key(self, index: int) -> int:
+        """
+
+        :param index: the index of the pile
+        :return: the Zobrist key of that pile
+        """
+        key = 0
+        for color, count in enumerate(self._piles[index]):
+            key ^= AzulZobrist.PILE[index][color][count]
+        return key
+
+    def to_bytes(self) -> bytes:
+        """
+
+        :return: the tiles encoded in AzulTiles.STRUCT.size bytes
+        """
+        counts = [count for pile in self._piles for count in pile]
+        counts.extend(0 for _ in range(AzulTiles.STRUCT.size - 1 - len(counts)))
+        return AzulTiles.STRUCT.pack(len(self._piles), *counts)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "AzulTiles":
+        """
+
+        :param data: tiles encoded by to_bytes()
+        :return: the decoded tiles
+        """
+        pile_count, *counts = AzulTiles.STRUCT.unpack(data)
+        color_count = AzulTiles.COLOR_COUNT
+        return AzulTiles([list(counts[color_count * pile:color_count * (pile + 1)]) for pile in range(pile_count)])
+
+    def canonical_key(self) -> int:
+        """
+        Positions which differ only in the order of the factories have the same canonical key.
+
+        :return: the Zobrist key of the piles with the factories in canonical order
+        """
+        key = self.pile_key(self.center)
+        for index, pile in enumerate(sorted(self._piles[:self.center], reverse=True)):
+            for color, count in enumerate(pile):
+                key ^= AzulZobrist.PILE[index][color][count]
+        return key
+
+    def canonicalize(self) -> None:
+        """
+        Puts the factories in canonical order (the center pile stays last),
+        so positions which differ only in the order of the factories become equal.
+        Factories with the most tiles of the lowest colors come first, and empty factories come last.
+        """
+        self._piles[:self.center] = sorted(self._piles[:self.center], reverse=True)
+
+    def duplicates_earlier_factory(self, factory: int) -> bool:
+        """
+
+        :param factory: the pile from which tiles are taken
+        :return: True if an earlier factory holds the same tiles, so taking from this factory repeats a move
+        """
+        return factory < self.center and self._piles[factory] in self._piles[:factory]
 
     def check(self) -> None:
-        assert len(self.piles) == AzulTiles.FACTORY_COUNT
+        assert 2 <= len(self.piles) <= AzulZobrist.MAX_PILES
         assert all(len(pile) == AzulTiles.COLOR_COUNT for pile in self.piles)
 
     @checkup
@@ -95,20 +262,41 @@ class AzulTiles:
         :return: True if the player took the first player tile, False otherwise
         """
         took_first_player_tile = False
-        if factory < AzulTiles.CENTER_PILE:
+        if factory < self.center:
             for color in range(AzulTiles.COLOR_COUNT):
                 if color != taken_color:
-                    self.piles[AzulTiles.CENTER_PILE][color] += self.piles[factory][
+                    self.piles[self.center][color] += self.piles[factory][
                         color
                     ]
             self.piles[factory] = [0, 0, 0, 0, 0, 0]
         else:
-            self.piles[AzulTiles.CENTER_PILE][taken_color] = 0
-            if self.piles[AzulTiles.CENTER_PILE][AzulTiles.FIRST_PLAYER] == 1:
-                self.piles[AzulTiles.CENTER_PILE][AzulTiles.FIRST_PLAYER] = 0
+            self.piles[self.center][taken_color] = 0
+            if self.piles[self.center][AzulTiles.FIRST_PLAYER] == 1:
+                self.piles[self.center][AzulTiles.FIRST_PLAYER] = 0
                 took_first_player_tile = True
         return took_first_player_tile
 
+    @checkup
+    def untake(self, *, factory: int, taken_color: int, count: int, pile: list[int], took_first_player_tile: bool) -> None:
+        """
+        Reverses take()
+
+        :param factory: the factory from which the tiles were taken
+        :param taken_color: the color taken from that factory
+        :param count: the number of tiles taken
+        :param pile: the factory's pile before the tiles were taken
+        :param took_first_player_tile: the value returned by take()
+        """
+        if factory < self.center:
+            for color in range(AzulTiles.COLOR_COUNT):
+                if color != taken_color:
+                    self.piles[self.center][color] -= pile[color]
+            self.piles[factory] = pile
+        else:
+            self.piles[self.center][taken_color] = count
+            if took_first_player_tile:
+                self.piles[self.center][AzulTiles.FIRST_PLAYER] = 1
+
     @checkup
     def has_tiles(self, factory: int) -> bool:
         """
@@ -128,11 +316,61 @@ class AzulTiles:
         """
         nonempty = any(
             self.piles[factory][color] > 0
-            for factory in range(AzulTiles.FACTORY_COUNT)
+            for factory in range(len(self.piles))
             for color in range(AzulTiles.COLOR_COUNT)
         )
         return nonempty
 
+def _wall_runs(size: int) -> list[list[int]]:
+    """
+
+    :param size: the number of tiles in a line of the wall
+
+    :return: runs[line][position] is the number of tiles adjacent to that position in a line of the wall
+        (a bit mask), not counting the position itself
+    """
+    runs = []
+    for line in range(1 << size):
+        line_runs = []
+        for position in range(size):
+            run = 0
+            for other in range(position - 1, -1, -1):
+                if not line >> other & 1:
+                    break
+                run += 1
+            for other in range(position + 1, size):
+                if not line >> other & 1:
+                    break
+                run += 1
+            line_runs.append(run)
+        runs.append(line_runs)
+    return runs
+
+
+def _wall_tile_points(size: int) -> list[list[int]]:
+    """
+
+    :param size: the number of rows (and columns) of the wall
+
+    :return: points[row * 5 + column][row_line << size | column_line] is the number of points for placing a tile
+        at that position, given the tiles in its row and column (as bit masks)
+    """
+    runs = _wall_runs(size)
+    points = []
+    for row in range(size):
+        for column in range(size):
+            cell_points = []
+            for row_line in range(1 << size):
+                horizontal = runs[row_line][column]
+                for column_line in range(1 << size):
+                    vertical = runs[column_line][row]
+                    cell_points.append(
+                        horizontal + vertical + (horizontal > 0) + (vertical > 0) + (horizontal == vertical == 0)
+                    )
+            points.append(cell_points)
+    return points
+
+
 class AzulBoard:
 
     BROKEN_TILES_POINTS = [0, -1, -2, -4, -6, -8, -11, -14]
@@ -141,6 +379,19 @@ class AzulBoard:
     ROW_COUNT = 5
     """ Number of rows in the player's wall """
 
+    ROW_MASKS = [0b11111 << (5 * row) for row in range(5)]
+    """ the bits of each row of a wall mask, where the tile at (row, column) is bit 5 * row + column """
+    COLUMN_MASKS = [0b00001_00001_00001_00001_00001 << column for column in range(5)]
+    """ the bits of each column of a wall mask """
+    DIAGONAL_MASKS = [sum(1 << (5 * row + (row + diagonal) % 5) for row in range(5)) for diagonal in range(5)]
+    """ the bits of each (wrapped) diagonal of a wall mask, which are the tiles of a single color """
+    STRUCT = struct.Struct("<BI10BhB")
+    """ the encoding of a board: the player, the wall mask, the color and count of each pattern line,
+    the score, and the broken tiles """
+    TILE_POINTS = _wall_tile_points(5)
+    """ TILE_POINTS[row * 5 + column][row_line << 5 | column_line] is the number of points for placing a tile
+    at that position, given the tiles in its row and its column """
+
     @dataclass
     class PatternLine:
         """the pattern line on a player board"""
@@ -181,21 +432,24 @@ class AzulBoard:
     def __init__(
         self,
         player: int,
-        wall: Optional[sp.Matrix] = None,
+        wall: Optional[sp.Matrix | int] = None,
         patterns: Optional[list[PatternLine]] = None,
-        score: sp.Rational = sp.Integer(0),
+        score: Optional[sp.Rational] = None,
         broken_tiles: int = 0,
     ) -> None:
         """
 
         :param player: the player number
-        :param wall: the tiles in the player's walls (1 indicates a tile, 0 indicates no tile)
+        :param wall: the tiles in the player's walls (1 indicates a tile, 0 indicates no tile), or its mask
         :param patterns: the tiles in the player's patterns
-        :param score: the player's current score
+        :param score: the player's current score (converted to the current numeric backend)
         :param broken_tiles: the number of broken tiles on the player's board
         """
         self._player = player
-        self._wall = wall if wall else sp.zeros(self.ROW_COUNT, self.ROW_COUNT)
+        self._wall = wall if isinstance(wall, int) else self.wall_mask(wall)
+        """ the tile at (row, column) is bit 5 * row + column """
+        self._wall_columns = self.transpose(self._wall)
+        """ the tile at (row, column) is bit 5 * column + row, so that columns can be shifted out like rows """
         self._patterns = (
             patterns
             if patterns
@@ -207,7 +461,7 @@ class AzulBoard:
                 self.PatternLine(5),
             ]
         )
-        self._score = score
+        self._score = backend().convert(score if score is not None else 0)
         self._broken_tiles: int = broken_tiles
 
     def __hash__(self) -> int:
@@ -216,19 +470,115 @@ class AzulBoard:
 
     def hash(self) -> int:
         """ returns a hash used to quickly check if our values have changed. """
-        wall = sp.ImmutableMatrix(self._wall)
         patterns = tuple(pattern.hash() for pattern in self._patterns)
-        return hash((self._player, wall, patterns, self._score, self._broken_tiles))
+        return hash((self._player, self._wall, patterns, self._score, self._broken_tiles))
+
+    def key(self) -> int:
+        """
+
+        :return: the Zobrist key of the wall, patterns, score, and broken tiles
+        """
+        key = AzulZobrist.mix(hash(self._score) ^ AzulZobrist.SCORE[self._player]) ^ self.broken_key()
+        wall = self._wall
+        while wall:
+            tile = wall & -wall
+            key ^= AzulZobrist.WALL[self._player][tile.bit_length() - 1]
+            wall ^= tile
+        for row in range(self.ROW_COUNT):
+            key ^= self.pattern_key(row)
+        return key
+
+    def to_bytes(self) -> bytes:
+        """
+        Scores must be whole numbers.
+
+        :return: the board encoded in AzulBoard.STRUCT.size bytes
+        """
+        score = int(self._score)
+        assert score == self._score
+        patterns = [value for pattern in self._patterns for value in (pattern.color + 1, pattern.count)]
+        return AzulBoard.STRUCT.pack(self._player, self._wall, *patterns, score, self._broken_tiles)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "AzulBoard":
+        """
+
+        :param data: a board encoded by to_bytes()
+        :return: the decoded board (with its score converted to the current numeric backend)
+        """
+        player, wall, *patterns, score, broken_tiles = AzulBoard.STRUCT.unpack(data)
+        return AzulBoard(
+            player,
+            wall,
+            [AzulBoard.PatternLine(row + 1, patterns[2 * row] - 1, patterns[2 * row + 1]) for row in range(5)],
+            score,
+            broken_tiles,
+        )
+
+    def pattern_key(self, row: int) -> int:
+        """
+
+        :param row: the pattern line
+        :return: the Zobrist key of that pattern line
+        """
+        pattern = self._patterns[row]
+        return AzulZobrist.PATTERN[self._player][row][pattern.color + 1][pattern.count]
+
+    def broken_key(self) -> int:
+        """
+
+        :return: the Zobrist key of the broken tiles
+        """
+        return AzulZobrist.mix(self._broken_tiles ^ AzulZobrist.BROKEN[self._player])
 
     @property
     def player(self) -> int:
         return self._player
 
+    @staticmethod
+    def wall_mask(wall: Optional[sp.Matrix]) -> int:
+        """
+
+        :param wall: the tiles in a wall (1 indicates a tile, 0 indicates no tile)
+        :return: the mask of the wall
+        """
+        if wall is None:
+            return 0
+        return sum(1 << cell for cell, tile in enumerate(wall) if tile == 1)
+
+    @staticmethod
+    def transpose(mask: int) -> int:
+        """
+
+        :param mask: a wall mask
+        :return: the mask with rows and columns exchanged
+        """
+        transposed = 0
+        for row in range(AzulBoard.ROW_COUNT):
+            for column in range(AzulBoard.ROW_COUNT):
+                if mask >> (5 * row + column) & 1:
+                    transposed |= 1 << (5 * column + row)
+        return transposed
+
     @property
     def wall(self) -> sp.Matrix:
-        assert self._wall is not None
+        """ a copy of the wall as a matrix (1 indicates a tile, 0 indicates no tile) """
+        return sp.Matrix(self.ROW_COUNT, self.ROW_COUNT, lambda row, column: int(self.has_tile(row, column)))
+
+    @property
+    def wall_tiles(self) -> int:
+        """ the mask of the wall, where the tile at (row, column) is bit 5 * row + column """
         return self._wall
 
+    def has_tile(self, row: int, column: int) -> bool:
+        """
+
+        :param row: the row of a position on the wall
+        :param column: the column of that position
+        :return: True if there is a tile at that position
+        """
+        return bool(self._wall >> (5 * row + column) & 1)
+
     @property
     def patterns(self) -> list[PatternLine]:
         assert self._patterns is not None
@@ -251,7 +601,7 @@ class AzulBoard:
         self._broken_tiles = broken_tiles
 
     def check(self) -> None:
-        assert self.wall.shape == (self.ROW_COUNT, self.ROW_COUNT)
+        assert 0 <= self._wall < 1 << (self.ROW_COUNT * self.ROW_COUNT)
         assert len(self.patterns) == self.ROW_COUNT
         for row, pattern in enumerate(self.patterns):
             assert pattern.capacity == row + 1
@@ -261,7 +611,7 @@ class AzulBoard:
                 assert pattern.count <= pattern.capacity
                 assert pattern.count > 0
                 column = self.column(color=pattern.color, row=row)
-                assert self.wall[row, column] == 0
+                assert not self.has_tile(row, column)
 
     @checkup
     def wall_string(self, row) -> str:
@@ -272,7 +622,7 @@ class AzulBoard:
         """
         string = "["
         for col in range(self.ROW_COUNT):
-            if self.wall[row, col] == 1:
+            if self.has_tile(row, col):
                 color = self.color(row=row, column=col)
                 color_string = AzulTiles.color_string(color)
                 string += color_string
@@ -314,7 +664,7 @@ class AzulBoard:
         :param row: the row of the pattern line into which the tile will be placed
         :return: True if the tile may be placed on that pattern line
         """
-        if self.wall[row, self.column(color=color, row=row)] == 1:
+        if self.has_tile(row, self.column(color=color, row=row)):
             # cannot place in partial if already played to the wall
             return False
         if self.patterns[row].color not in {AzulTiles.EMPTY, color}:
@@ -344,6 +694,55 @@ class AzulBoard:
             self.patterns[row].count += unbroken_tiles
             self.broken_tiles += broken_tiles
 
+    @checkup
+    def restore_partial(self, *, row: int, color: int, count: int, broken_tiles: int) -> None:
+        """
+        Reverses place_in_partial()
+
+        :param row: the row into which the tiles were placed
+        :param color: the color of the pattern line before the tiles were placed
+        :param count: the number of tiles in the pattern line before the tiles were placed
+        :param broken_tiles: the number of broken tiles before the tiles were placed
+        """
+        self.patterns[row].color = color
+        self.patterns[row].count = count
+        self.broken_tiles = broken_tiles
+
+    @staticmethod
+    def broken_tiles_points(broken_tiles: int) -> int:
+        """
+
+        :param broken_tiles: the number of broken tiles
+        :return: the (negative) points for that many broken tiles
+        """
+        if broken_tiles < len(AzulBoard.BROKEN_TILES_POINTS):
+            return AzulBoard.BROKEN_TILES_POINTS[broken_tiles]
+        return AzulBoard.BROKEN_TILES_POINTS[-1] + 3 * (broken_tiles - (len(AzulBoard.BROKEN_TILES_POINTS) - 1))
+
+    def placement_value(self, *, row: int, color: int, count: int, first_player_tile: bool) -> tuple[int, int]:
+        """
+        A heuristic for choosing a row without searching: the change in score from the broken tiles, plus the points
+        for the tile placed on the wall if the pattern line is completed, ignoring everything else this round.
+
+        :param row: the pattern line in which the tiles are placed
+        :param color: the color of the tiles
+        :param count: the number of tiles
+        :param first_player_tile: True if the first player tile is taken with them
+        :return: the immediate change in score, and the number of tiles placed on the pattern line (the tie breaker)
+        """
+        pattern = self._patterns[row]
+        column = (color + row) % self.ROW_COUNT
+        placed = 0
+        if not self._wall >> (5 * row + column) & 1 and pattern.color in (AzulTiles.EMPTY, color):
+            placed = min(count, pattern.capacity - pattern.count)
+        broken_tiles = self._broken_tiles + count - placed + first_player_tile
+        value = AzulBoard.broken_tiles_points(broken_tiles) - AzulBoard.broken_tiles_points(self._broken_tiles)
+        if placed > 0 and pattern.count + placed == pattern.capacity:
+            row_line = self._wall >> (5 * row) & 0b11111
+            column_line = self._wall_columns >> (5 * column) & 0b11111
+            value += AzulBoard.TILE_POINTS[5 * row + column][row_line << 5 | column_line]
+        return value, placed
+
     @checkup
     def score_tile(self, row: int, col: int) -> None:
         """
@@ -352,43 +751,16 @@ class AzulBoard:
         :param col: the column the tile is placed in
         :return: the score obtained by placing this tile based on neighboring tiles in the wall
         """
-        points = 0
-        hor_score = False
-        ver_score = False
-        for delta in range(1, row + 1):
-            if self.wall[row - delta, col] == 1:
-                hor_score = True
-                points += 1
-            else:
-                break
-        for delta in range(1, AzulBoard.ROW_COUNT - row):
-            if self.wall[row + delta, col] == 1:
-                hor_score = True
-                points += 1
-            else:
-                break
-        for delta in range(1, col + 1):
-            if self.wall[row, col - delta] == 1:
-                ver_score = True
-                points += 1
-            else:
-                break
-        for delta in range(1, AzulBoard.ROW_COUNT - col):
-            if self.wall[row, col + delta] == 1:
-                ver_score = True
-                points += 1
-            else:
-                break
-        if ver_score:
-            points += 1
-        if hor_score:
-            points += 1
-        if not (ver_score or hor_score):
-            points += 1
-
-        output = f"{self.player}: ({row}, {col}) gains {points} points"
-        icp(output)
-        self.score += points
+        self._score_tile(row, col)
+
+    def _score_tile(self, row: int, col: int) -> None:
+        """ score_tile() without the checks, for AzulGame's inner loop """
+        row_line = self._wall >> (5 * row) & 0b11111
+        column_line = self._wall_columns >> (5 * col) & 0b11111
+        points = AzulBoard.TILE_POINTS[5 * row + col][row_line << 5 | column_line]
+
+        trace(TRACE_DETAIL, "{}: ({}, {}) gains {} points", self._player, row, col, points)
+        self._score += points
 
     @checkup
     def score_round(self) -> None:
@@ -396,61 +768,100 @@ class AzulBoard:
 
         :return: the score of the player after moving all eligible tiles from the partials to the wall
         """
-        for row, pattern in enumerate(self.patterns):
+        self._score_round()
+
+    def _score_round(self) -> None:
+        """ score_round() without the checks, for AzulGame's inner loop """
+        patterns = self._patterns
+        for row, pattern in enumerate(patterns):
             if pattern.count == pattern.capacity:
                 # row is filled, place the tile
-                col = AzulBoard.column(row=row, color=pattern.color)
-                assert self.wall[row, col] == 0
-                self.wall[row, col] = 1
-                self.patterns[row] = self.PatternLine(row + 1)
-                self.score_tile(row, col)
-
-        points = 0
-        broken_tiles = self.broken_tiles
-        if self.broken_tiles < len(AzulBoard.BROKEN_TILES_POINTS):
-            points += AzulBoard.BROKEN_TILES_POINTS[self.broken_tiles]
-        else:
-            points += AzulBoard.BROKEN_TILES_POINTS[-1] + 3 * (
-                self.broken_tiles - (len(AzulBoard.BROKEN_TILES_POINTS) - 1)
-            )
-        self.broken_tiles = 0
+                col = (pattern.color + row) % self.ROW_COUNT
+                assert not self._wall >> (5 * row + col) & 1
+                self._wall |= 1 << (5 * row + col)
+                self._wall_columns |= 1 << (5 * col + row)
+                patterns[row] = self.PatternLine(row + 1)
+                self._score_tile(row, col)
 
-        output = f"{self.player}: {broken_tiles} broken tiles penalize {points} points"
-        icp(output)
-        self.score += points
+        broken_tiles = self._broken_tiles
+        points = AzulBoard.broken_tiles_points(broken_tiles)
+        self._broken_tiles = 0
+
+        trace(TRACE_INFO, "{}: {} broken tiles penalize {} points", self._player, broken_tiles, points)
+        self._score += points
 
-        self.score = max(self.score, sp.Integer(0))
+        self._score = max(self._score, backend().integer(0))
+
+    @checkup
+    def final_score(self) -> sp.Rational:
+        """
+
+        :return: the score after end of round and end of game scoring, leaving this board unchanged
+        """
+        board = AzulBoard(
+            self.player,
+            self._wall,
+            [copy.copy(pattern) for pattern in self.patterns],
+            self.score,
+            self.broken_tiles,
+        )
+        board.score_round()
+        board.score_game()
+        return board.score
+
+    def projected_score(self) -> sp.Rational:
+        """
+        A heuristic for scoring the board during a round (see AzulState.heuristic_evaluation()):
+        the score after the completed pattern lines are placed and the broken tiles are penalized (as in score_round),
+        plus the points each partial pattern line would gain, in proportion to how full it is,
+        plus the end of game bonuses, in proportion to the square of the fraction of their tiles on the wall.
+
+        :return: the projected score, leaving this board unchanged
+        """
+        numeric = backend()
+        wall, wall_columns = self._wall, self._wall_columns
+        points = AzulBoard.broken_tiles_points(self._broken_tiles)
+        for row, pattern in enumerate(self._patterns):
+            if pattern.count == pattern.capacity:
+                col = (pattern.color + row) % self.ROW_COUNT
+                row_line = wall >> (5 * row) & 0b11111
+                column_line = wall_columns >> (5 * col) & 0b11111
+                points += AzulBoard.TILE_POINTS[5 * row + col][row_line << 5 | column_line]
+                wall |= 1 << (5 * row + col)
+                wall_columns |= 1 << (5 * col + row)
+        score = max(self._score + points, numeric.integer(0))
+
+        for row, pattern in enumerate(self._patterns):
+            if 0 < pattern.count < pattern.capacity:
+                col = (pattern.color + row) % self.ROW_COUNT
+                row_line = wall >> (5 * row) & 0b11111
+                column_line = wall_columns >> (5 * col) & 0b11111
+                tile_points = AzulBoard.TILE_POINTS[5 * row + col][row_line << 5 | column_line]
+                score += numeric.rational(tile_points * pattern.count, pattern.capacity)
+
+        for masks, bonus in ((AzulBoard.ROW_MASKS, 2), (AzulBoard.COLUMN_MASKS, 7), (AzulBoard.DIAGONAL_MASKS, 10)):
+            for mask in masks:
+                tiles = bin(wall & mask).count("1")
+                if tiles > 0:
+                    score += numeric.rational(bonus * tiles * tiles, 25)
+        return score
 
     @checkup
     def score_game(self) -> None:
         """
         Adds points to the player's score based on end of game scoring (rows, columns, and diagonals)
         """
-        points = 0
-        for row in range(AzulBoard.ROW_COUNT):
-            if all(self.wall[row, col] == 1 for col in range(AzulBoard.ROW_COUNT)):
-                points += 2
-        output = f"{self.player}: rows score {points} points"
-        icp(output)
+        wall = self._wall
+        points = sum(2 for mask in AzulBoard.ROW_MASKS if wall & mask == mask)
+        trace(TRACE_INFO, "{}: rows score {} points", self.player, points)
         self.score += points
 
-        points = 0
-        for col in range(AzulBoard.ROW_COUNT):
-            if all(self.wall[row, col] == 1 for row in range(AzulBoard.ROW_COUNT)):
-                points += 7
-        output = f"{self.player}: cols score {points} points"
-        icp(output)
+        points = sum(7 for mask in AzulBoard.COLUMN_MASKS if wall & mask == mask)
+        trace(TRACE_INFO, "{}: cols score {} points", self.player, points)
         self.score += points
 
-        points = 0
-        for diag in range(AzulBoard.ROW_COUNT):
-            if all(
-                self.wall[row, (row + diag) % AzulBoard.ROW_COUNT] == 1
-                for row in range(AzulBoard.ROW_COUNT)
-            ):
-                points += 10
-        output = f"{self.player}: diagonals score {points} points"
-        icp(output)
+        points = sum(10 for mask in AzulBoard.DIAGONAL_MASKS if wall & mask == mask)
+        trace(TRACE_INFO, "{}: diagonals score {} points", self.player, points)
         self.score += points
 
 
@@ -465,9 +876,29 @@ class AzulMove(GameMove):
     def __repr__(self):
         return f"{AzulTiles.color_string(self.color)} ({self.count}): Factory {self.factory} -> Row {self.row}"
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def shared(color: int, count: int, factory: int, row: int) -> "AzulMove":
+        """ the same move as AzulMove(), built once, since AzulGame's policies make so many """
+        return AzulMove(color, count, factory, row)
+
 
 class AzulState(GameState):
 
+    HEADER = struct.Struct("<BB")
+    """ the start of the encoding of a state: the player to move and the number of players """
+
+    SIZE = HEADER.size + AzulTiles.STRUCT.size + AzulZobrist.MAX_PLAYERS * AzulBoard.STRUCT.size
+    """ the number of bytes in the encoding of every state """
+
+    ROW_POLICIES = ("exhaustive", "heuristic", "top_k")
+    """
+    How the row for the tiles taken is chosen:
+    "exhaustive" searches every row and keeps the best for the player,
+    "heuristic" keeps the row with the best AzulBoard.placement_value() without searching,
+    and "top_k" searches the row_candidates rows with the best placement values and keeps the best of those.
+    """
+
     def __init__(
         self,
         player: int,
@@ -475,6 +906,9 @@ class AzulState(GameState):
         boards: tuple[AzulBoard, ...],
         strategies: tuple[Callable, ...],
         history: Optional[tuple[GameMove, ...]] = None,
+        dedupe: bool = False,
+        row_policy: str = "exhaustive",
+        row_candidates: int = 2,
     ) -> None:
         """
 
@@ -483,10 +917,20 @@ class AzulState(GameState):
         :param boards: the player boards for each player
         :param strategies: the strategies for each player
         :param history: the sequence of moves leading to this point in the game
+        :param dedupe: if True, moves which repeat a move from an identical factory are skipped,
+            and the factories of the branch states are kept in canonical order (see AzulState.dedupe)
+        :param row_policy: how the rows for the tiles taken are chosen (see AzulState.ROW_POLICIES)
+        :param row_candidates: the number of rows searched by the "top_k" row policy
         """
         super().__init__(player, strategies, history)
+        assert row_policy in AzulState.ROW_POLICIES
         self._tiles = tiles
         self._boards = boards
+        self._dedupe = dedupe
+        self._row_policy = row_policy
+        self._row_candidates = row_candidates
+        self._undo_records: list[tuple[list[int], bool, int, int, int, Optional[Hashable]]] = []
+        """ the pile, first player tile, pattern line color and count, broken tiles, and key before each applied move """
 
     def __hash__(self) -> int:
         """ AzulState is mutable, so this is intentionally unimplemented """
@@ -500,6 +944,143 @@ class AzulState(GameState):
         """
         return hash((super().hash(), self._tiles.hash(), tuple(board.hash() for board in self._boards)))
 
+    def position_key(self) -> int:
+        """
+
+        :return: the Zobrist key of the player to move, the tiles, and the boards (but not the history)
+        """
+        key = AzulZobrist.PLAYER[self.player] ^ self._tiles.key()
+        for board in self._boards:
+            key ^= board.key()
+        return key
+
+    def to_bytes(self) -> bytes:
+        """
+        Encodes the position (the player to move, the tiles, and the boards) in AzulState.SIZE bytes,
+        leaving out the strategies, the history, and the search options, which are given to from_bytes().
+        This is much smaller and faster than pickling the state, and equal positions have equal encodings.
+
+        :return: the encoded position
+        """
+        boards = b"".join(board.to_bytes() for board in self._boards)
+        padding = bytes(AzulBoard.STRUCT.size * (AzulZobrist.MAX_PLAYERS - len(self._boards)))
+        return AzulState.HEADER.pack(self.player, len(self._boards)) + self._tiles.to_bytes() + boards + padding
+
+    @staticmethod
+    def from_bytes(
+        data: bytes,
+        strategies: tuple[Callable, ...],
+        history: Optional[tuple[GameMove, ...]] = None,
+        **options,
+    ) -> "AzulState":
+        """
+
+        :param data: a position encoded by to_bytes()
+        :param strategies: the strategies for each player
+        :param history: the sequence of moves leading to this position
+        :param options: the search options of AzulState (dedupe, row_policy, row_candidates)
+        :return: the decoded state
+        """
+        player, players = AzulState.HEADER.unpack_from(data)
+        start = AzulState.HEADER.size
+        tiles = AzulTiles.from_bytes(data[start:start + AzulTiles.STRUCT.size])
+        start += AzulTiles.STRUCT.size
+        size = AzulBoard.STRUCT.size
+        boards = tuple(
+            AzulBoard.from_bytes(data[start + size * board:start + size * (board + 1)]) for board in range(players)
+        )
+        return AzulState(player, tiles, boards, strategies, history, **options)
+
+    @property
+    def canonical_key(self) -> int:
+        """ the same for positions which differ only in the order of the factories """
+        key = AzulZobrist.PLAYER[self.player] ^ self._tiles.canonical_key()
+        for board in self._boards:
+            key ^= board.key()
+        return key
+
+    def canonical(self) -> "AzulState":
+        """
+
+        :return: a copy of this state with the factories in canonical order
+        """
+        tiles = copy.deepcopy(self.tiles)
+        tiles.canonicalize()
+        return AzulState(
+            self.player,
+            tiles,
+            copy.deepcopy(self.boards),
+            self.strategies,
+            self.history,
+            self.dedupe,
+            self.row_policy,
+            self.row_candidates,
+        )
+
+    @property
+    def dedupe(self) -> bool:
+        """
+        True if moves which repeat a move from an identical factory are skipped.
+        Taking a color from either of two identical factories leads to the same position up to the order of the factories,
+        so this only changes the outcome for strategies that weigh every move (like bayesian_strategy).
+        The branch states also keep their factories in canonical order, so a transposition table
+        finds positions reached by taking from the factories in a different order, and the factory of each move
+        refers to the order of the factories when it was made.
+        """
+        return self._dedupe
+
+    @property
+    def row_policy(self) -> str:
+        """ how the row for the tiles taken is chosen (see AzulState.ROW_POLICIES) """
+        return self._row_policy
+
+    @property
+    def row_candidates(self) -> int:
+        """ the number of rows searched by the "top_k" row policy """
+        return self._row_candidates
+
+    def candidate_rows(self, factory: int, color: int) -> list[int]:
+        """
+        The row policy is reported to search_stats(), along with the number of rows searched.
+
+        :param factory: the pile from which the tiles are taken
+        :param color: the color of the tiles taken
+        :return: the rows to try for those tiles, according to the row policy
+        """
+        rows = list(range(AzulBoard.ROW_COUNT))
+        if self._row_policy != "exhaustive":
+            board = self.boards[self.player]
+            count = self.tiles.piles[factory][color]
+            first_player_tile = factory == self.tiles.center and self.tiles.piles[factory][AzulTiles.FIRST_PLAYER] == 1
+            rows.sort(
+                key=lambda row: board.placement_value(
+                    row=row, color=color, count=count, first_player_tile=first_player_tile
+                ),
+                reverse=True,
+            )
+            rows = rows[:1] if self._row_policy == "heuristic" else sorted(rows[:self._row_candidates])
+        stats = active_search_stats()
+        if stats is not None:
+            stats.label("row_policy", self._row_policy)
+            if self._row_policy == "top_k":
+                stats.label("row_candidates", self._row_candidates)
+            if len(rows) > 1:
+                stats.count("searched_rows", len(rows))
+        return rows
+
+    def _partial_key(self, factory: int, row: int) -> int:
+        """
+
+        :param factory: the pile from which tiles are taken
+        :param row: the pattern line in which they are placed
+        :return: the Zobrist key of the parts of the position a move changes
+        """
+        board = self.boards[self.player]
+        key = board.pattern_key(row) ^ board.broken_key() ^ self.tiles.pile_key(self.tiles.center)
+        if factory != self.tiles.center:
+            key ^= self.tiles.pile_key(factory)
+        return key
+
     @checkup
     def __repr__(self) -> str:
         string = super().__repr__()
@@ -525,26 +1106,39 @@ class AzulState(GameState):
     def game_over(self) -> bool:
         return not self.tiles
 
+    def evaluate(self) -> GameOutcome:
+        """
+        Center-only endgames are looked up in (and added to) the active AzulTablebase, if it applies to them.
+
+        :return: the outcome of this game using the strategies, computed without stashing it
+        """
+        tablebase = _TABLEBASE
+        if tablebase is None or not tablebase.applies(self):
+            return super().evaluate()
+        outcome = tablebase.lookup(self)
+        if outcome is None:
+            outcome = super().evaluate()
+            tablebase.store(self, outcome)
+        return outcome
+
     @checkup
     def compute_outcome(self) -> GameOutcome:
-        for board in self.boards:
-            board.score_round()
-            board.score_game()
-        result = GameOutcome(tuple(board.score for board in self.boards), self.history)
+        result = GameOutcome(tuple(board.final_score() for board in self.boards), self.history)
         return result
 
     @checkup
     # maybe this should be optimal_branch_state_for() and just return one state
-    def branch_states_for(self, factory: int, color: int):
+    def branch_states_for(self, factory: int, color: int, rows: Optional[list[int]] = None):
         """
 
         :param factory: the factory from which the tiles are taken
         :param color: the color of tile taken
+        :param rows: the rows to try (None tries every row)
         :return: the states that result from trying the tile in different rows
         """
         count = self.tiles.piles[factory][color]
         if count > 0:
-            for row in range(AzulBoard.ROW_COUNT):
+            for row in range(AzulBoard.ROW_COUNT) if rows is None else rows:
                 new_player = (self.player + 1) % len(self.boards)
                 new_tiles = copy.deepcopy(self.tiles)
                 new_boards = copy.deepcopy(self.boards)
@@ -554,7 +1148,9 @@ class AzulState(GameState):
                 )
                 if new_tiles.take(taken_color=color, factory=factory):
                     # they took the first player marker
-                    self.boards[self.player].broken_tiles += 1
+                    new_boards[self.player].broken_tiles += 1
+                if self.dedupe:
+                    new_tiles.canonicalize()
                 if self.history is None:
                     new_history: tuple[GameMove, ...] = (
                         AzulMove(color, count, factory, row),
@@ -567,6 +1163,9 @@ class AzulState(GameState):
                     new_boards,
                     new_strategies,
                     new_history,
+                    self.dedupe,
+                    self.row_policy,
+                    self.row_candidates,
                 )
                 yield state
 
@@ -576,20 +1175,176 @@ class AzulState(GameState):
         """
 
         :return: the possible states that continue the game from this state assuming optimal row selected
+            from the rows chosen by the row policy
+            (skipping repeated moves from identical factories when dedupe is True)
         """
-        for factory in range(AzulTiles.COLOR_COUNT):
-            if self.tiles.has_tiles(factory):
-                for color in range(AzulTiles.COLOR_COUNT):
+        for factory in range(len(self.tiles.piles)):
+            if self.tiles.has_tiles(factory) and not (self.dedupe and self.tiles.duplicates_earlier_factory(factory)):
+                for color in range(AzulTiles.FIRST_PLAYER):
                     if self.tiles.piles[factory][color] > 0:
+                        branches = self.branch_states_for(factory, color, self.candidate_rows(factory, color))
+                        if self.row_policy == "heuristic":
+                            yield next(branches)
+                            continue
                         optimal_state = max(
-                            (
-                                branch
-                                for branch in self.branch_states_for(factory, color)
-                            ),
+                            branches,
                             key=lambda b: AzulState.rank(self.player, b.outcome),
                         )
                         yield optimal_state
 
+    @property
+    def moves(self):
+        """
+
+        :return: the possible moves from this state, trying the tiles in the rows chosen by the row policy
+            (skipping repeated moves from identical factories when dedupe is True)
+        """
+        for factory, color, count in self.picks():
+            for row in self.candidate_rows(factory, color):
+                yield AzulMove(color, count, factory, row)
+
+    def picks(self) -> list[tuple[int, int, int]]:
+        """
+
+        :return: the factory, color, and count of the tiles that can be taken (each can be placed in any row)
+            (skipping repeated picks from identical factories when dedupe is True)
+        """
+        tiles = self._tiles
+        dedupe = self._dedupe
+        picks = []
+        for factory, pile in enumerate(tiles.piles):
+            if pile == AzulTiles.EMPTY_PILE or dedupe and tiles.duplicates_earlier_factory(factory):
+                continue
+            for color in AzulTiles.COLORS:
+                count = pile[color]
+                if count:
+                    picks.append((factory, color, count))
+        return picks
+
+    def apply(self, move: GameMove) -> None:
+        """
+
+        :param move: the AzulMove to make
+        """
+        assert isinstance(move, AzulMove)
+        board = self.boards[self.player]
+        pattern = board.patterns[move.row]
+        pile = self.tiles.piles[move.factory]
+        color, count, broken_tiles = pattern.color, pattern.count, board.broken_tiles
+        key = self._key if isinstance(self._key, int) else None
+        if key is not None:
+            key ^= self._partial_key(move.factory, move.row)
+        board.place_in_partial(row=move.row, color=move.color, count=move.count)
+        took_first_player_tile = self.tiles.take(taken_color=move.color, factory=move.factory)
+        if took_first_player_tile:
+            board.broken_tiles += 1
+        self._undo_records.append((pile, took_first_player_tile, color, count, broken_tiles, self._key))
+        if key is not None:
+            key ^= self._partial_key(move.factory, move.row) ^ AzulZobrist.PLAYER[self.player]
+        self._player = (self.player + 1) % len(self.boards)
+        self._history = self._history + (move,)
+        if key is not None:
+            self._key = key ^ AzulZobrist.PLAYER[self.player]
+
+    def advance(self, move: AzulMove, record: bool = True) -> bool:
+        """
+        Makes a move for good, as AzulGame does: unlike apply(), there is no undo record, no checks, and no key.
+
+        :param move: the AzulMove to make
+        :param record: False to leave the move out of the history
+        :return: True if the player took the first player tile
+        """
+        # the boards and tiles are read through their fields rather than their properties, which adds up here
+        board = self._boards[self._player]
+        color, count, factory, row = move.color, move.count, move.factory, move.row
+        pattern = board._patterns[row]
+        placed = 0
+        if (
+            not board._wall >> (5 * row + (color + row) % AzulBoard.ROW_COUNT) & 1
+            and pattern.color in (AzulTiles.EMPTY, color)
+        ):
+            placed = min(count, pattern.capacity - pattern.count)
+            if placed > 0:
+                pattern.color = color
+                pattern.count += placed
+
+        piles = self._tiles._piles
+        center = piles[-1]
+        took_first_player_tile = False
+        if factory < len(piles) - 1:
+            pile = piles[factory]
+            for other in AzulTiles.COLORS:
+                if other != color:
+                    center[other] += pile[other]
+            piles[factory] = [0, 0, 0, 0, 0, 0]
+        else:
+            center[color] = 0
+            if center[AzulTiles.FIRST_PLAYER] == 1:
+                center[AzulTiles.FIRST_PLAYER] = 0
+                took_first_player_tile = True
+        board._broken_tiles += count - placed + took_first_player_tile
+
+        self._player = (self._player + 1) % len(self._boards)
+        if record:
+            self._history = self._history + (move,)
+        self._key = None
+        return took_first_player_tile
+
+    def undo(self, move: GameMove) -> None:
+        """
+
+        :param move: the AzulMove most recently made
+        """
+        assert isinstance(move, AzulMove)
+        assert self._history[-1] == move
+        pile, took_first_player_tile, color, count, broken_tiles, key = self._undo_records.pop()
+        self._history = self._history[:-1]
+        self._player = (self.player - 1) % len(self.boards)
+        self.tiles.untake(
+            factory=move.factory,
+            taken_color=move.color,
+            count=move.count,
+            pile=pile,
+            took_first_player_tile=took_first_player_tile,
+        )
+        self.boards[self.player].restore_partial(row=move.row, color=color, count=count, broken_tiles=broken_tiles)
+        self._key = key
+
+    @property
+    def groups_moves(self) -> bool:
+        """ When searching in place, the moves are grouped by factory and color, keeping the optimal row as branch_states does. """
+        return True
+
+    def move_group(self, move: GameMove) -> Hashable:
+        """
+
+        :param move: a move yielded by moves
+        :return: the factory and color of the move
+        """
+        assert isinstance(move, AzulMove)
+        return move.factory, move.color
+
+    def group_rank(self, player: int, outcome: GameOutcome) -> sp.Rational:
+        """
+
+        :param player: the player choosing the row
+        :param outcome: the outcome of placing the tiles in a row
+        :return: the rank used by branch_states to choose the row
+        """
+        return AzulState.rank(player, outcome)
+
+    @staticmethod
+    def heuristic_evaluation(state: "AzulState") -> tuple[sp.Rational, ...]:
+        """
+        An evaluation for depth_limited_strategy() and iterative_deepening_strategy():
+        the projected pattern line completions, adjacency points, and broken tile penalties of each board
+        (see AzulBoard.projected_score()), ignoring the tiles left to take.
+
+        :param state: a state during the round
+        :return: the projected score of each player
+        """
+        return tuple(board.projected_score() for board in state.boards)
+
     @staticmethod
     def rank(player: int, outcome: GameOutcome) -> sp.Rational:
         """
@@ -606,6 +1361,571 @@ class AzulState(GameState):
         return score
 
 
+class AzulTablebase:
+    """
+    Exact outcomes of center-only endgames (every factory is empty) with at most max_tiles tiles in the center,
+    when every player uses rational_strategy(AzulState.rank) and the exhaustive row policy.
+
+    Positions are keyed by the player to move, the piles, and the boards (but not the history),
+    so the same endgame reached by different moves is only searched once.
+    While a tablebase is active (see set_tablebase()), AzulState.outcome looks up the positions it applies to,
+    and adds the ones it has to search, so it can be built by searching (see build()) and saved to disk.
+    """
+
+    def __init__(self, max_tiles: int = 8) -> None:
+        """
+
+        :param max_tiles: the most tiles (not counting the first player tile) in the center of a stored position
+        """
+        self._max_tiles = max_tiles
+        self._entries: dict[bytes, tuple[tuple[int, ...], tuple[GameMove, ...]]] = {}
+        self.hits = 0
+        """ the number of lookups that found a stored outcome """
+        self.misses = 0
+        """ the number of lookups that did not find a stored outcome """
+
+    def __repr__(self) -> str:
+        return (
+            f"AzulTablebase: {len(self)} positions with up to {self._max_tiles} tiles, "
+            f"{self.hits} hits, {self.misses} misses"
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def max_tiles(self) -> int:
+        return self._max_tiles
+
+    @staticmethod
+    def key(state: AzulState) -> bytes:
+        """
+
+        :param state: a center-only endgame
+        :return: the player to move, the piles, and each board's wall, patterns, score, and broken tiles
+            (see AzulState.to_bytes())
+        """
+        return state.to_bytes()
+
+    def applies(self, state: AzulState) -> bool:
+        """
+
+        :param state: a state being evaluated
+        :return: True if the state is a center-only endgame with few enough tiles, searched by the rational strategy
+        """
+        piles = state.tiles.piles
+        center = state.tiles.center
+        if sum(piles[center][:AzulTiles.FIRST_PLAYER]) > self._max_tiles:
+            return False
+        if any(any(piles[factory]) for factory in range(center)):
+            return False
+        if state.row_policy != "exhaustive":
+            return False
+        return all(
+            isinstance(strategy, RationalStrategy) and strategy.rank is AzulState.rank for strategy in state.strategies
+        )
+
+    def lookup(self, state: AzulState) -> Optional[GameOutcome]:
+        """
+
+        :param state: a state to which the tablebase applies
+        :return: the stored outcome for the state's position (with the state's history), or None if there is none
+        """
+        entry = self._entries.get(self.key(state))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        payoffs, continuation = entry
+        numeric = backend()
+        history = state.history if state.history else ()
+        return GameOutcome(tuple(numeric.integer(payoff) for payoff in payoffs), history + continuation)
+
+    def store(self, state: AzulState, outcome: GameOutcome) -> None:
+        """
+
+        :param state: a state to which the tablebase applies
+        :param outcome: the outcome of that state (its moves must begin with the state's history)
+        """
+        history = state.history if state.history else ()
+        moves = outcome.moves if outcome.moves else ()
+        assert moves[:len(history)] == history
+        self._entries[self.key(state)] = (tuple(int(payoff) for payoff in outcome.payoffs), moves[len(history):])
+
+    def build(
+        self, boards: tuple[AzulBoard, ...], colors: Sequence[int] = tuple(range(AzulTiles.FIRST_PLAYER))
+    ) -> None:
+        """
+        Searches every center-only endgame with these boards and up to max_tiles tiles of these colors in the center
+        (with either player to move, and with or without the first player tile), storing every position searched.
+
+        :param boards: the boards of the players
+        :param colors: the colors that may be in the center
+        """
+        strategies = tuple(AzulState.rational_strategy(AzulState.rank) for _ in boards)
+        factories = AzulTiles.pile_count(len(boards)) - 1
+        previous = set_tablebase(self)
+        try:
+            for tiles in range(1, self._max_tiles + 1):
+                for center_colors in it.combinations_with_replacement(colors, tiles):
+                    for first_player_tile in (0, 1):
+                        center = [center_colors.count(color) for color in range(AzulTiles.FIRST_PLAYER)]
+                        center.append(first_player_tile)
+                        for player in range(len(boards)):
+                            piles = [[0 for _ in range(AzulTiles.COLOR_COUNT)] for _ in range(factories)]
+                            piles.append(list(center))
+                            state = AzulState(player, AzulTiles(piles), copy.deepcopy(boards), strategies)
+                            state.outcome
+        finally:
+            set_tablebase(previous)
+
+    def save(self, path: str) -> None:
+        """
+
+        :param path: the file in which to save the tablebase
+        """
+        with open(path, "wb") as file:
+            pickle.dump((self._max_tiles, self._entries), file)
+
+    @staticmethod
+    def load(path: str) -> "AzulTablebase":
+        """
+
+        :param path: a file written by save()
+        :return: the tablebase saved in that file
+        """
+        with open(path, "rb") as file:
+            max_tiles, entries = pickle.load(file)
+        tablebase = AzulTablebase(max_tiles)
+        tablebase._entries = entries
+        return tablebase
+
+
+_TABLEBASE: Optional[AzulTablebase] = None
+""" the tablebase consulted by AzulState.evaluate() """
+
+
+def set_tablebase(tablebase: Optional[AzulTablebase]) -> Optional[AzulTablebase]:
+    """
+
+    :param tablebase: the tablebase for AzulState.outcome to consult (None to stop consulting one)
+    :return: the tablebase that was being consulted
+    """
+    global _TABLEBASE
+    previous = _TABLEBASE
+    _TABLEBASE = tablebase
+    return previous
+
+
+@contextmanager
+def azul_tablebase(tablebase: AzulTablebase) -> Iterator[AzulTablebase]:
+    """
+    Consults the tablebase within a with statement.
+
+    :param tablebase: the tablebase for AzulState.outcome to consult
+    """
+    previous = set_tablebase(tablebase)
+    try:
+        yield tablebase
+    finally:
+        set_tablebase(previous)
+
+
+class AzulBag:
+    """ The bag from which the factories are filled, and the lid of the box, which holds discarded tiles """
+
+    TILES_PER_COLOR = 20
+    """ the number of tiles of each color in the game """
+
+    TILES_PER_FACTORY = 4
+    """ the number of tiles drawn for each factory """
+
+    def __init__(self, rng: random.Random) -> None:
+        """
+
+        :param rng: the random number generator used to draw the tiles
+        """
+        self._rng = rng
+        self.bag = [self.TILES_PER_COLOR for _ in range(AzulTiles.FIRST_PLAYER)]
+        """ the number of tiles of each color in the bag """
+        self.lid = [0 for _ in range(AzulTiles.FIRST_PLAYER)]
+        """ the number of tiles of each color in the lid """
+
+    def __repr__(self) -> str:
+        return f"Bag {self.bag}, Lid {self.lid}"
+
+    def draw(self) -> int:
+        """
+        When the bag is empty, the tiles in the lid are returned to the bag first.
+
+        :return: the color of a tile drawn at random from the bag, or AzulTiles.EMPTY if there are no tiles left
+        """
+        total = sum(self.bag)
+        if total == 0:
+            self.bag, self.lid = self.lid, [0 for _ in range(AzulTiles.FIRST_PLAYER)]
+            total = sum(self.bag)
+            if total == 0:
+                return AzulTiles.EMPTY
+        pick = self._rng.randrange(total)
+        for color, count in enumerate(self.bag):
+            if pick < count:
+                self.bag[color] -= 1
+                return color
+            pick -= count
+        raise AssertionError("the bag holds fewer tiles than its total")
+
+    def draw_tiles(self, count: int) -> list[int]:
+        """
+        Draws the tiles together, which is the same as drawing them one at a time with draw().
+
+        :param count: the number of tiles to draw
+        :return: the colors of the tiles drawn (fewer if the bag and the lid run out)
+        """
+        drawn: list[int] = []
+        while len(drawn) < count:
+            tiles: list[int] = []
+            for color, tile_count in enumerate(self.bag):
+                tiles += [color] * tile_count
+            if not tiles:
+                if not any(self.lid):
+                    break
+                self.bag, self.lid = self.lid, [0 for _ in range(AzulTiles.FIRST_PLAYER)]
+                continue
+            # a partial Fisher-Yates shuffle that moves the tiles drawn to the end,
+            # with rng.random() since it is much cheaper than rng.sample()
+            random_value = self._rng.random
+            size = len(tiles)
+            sample_size = min(count - len(drawn), size)
+            for last in range(size - 1, size - 1 - sample_size, -1):
+                pick = int(random_value() * (last + 1))
+                tiles[pick], tiles[last] = tiles[last], tiles[pick]
+            sample = tiles[size - sample_size:]
+            for color in sample:
+                self.bag[color] -= 1
+            drawn.extend(sample)
+        return drawn
+
+    def fill(self, factories: int) -> AzulTiles:
+        """
+        If the bag and the lid run out of tiles, the remaining factories are left (partially) empty.
+
+        :param factories: the number of factories
+        :return: the factories filled from the bag, and the center holding the first player tile
+        """
+        drawn = self.draw_tiles(factories * self.TILES_PER_FACTORY)
+        piles = []
+        for factory in range(factories):
+            pile = [0 for _ in range(AzulTiles.COLOR_COUNT)]
+            for color in drawn[factory * self.TILES_PER_FACTORY:(factory + 1) * self.TILES_PER_FACTORY]:
+                pile[color] += 1
+            piles.append(pile)
+        center = [0 for _ in range(AzulTiles.COLOR_COUNT)]
+        center[AzulTiles.FIRST_PLAYER] = 1
+        piles.append(center)
+        return AzulTiles(piles)
+
+    def discard(self, color: int, count: int) -> None:
+        """
+
+        :param color: the color of the discarded tiles
+        :param count: the number of discarded tiles
+        """
+        self.lid[color] += count
+
+
+@dataclass(frozen=True)
+class AzulGameResult:
+    """ The end of a complete game of Azul """
+
+    scores: tuple
+    """ the final score of each player """
+    winners: tuple[int, ...]
+    """ the players with the highest score (ties are broken by complete rows, and may still be shared) """
+    rounds: int
+    """ the number of rounds played """
+    moves: Optional[tuple[tuple[AzulMove, ...], ...]] = None
+    """ the moves of each round (None for compact games) """
+
+
+class AzulGame:
+    """
+    Plays a complete game of Azul: the factories are filled from a seeded bag (refilled from the lid),
+    the player taking the first player tile starts the next round, and the game ends after the round
+    in which a player completes a row of their wall.
+
+    Each player has a policy, which is called with the AzulState of the round (whose tiles and boards belong to the game)
+    and a random number generator, and returns the AzulMove to make.
+    """
+
+    def __init__(self, policies: Sequence[Callable], seed: Optional[int] = None, compact: bool = False) -> None:
+        """
+
+        :param policies: the policy of each player (two to four players)
+        :param seed: the seed for the bag and the policies
+        :param compact: if True, scores are plain integers and the moves are not recorded, which is much faster
+        """
+        assert 2 <= len(policies) <= AzulZobrist.MAX_PLAYERS
+        self._policies = tuple(policies)
+        self._rng = random.Random(seed)
+        self._compact = compact
+        self._bag = AzulBag(self._rng)
+        with self._numeric_backend():
+            self._boards = tuple(AzulBoard(player) for player in range(self.players))
+        self._first_player = 0
+        self._rounds: list[tuple[AzulMove, ...]] = []
+        self._game_over = False
+        self._result: Optional[AzulGameResult] = None
+
+    @property
+    def players(self) -> int:
+        return len(self._policies)
+
+    @property
+    def boards(self) -> tuple[AzulBoard, ...]:
+        return self._boards
+
+    @property
+    def bag(self) -> AzulBag:
+        return self._bag
+
+    @property
+    def first_player(self) -> int:
+        """ the player who starts the next round """
+        return self._first_player
+
+    def _numeric_backend(self):
+        """ compact games keep their scores as plain integers """
+        return numeric_backend("fraction") if self._compact else nullcontext()
+
+    def play(self) -> AzulGameResult:
+        """
+
+        :return: the result of playing the rest of the game (which is only played once)
+        """
+        if self._result is None:
+            while not self._game_over:
+                self.play_round()
+            self._result = self.result()
+        return self._result
+
+    def play_round(self) -> bool:
+        """
+
+        :return: True if the game is over
+        """
+        if not self._game_over:
+            with self._numeric_backend():
+                self._game_over = self._play_round()
+        return self._game_over
+
+    def _play_round(self) -> bool:
+        """
+
+        :return: True if the game is over
+        """
+        tiles = self._bag.fill(AzulTiles.pile_count(self.players) - 1)
+        # the tiles of each color in the piles, leaving out the first player tile (which comes last)
+        drawn = [sum(counts) for counts in zip(*tiles.piles)][:AzulTiles.FIRST_PLAYER]
+        remaining = sum(drawn)
+        if remaining == 0:
+            # every tile is on a wall or a pattern line, so the game cannot continue
+            for board in self._boards:
+                board.score_game()
+            return True
+
+        # every tile taken this round that is not left on a pattern line is broken, and so goes to the lid,
+        # which is cheaper to count once a round than to follow move by move
+        discarded = drawn
+        for board in self._boards:
+            for pattern in board.patterns:
+                if pattern.count:
+                    discarded[pattern.color] += pattern.count
+
+        record = not self._compact
+        policies, rng = self._policies, self._rng
+        state = AzulState(self._first_player, tiles, self._boards, policies)
+        moves = []
+        while remaining > 0:
+            player = state.player
+            move = policies[player](state, rng)
+            if state.advance(move, record):
+                self._first_player = player
+            remaining -= move.count
+            if record:
+                moves.append(move)
+
+        for board in self._boards:
+            for pattern in board.patterns:
+                if pattern.count:
+                    # a completed pattern line leaves one tile on the wall
+                    discarded[pattern.color] -= 1 if pattern.count == pattern.capacity else pattern.count
+            board._score_round()
+        for color in AzulTiles.COLORS:
+            self._bag.discard(color, discarded[color])
+        self._rounds.append(tuple(moves))
+
+        if not any(
+            board.wall_tiles & mask == mask for board in self._boards for mask in AzulBoard.ROW_MASKS
+        ):
+            return False
+        for board in self._boards:
+            board.score_game()
+        return True
+
+    def result(self) -> AzulGameResult:
+        """
+
+        :return: the result of the game as it stands
+        """
+        def rows(board: AzulBoard) -> int:
+            return sum(1 for mask in AzulBoard.ROW_MASKS if board.wall_tiles & mask == mask)
+
+        best = max((board.score, rows(board)) for board in self._boards)
+        winners = tuple(board.player for board in self._boards if (board.score, rows(board)) == best)
+        return AzulGameResult(
+            tuple(board.score for board in self._boards),
+            winners,
+            len(self._rounds),
+            None if self._compact else tuple(self._rounds),
+        )
+
+    @property
+    def outcome(self) -> GameOutcome:
+        """ the share of the win of each player, so that games can be played with run_rollouts() """
+        result = self.play()
+        share = backend().rational(1, len(result.winners))
+        payoffs = tuple(share if player in result.winners else backend().integer(0) for player in range(self.players))
+        return GameOutcome(payoffs, ())
+
+    @staticmethod
+    def win_rates(
+        policies: Sequence[Callable],
+        games: int,
+        seed: Optional[int] = None,
+        workers: Optional[int] = None,
+        batch_size: int = 1_000,
+    ) -> RolloutSummary:
+        """
+        Plays compact games with run_rollouts(), so the results with a seed do not depend on the number of workers.
+
+        :param policies: the policy of each player
+        :param games: the number of games to play
+        :param seed: the seed for the games
+        :param workers: the number of worker processes (None plays the games in this process)
+        :param batch_size: the number of games in each batch
+        :return: the win rate of each player (ties are shared) with its standard error
+        """
+        def new_game() -> AzulGame:
+            return AzulGame(policies, random.getrandbits(64), compact=True)
+
+        return run_rollouts(new_game, games, batch_size, workers, seed)
+
+    @staticmethod
+    def random_policy(state: AzulState, rng: random.Random) -> AzulMove:
+        """
+
+        :return: a move chosen uniformly at random
+        """
+        picks = state.picks()
+        # rng.random() is much cheaper than rng.choice() and rng.randrange(), and as uniform for so few choices
+        factory, color, count = picks[int(rng.random() * len(picks))]
+        return AzulMove.shared(color, count, factory, int(rng.random() * AzulBoard.ROW_COUNT))
+
+    @staticmethod
+    def greedy_policy(state: AzulState, rng: random.Random) -> AzulMove:
+        """
+        Places as many tiles as possible on the pattern lines while breaking as few as possible,
+        preferring moves that complete a pattern line, with ties chosen at random.
+
+        :return: the chosen move
+        """
+        board = state.boards[state.player]
+        wall = board.wall_tiles
+        patterns = board.patterns
+        # the room on each pattern line for each color (0 where the color cannot go), and the most room
+        rooms: list[Optional[list[int]]] = [None for _ in AzulTiles.COLORS]
+        most_room = [0 for _ in AzulTiles.COLORS]
+        best_picks: list[tuple[int, int, int]] = []
+        best_value = None
+        for pick in state.picks():
+            color, count = pick[1], pick[2]
+            if rooms[color] is None:
+                color_rooms = rooms[color] = [
+                    pattern.capacity - pattern.count
+                    if pattern.color in (AzulTiles.EMPTY, color) and not wall >> (5 * row + (color + row) % 5) & 1
+                    else 0
+                    for row, pattern in enumerate(patterns)
+                ]
+                most_room[color] = max(color_rooms)
+            # twice the difference of the tiles placed and the tiles broken, plus 1 for completing a pattern line
+            most = most_room[color]
+            if most == 0:
+                value = -2 * count
+            elif count >= most:
+                value = 4 * most - 2 * count + 1
+            else:
+                value = 2 * count + (count in rooms[color])  # type: ignore[operator]
+            if best_value is None or value > best_value:
+                best_picks, best_value = [pick], value
+            elif value == best_value:
+                best_picks.append(pick)
+
+        # every tied pick and row is equally likely
+        assert best_value is not None
+        complete = best_value % 2 == 1
+        moves = []
+        for factory, color, count in best_picks:
+            row_rooms = rooms[color]
+            assert row_rooms is not None
+            fit = min(count, most_room[color])
+            for row, room in enumerate(row_rooms):
+                if (room == fit) if complete else (room > fit or fit == 0):
+                    moves.append((factory, color, count, row))
+        factory, color, count, row = moves[int(rng.random() * len(moves))]
+        return AzulMove.shared(color, count, factory, row)
+
+    @staticmethod
+    def search_policy(strategies: tuple[Callable, ...]) -> Callable:
+        """
+        Searching from early in a round is expensive, so this is best used with a bounded strategy
+        (such as mcts_strategy) or near the end of a round.
+
+        :param strategies: the GameState strategies of every player, used to search to the end of the round
+        :return: a policy that makes the first move of the outcome of the round
+        """
+        def searching_policy(state: AzulState, rng: random.Random) -> AzulMove:
+            searched = AzulState(state.player, copy.deepcopy(state.tiles), copy.deepcopy(state.boards), strategies)
+            moves = searched.outcome.moves
+            assert moves and isinstance(moves[0], AzulMove)
+            return moves[0]
+
+        return searching_policy
+
+    @staticmethod
+    def deepening_policy(time_budget: float = 0.1, max_depth: Optional[int] = None) -> Callable:
+        """
+        Searches deeper until the time budget runs out, scoring the states before the end of the round
+        with AzulState.heuristic_evaluation(), so it answers in about the same time from any point in the round.
+
+        :param time_budget: the number of seconds to search for each move
+        :param max_depth: the deepest search to try (None for no limit)
+        :return: a policy that makes the first move of the best line found
+        """
+        strategy = GameState.iterative_deepening_strategy(
+            AzulState.rank, AzulState.heuristic_evaluation, time_budget, max_depth
+        )
+
+        def deepening(state: AzulState, rng: random.Random) -> AzulMove:
+            searched = AzulState(
+                state.player, copy.deepcopy(state.tiles), copy.deepcopy(state.boards), (strategy,) * state.players
+            )
+            moves = strategy(searched).moves
+            assert moves and isinstance(moves[0], AzulMove)
+            return moves[0]
+
+        return deepening
+
+
 def main():
 
     def make_state(strategies) -> AzulState:
@@ -746,55 +2066,42 @@ def main():
     print(f"Tiles: {state.tiles}\n")
     print("RUNNING MONTE CARLO GAMES")
 
-    blue_sum = (0, 0)
-    red_sum = (0, 0)
-    cyan_sum = (0, 0)
-    total_trials = 1_000
-    for _ in range(total_trials):
-
-        state = make_state(
+    def make_monte_carlo_state(color: int) -> AzulState:
+        mc_state = make_state(
             (
                 AzulState.rational_strategy(AzulState.rank),
                 AzulState.monte_carlo_strategy(sample_weights),
             )
         )
+        mc_state.tiles.piles[AzulTiles.CENTER_PILE][color] = 0
+        if color == AzulTiles.BLUE:
+            mc_state.boards[0].patterns[0] = AzulBoard.PatternLine(1, AzulTiles.BLUE, 1)
+            mc_state.boards[0].broken_tiles += 2
+        elif color == AzulTiles.RED:
+            mc_state.boards[0].patterns[4] = AzulBoard.PatternLine(5, AzulTiles.RED, 4)
+        else:
+            mc_state.boards[0].patterns[1] = AzulBoard.PatternLine(2, AzulTiles.CYAN, 1)
+        mc_state.player = 1
+        return mc_state
 
-        # try blue
-        blue_state = copy.deepcopy(state)
-        blue_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.BLUE] = 0
-        blue_state.boards[0].patterns[0] = AzulBoard.PatternLine(1, AzulTiles.BLUE, 1)
-        blue_state.boards[0].broken_tiles += 2
-        blue_state.player = 1
-        blue_outcome = blue_state.outcome
-        blue_sum = tuple(blue_sum[i] + blue_outcome.payoffs[i] for i in range(2))
-
-        # try red
-        red_state = copy.deepcopy(state)
-        red_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.RED] = 0
-        red_state.boards[0].patterns[4] = AzulBoard.PatternLine(5, AzulTiles.RED, 4)
-        red_state.boards[0].broken_tiles += 0
-        red_state.player = 1
-        red_outcome = red_state.outcome
-        red_sum = tuple(red_sum[i] + red_outcome.payoffs[i] for i in range(2))
-
-        # try cyan
-        cyan_state = copy.deepcopy(state)
-        cyan_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.CYAN] = 0
-        cyan_state.boards[0].patterns[1] = AzulBoard.PatternLine(2, AzulTiles.CYAN, 1)
-        cyan_state.boards[0].broken_tiles += 0
-        cyan_state.player = 1
-        cyan_outcome = cyan_state.outcome
-        cyan_sum = tuple(cyan_sum[i] + cyan_outcome.payoffs[i] for i in range(2))
+    total_trials = 1_000
+    blue_summary = run_rollouts(lambda: make_monte_carlo_state(AzulTiles.BLUE), total_trials)
+    red_summary = run_rollouts(lambda: make_monte_carlo_state(AzulTiles.RED), total_trials)
+    cyan_summary = run_rollouts(lambda: make_monte_carlo_state(AzulTiles.CYAN), total_trials)
 
     print("END OF MONTE CARLO GAMES")
 
-    blue_average = tuple(blue_sum[i] / total_trials for i in range(2))
-    red_average = tuple(red_sum[i] / total_trials for i in range(2))
-    cyan_average = tuple(cyan_sum[i] / total_trials for i in range(2))
+    print(f"Expected Blue Payoff: {blue_summary.means[0] - blue_summary.means[1]} ≈ 2")
+    print(f"Expected Red Payoff: {red_summary.means[0] - red_summary.means[1]} ≈ 3.2")
+    print(f"Expected Cyan Payoff: {cyan_summary.means[0] - cyan_summary.means[1]} ≈ 3.4")
+
+    # FULL GAMES ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    print(f"Expected Blue Payoff: {1.0*blue_average[0] - blue_average[1]} ≈ 2")
-    print(f"Expected Red Payoff: {1.0*red_average[0] - red_average[1]} ≈ 3.2")
-    print(f"Expected Cyan Payoff: {1.0*cyan_average[0] - cyan_average[1]} ≈ 3.4")
+    print("")
+    print("~~ START OF FULL GAMES " + 10 * "~")
+    print(AzulGame((AzulGame.greedy_policy, AzulGame.random_policy), seed=0).play())
+    print(AzulGame.win_rates((AzulGame.greedy_policy, AzulGame.greedy_policy), 1_000, seed=0))
+    print("END OF FULL GAMES")
 
 
 if __name__ == "__main__":
@@ -1,12 +1,21 @@
+import numpy as np
 import sympy as sp
+import json
+import math
 import random
-import copy
-from typing import Callable, Optional, Generator
+import time
+import itertools as it
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Hashable, Iterator, Optional, Generator
 from dataclasses import dataclass
 
 from icecream import ic  # type: ignore
 
-from util.debug import checkup
+from util.debug import TRACE_DETAIL, TRACE_INFO, checkup, trace
+from mwmath.numeric import FRACTION, backend
 
 ic.disable()
 
@@ -27,6 +36,271 @@ class GameOutcome:
         return f"Payoffs: {self.payoffs}\nMoves: {self.moves}"
 
 
+class TranspositionTable:
+    """
+    A size-bounded cache of outcomes keyed by GameState.key, shared between the states of a search.
+
+    Only the moves made after the position are stored, so a position reached by a different sequence of moves
+    reuses the stored result with its own history prepended.
+    The outcome of a position depends on the strategies of every player,
+    so a table should only be shared by states using the same strategies.
+    """
+
+    def __init__(self, max_size: Optional[int] = 1_000_000) -> None:
+        """
+
+        :param max_size: the number of positions to keep before evicting the least recently used (None is unbounded)
+        """
+        self._max_size = max_size
+        self._entries: OrderedDict[Hashable, tuple[tuple[sp.Rational, ...], tuple[GameMove, ...]]] = OrderedDict()
+        self.hits = 0
+        """ the number of lookups that found a stored outcome """
+        self.misses = 0
+        """ the number of lookups that did not find a stored outcome """
+
+    def __repr__(self) -> str:
+        return f"TranspositionTable: {len(self)} of {self._max_size} positions, {self.hits} hits, {self.misses} misses"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def max_size(self) -> Optional[int]:
+        return self._max_size
+
+    def clear(self) -> None:
+        """ removes all stored outcomes and resets the counters """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, state: "GameState") -> Optional[GameOutcome]:
+        """
+
+        :param state: the state whose outcome we want
+        :return: the stored outcome for the state's position (with the state's history), or None if there is none
+        """
+        key = state.key
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if _SEARCH_STATS is not None:
+            _SEARCH_STATS.transposition_hits += 1
+        self._entries.move_to_end(key)
+        payoffs, continuation = entry
+        history = state.history if state.history else ()
+        return GameOutcome(payoffs, history + continuation)
+
+    def store(self, state: "GameState", outcome: GameOutcome) -> None:
+        """
+
+        :param state: the state whose outcome is being stored
+        :param outcome: the outcome of that state (its moves must begin with the state's history)
+        """
+        key = state.key
+        history = state.history if state.history else ()
+        moves = outcome.moves if outcome.moves else ()
+        assert moves[:len(history)] == history
+        self._entries[key] = (outcome.payoffs, moves[len(history):])
+        self._entries.move_to_end(key)
+        if self._max_size is not None and len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def outcome(self, state: "GameState") -> GameOutcome:
+        """
+
+        :param state: the state whose outcome we want
+        :return: the stored outcome of the state if there is one, otherwise state.outcome (which is then stored)
+        """
+        outcome = self.lookup(state)
+        if outcome is None:
+            outcome = state.outcome
+            self.store(state, outcome)
+        return outcome
+
+
+# region Search Statistics
+
+class SearchStats:
+    """
+    Counts the work done by a search, collected within search_stats().
+
+    Statistics are collected by outcome, evaluate(), outcome_iteratively(), and the strategies returned by
+    rational_strategy, bayesian_strategy, and alphabeta_strategy. Work done in other processes is not collected,
+    but parallel_outcome() counts the plies it splits among them.
+    Depths are counted in plies from the shallowest state visited,
+    and the time at a depth includes the time spent searching below it.
+    """
+
+    def __init__(self) -> None:
+        self.nodes: dict[int, int] = {}
+        """ the number of states visited (not found in a stash or table) after each number of moves """
+        self.seconds: dict[int, float] = {}
+        """ the time spent evaluating the states after each number of moves """
+        self.terminal_evaluations = 0
+        """ the number of calls to compute_outcome() """
+        self.stash_hits = 0
+        """ the number of times outcome returned a stashed outcome """
+        self.transposition_hits = 0
+        """ the number of times a TranspositionTable returned a stored outcome """
+        self.expanded = 0
+        """ the number of states whose branches were searched """
+        self.branches = 0
+        """ the number of branches searched from those states """
+        self.elapsed = 0.0
+        """ the time spent within search_stats() """
+        self.labels: dict[str, Any] = {}
+        """ settings reported by the games being searched (like how they select moves) """
+        self.counters: dict[str, int] = {}
+        """ other counts reported by the games being searched """
+
+    def __repr__(self) -> str:
+        return f"SearchStats: {sum(self.nodes.values())} nodes, {self.terminal_evaluations} terminal"
+
+    def visit(self, state: "GameState") -> int:
+        """
+
+        :param state: a state being evaluated
+        :return: the number of moves in its history
+        """
+        ply = len(state.history) if state.history else 0
+        self.nodes[ply] = self.nodes.get(ply, 0) + 1
+        return ply
+
+    def timed(self, ply: int, start: float) -> None:
+        """
+
+        :param ply: the number of moves in the history of the state that was evaluated
+        :param start: the time.perf_counter() when its evaluation started
+        """
+        self.seconds[ply] = self.seconds.get(ply, 0.0) + time.perf_counter() - start
+
+    def label(self, name: str, value: Any) -> None:
+        """
+
+        :param name: the name of a setting used by the search
+        :param value: its value (which should be JSON serializable)
+        """
+        self.labels[name] = value
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+
+        :param name: the name of the counter
+        :param amount: the amount to add to it
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def expand(self, branches: int) -> None:
+        """
+
+        :param branches: the number of branches searched from a state
+        """
+        self.expanded += 1
+        self.branches += branches
+
+    def evaluate(self, state: "GameState") -> GameOutcome:
+        """
+        GameState.evaluate() while collecting statistics
+
+        :param state: the state to evaluate
+        :return: the outcome of the state
+        """
+        ply = self.visit(state)
+        start = time.perf_counter()
+        if state.game_over:
+            self.terminal_evaluations += 1
+            outcome = state.compute_outcome()
+        else:
+            outcome = state.strategies[state.player](state)
+        self.timed(ply, start)
+        return outcome
+
+    def count_branches(self, branch_outcomes: Iterator) -> Generator:
+        """
+
+        :param branch_outcomes: the branches of a state
+        :return: the same branches, which are counted once they have all been searched
+        """
+        branches = 0
+        for branch_outcome in branch_outcomes:
+            branches += 1
+            yield branch_outcome
+        self.expand(branches)
+
+    @property
+    def branching_factor(self) -> float:
+        """ the average number of branches searched from the states which were expanded """
+        return self.branches / self.expanded if self.expanded else 0.0
+
+    def report(self) -> dict:
+        """
+
+        :return: the statistics as a dictionary which can be written as JSON
+        """
+        root = min(self.nodes, default=0)
+        return {
+            "elapsed_seconds": self.elapsed,
+            "nodes": sum(self.nodes.values()),
+            "nodes_per_depth": {str(ply - root): self.nodes[ply] for ply in sorted(self.nodes)},
+            "seconds_per_depth": {str(ply - root): self.seconds[ply] for ply in sorted(self.seconds)},
+            "terminal_evaluations": self.terminal_evaluations,
+            "stash_hits": self.stash_hits,
+            "transposition_hits": self.transposition_hits,
+            "expanded_nodes": self.expanded,
+            "average_branching_factor": self.branching_factor,
+            "labels": dict(self.labels),
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """
+
+        :param indent: passed to json.dumps
+        :return: the report as JSON
+        """
+        return json.dumps(self.report(), indent=indent)
+
+
+_SEARCH_STATS: Optional[SearchStats] = None
+""" the statistics being collected, or None when they are not (which keeps the search loops cheap) """
+
+
+def active_search_stats() -> Optional[SearchStats]:
+    """
+
+    :return: the statistics being collected, or None outside of search_stats()
+    """
+    return _SEARCH_STATS
+
+
+@contextmanager
+def search_stats() -> Iterator[SearchStats]:
+    """
+    Collects statistics for the searches within the context:
+
+        with search_stats() as stats:
+            state.outcome
+        print(stats.to_json())
+
+    :return: the statistics (complete once the context exits)
+    """
+    global _SEARCH_STATS
+    previous = _SEARCH_STATS
+    stats = SearchStats()
+    _SEARCH_STATS = stats
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.elapsed = time.perf_counter() - start
+        _SEARCH_STATS = previous
+
+# endregion
+
+
 class GameState:
     """ Abstract class representing the state of a game. """
 
@@ -48,7 +322,10 @@ class GameState:
         self._strategies = strategies
         self._history = history if history else ()
         self._stashed_outcome: Optional[GameOutcome] = None
-        self._stashed_hash: Optional[int] = None
+        self._stashed_key: Optional[Hashable] = None
+        self._stashed_history: Optional[tuple[GameMove, ...]] = None
+        self._key: Optional[Hashable] = None
+        self._in_place = False
 
     @checkup
     def __repr__(self) -> str:
@@ -64,6 +341,29 @@ class GameState:
     def hash(self) -> int:
         return hash((self._player, self._strategies, self._history))
 
+    def position_key(self) -> Hashable:
+        """ Subclasses can override this with a key that the same position reached by other moves shares.
+
+        :return: a key identifying the position (by default, the player to move and the history leading to it)
+        """
+        return self.player, self.history
+
+    @property
+    def key(self) -> Hashable:
+        """
+        The position key is computed by position_key() when first needed, and then kept up to date by apply() and undo().
+        It is used to check the stashed outcome and as the key in a TranspositionTable.
+
+        :return: a key identifying the position (but not the history leading to it)
+        """
+        if self._key is None:
+            self._key = self.position_key()
+        return self._key
+
+    def invalidate_key(self) -> None:
+        """ This needs to be called after changing the position other than through apply(), undo() or player. """
+        self._key = None
+
     # endregion
 
     # region debugging
@@ -91,8 +391,9 @@ class GameState:
         """ the current player in the game is mutable """
         assert player < self.players
         self._player = player
-        # invalidate the stashed_outcome
+        # invalidate the stashed_outcome and the key
         self._stashed_outcome = None
+        self._key = None
 
     @property
     def strategies(self) -> tuple[Callable, ...]:
@@ -104,29 +405,176 @@ class GameState:
         """ the history of moves that lead to this state in the game """
         return self._history
 
+    @property
+    def in_place(self) -> bool:
+        """ True while outcome_in_place() is walking the game tree with apply() and undo() """
+        return self._in_place
+
     @property
     def outcome(self) -> GameOutcome:
         """
-        This assumes that if hash(self) has not changed, then the outcome has not changed.
-        To protect against hash collisions, users can call clear_stashed_outcome() before calling outcome()
+        This assumes that if the key and the history have not changed, then the outcome has not changed.
+        After changing the state other than through apply(), undo() or player,
+        and to protect against key collisions, users can call clear_stashed_outcome() before calling outcome()
 
         :return: the outcome of this game using the strategies
         """
-        if self._stashed_outcome and self._stashed_hash == self.hash():
+        key = self.key
+        if (
+            self._stashed_outcome
+            and self._stashed_key == key
+            and (self._stashed_history is self._history or self._stashed_history == self._history)
+        ):
+            if _SEARCH_STATS is not None:
+                _SEARCH_STATS.stash_hits += 1
             return self._stashed_outcome
-        elif self.game_over:
-            self._stashed_outcome = self.compute_outcome()
-        else:
-            self._stashed_outcome = self.strategies[self.player](self)
+        self._stashed_outcome = self.evaluate()
 
-        self._stashed_hash = self.hash()
+        self._stashed_key = self.key
+        self._stashed_history = self._history
         assert self._stashed_outcome is not None
         return self._stashed_outcome
 
     def clear_stashed_outcome(self) -> None:
-        """ This can be called to clear out the stashed outcome before calling outcome
-        to protect against hash collisions. """
+        """ This can be called to clear out the stashed outcome (and the key) before calling outcome,
+        after changing the state or to protect against key collisions. """
         self._stashed_outcome = None
+        self._key = None
+
+    def outcome_in_place(self) -> GameOutcome:
+        """
+        Computes the outcome by making and unmaking moves on this state rather than copying it for each branch.
+        The state is unchanged afterward, and the outcome is not stashed.
+
+        :return: the outcome of this game using the strategies
+        """
+        was_in_place = self._in_place
+        self._in_place = True
+        try:
+            return self.evaluate()
+        finally:
+            self._in_place = was_in_place
+
+    def evaluate(self) -> GameOutcome:
+        """
+
+        :return: the outcome of this game using the strategies, computed without stashing it
+        """
+        if _SEARCH_STATS is not None:
+            return _SEARCH_STATS.evaluate(self)
+        if self.game_over:
+            return self.compute_outcome()
+        return self.strategies[self.player](self)
+
+    def branch_outcomes(self, table: Optional[TranspositionTable] = None) -> Generator:
+        """
+        The strategies use this to evaluate the branches, so they work whether or not the search is in place.
+
+        :param table: a table used to reuse the outcomes of transposed positions
+        :return: the move and the outcome of each branch from this state
+        """
+        if _SEARCH_STATS is not None:
+            return _SEARCH_STATS.count_branches(self._branch_outcomes(table))
+        return self._branch_outcomes(table)
+
+    def _branch_outcomes(self, table: Optional[TranspositionTable]) -> Generator:
+        """
+
+        :param table: a table used to reuse the outcomes of transposed positions
+        :return: the move and the outcome of each branch from this state
+        """
+        if not self._in_place:
+            for branch in self.branch_states:
+                yield branch.history[-1], branch.outcome if table is None else table.outcome(branch)
+            return
+
+        def move_outcomes() -> Generator:
+            for move in self.moves:
+                self.apply(move)
+                outcome = None if table is None else table.lookup(self)
+                if outcome is None:
+                    outcome = self.evaluate()
+                    if table is not None:
+                        table.store(self, outcome)
+                self.undo(move)
+                yield move, outcome
+
+        if not self.groups_moves:
+            yield from move_outcomes()
+        else:
+            player = self.player
+            for _, group_outcomes in it.groupby(move_outcomes(), key=lambda mo: self.move_group(mo[0])):
+                yield max(group_outcomes, key=lambda mo: self.group_rank(player, mo[1]))
+
+    def outcome_iteratively(self) -> GameOutcome:
+        """
+        Computes the outcome with an explicit stack rather than recursion, so the depth of the game is unlimited.
+        Players using rational_strategy or bayesian_strategy are evaluated on the stack with the same results,
+        while any other strategy is called as usual.
+        States that implement the in-place protocol are searched in place, others through branch_states.
+        The outcome is not stashed.
+
+        :return: the outcome of this game using the strategies
+        """
+        return _evaluate_iteratively(self)
+
+    def parallel_outcome(self, rank: Callable, workers: Optional[int] = None, second_ply: bool = False) -> GameOutcome:
+        """
+        Computes the outcome of the branches in a pool of worker processes, then takes the optimal branch
+        as rational_strategy(rank) would. With second_ply, each branch's player also takes the optimal
+        of its own branches (using rank), and those branches are computed in the workers instead.
+        Below that, the branches are computed with the players' strategies as usual
+        (in place when the state implements the in-place protocol).
+
+        The outcomes are gathered in the order the branches are generated, so the result does not depend on
+        the number of workers. The workers are forked from this process, so this needs the "fork" start method.
+
+        :param rank: the function ranking the outcomes for a player
+        :param workers: the number of worker processes (None uses every cpu)
+        :param second_ply: True to spread the branches of the branches across the workers
+        :return: the outcome of this game using the strategies below the parallel plies
+        """
+        assert not self.game_over
+        # the plies split among the workers are expanded here, so they are counted here (unlike the workers' work)
+        stats = _SEARCH_STATS
+        paths: list[tuple[int, ...]] = []
+        branch_players: list[int] = []
+        for index in range(_parallel_branch_count(self)):
+            branch = _parallel_branch(self, index)
+            branch_players.append(branch.player)
+            if not second_ply or branch.game_over:
+                paths.append((index,))
+            else:
+                second_count = _parallel_branch_count(branch)
+                paths.extend((index, second) for second in range(second_count))
+                if stats is not None:
+                    stats.expand(second_count)
+            _parallel_return(self, branch)
+        if stats is not None:
+            stats.expand(len(branch_players))
+
+        global _PARALLEL_ROOT
+        _PARALLEL_ROOT = self
+        try:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                chunksize = max(1, len(paths) // (4 * (workers or multiprocessing.cpu_count())))
+                outcomes = list(executor.map(_parallel_path_outcome, paths, chunksize=chunksize))
+        finally:
+            _PARALLEL_ROOT = None
+
+        branch_outcomes: list[GameOutcome] = []
+        for index, path_outcomes in it.groupby(zip(paths, outcomes), key=lambda po: po[0][0]):
+            path_outcome_list = list(path_outcomes)
+            if len(path_outcome_list[0][0]) == 1:
+                branch_outcomes.append(path_outcome_list[0][1])
+            else:
+                branch_player = branch_players[index]
+                branch_outcomes.append(
+                    max((outcome for _, outcome in path_outcome_list), key=lambda o: rank(branch_player, o))
+                )
+        trace(TRACE_INFO, "{} paths computed by {} workers", len(paths), workers or multiprocessing.cpu_count())
+        return max(branch_outcomes, key=lambda o: rank(self.player, o))
 
     # end region
 
@@ -157,48 +605,188 @@ class GameState:
 
     # endregion
 
+    # region In-place Protocol
+
+    @property
+    def moves(self) -> Generator:
+        """ Subclasses that can be searched in place need to override this to yield the legal moves.
+
+        :return: the next move that can be made from this state
+        """
+        raise NotImplementedError
+
+    def apply(self, move: GameMove) -> None:
+        """ Subclasses that can be searched in place need to override this to make the move,
+        updating the player, appending the move to the history, and updating (or invalidating) the key.
+
+        :param move: one of the moves yielded by moves
+        """
+        raise NotImplementedError
+
+    def undo(self, move: GameMove) -> None:
+        """ Subclasses that can be searched in place need to override this to unmake the most recently applied move
+        (restoring the key).
+
+        :param move: the move most recently passed to apply()
+        """
+        raise NotImplementedError
+
+    @property
+    def groups_moves(self) -> bool:
+        """
+        Subclasses can override this to return True so that a branch of an in-place search is a group of
+        consecutive moves (sharing a move_group), with the group's optimal move (by group_rank) made for the player.
+        This lets moves be generated more finely than branch_states, which makes that choice within a single branch.
+        """
+        return False
+
+    def move_group(self, move: GameMove) -> Hashable:
+        """ Subclasses that group their moves need to override this.
+
+        :param move: a move yielded by moves
+        :return: the key shared by the moves in a group
+        """
+        raise NotImplementedError
+
+    def group_rank(self, player: int, outcome: GameOutcome):
+        """ Subclasses that group their moves need to override this to rank the outcomes of the moves in a group.
+
+        :param player: the player choosing the move within the group
+        :param outcome: the outcome of a move in the group
+        :return: the rank of the outcome for the player
+        """
+        raise NotImplementedError
+
+    @property
+    def searchable_in_place(self) -> bool:
+        """ True if this state implements the in-place protocol """
+        return type(self).apply is not GameState.apply
+
+    # endregion
+
     @staticmethod
-    def rational_strategy(rank: Callable) -> Callable:
+    def rational_strategy(rank: Callable, table: Optional[TranspositionTable] = None) -> Callable:
+        """
 
-        def ranked_strategy(state: GameState) -> GameOutcome:
-            """
+        :param rank: the function ranking the outcomes for a player
+        :param table: a table shared by the strategies to reuse the outcomes of transposed positions
+        :return: the rational strategy
+        """
+        return RationalStrategy(rank, table)
 
-            :return: the outcome resulting from taking the rational max-min strategy
-            """
-            optimal_outcome = max(
-                (branch.outcome for branch in state.branch_states),
-                key=lambda o: rank(state.player, o),
-            )
-            return optimal_outcome
+    @staticmethod
+    def bayesian_strategy(weights: Callable, table: Optional[TranspositionTable] = None) -> Callable:
+        """
 
-        return ranked_strategy
+        :param weights: the probability of choosing each move
+        :param table: a table shared by the strategies to reuse the outcomes of transposed positions
+        :return: the bayesian strategy
+        """
+        return BayesianStrategy(weights, table)
 
     @staticmethod
-    def bayesian_strategy(weights: Callable) -> Callable:
+    def vector_bayesian_strategy(weights: Callable, table: Optional[TranspositionTable] = None) -> Callable:
+        """
+        Finds the outcomes bayesian_strategy(weights) finds, but remembers the outcome of every position it evaluates
+        by key, so identical subtrees reached by different moves are evaluated once,
+        and combines the payoffs of all the branches of a position at once
+        (as sums of Fractions for the exact backends, so the results are identical,
+        and as a product of float arrays for the float backend).
+        The outcomes depend on the strategies of every player, so use a new strategy (or table) for each game.
 
-        def weighted_strategy(state: GameState) -> GameOutcome:
+        :param weights: the probability of choosing each move
+        :param table: the table remembering the outcomes (a new unbounded table by default)
+        :return: the memoized bayesian strategy
+        """
+        return VectorBayesianStrategy(weights, TranspositionTable(None) if table is None else table)
+
+    @staticmethod
+    def alphabeta_strategy(rank: Callable, order: Optional[Callable] = None) -> Callable:
+        """
+        Finds the outcome rational_strategy(rank) finds when every player uses it, but skips the branches
+        that cannot change that outcome. This requires a two-player game whose rank is zero-sum,
+        so that rank(0, outcome) == -rank(1, outcome).
+
+        States that implement the in-place protocol are searched through their moves, otherwise through branch_states.
+        Ties are broken in favor of the first move generated, so the order of the search does not change the outcome.
+
+        :param rank: the function ranking the outcomes for a player
+        :param order: given the state and a list of its moves (or branch states), returns them in the order to search
+        :return: the pruned rational strategy
+        """
+
+        def search(state: GameState, alpha, beta) -> tuple[sp.Rational, GameOutcome]:
             """
 
-            :param state: this is the state of the game before the move
-            :return: the probability that the move would be taken
+            :param state: the state to search
+            :param alpha: the value that the player to move is already guaranteed elsewhere
+            :param beta: the value above which the opponent will avoid this state
+            :return: the value of the state for the player to move and its outcome
+                (exact when the value is from alpha to beta)
             """
-            expected_payoffs = tuple(sp.Integer(0) for _ in range(state.players))
-            for branch in state.branch_states:
-                move = branch.history[-1]
-                expected_payoffs = tuple(
-                    weights(state, move) * branch.outcome.payoffs[p]
-                    + expected_payoffs[p]
-                    for p in range(state.players)
-                )
+            stats = _SEARCH_STATS
+            if state.game_over:
+                if stats is not None:
+                    stats.terminal_evaluations += 1
+                outcome = state.compute_outcome()
+                return rank(state.player, outcome), outcome
+
+            player = state.player
+            in_place = state.searchable_in_place
+            branches = list(state.moves if in_place else state.branch_states)
+            # the position of each branch's move as generated, which breaks ties whatever the order of the search
+            index: dict[GameMove, int] = {}
+            for i, branch in enumerate(branches):
+                index.setdefault(branch if in_place else branch.history[-1], i)
+            if order is not None:
+                branches = list(order(state, branches))
+
+            best_value = None
+            best_index = len(branches)
+            best_outcome = None
+            searched = 0
+            for branch in branches:
+                searched += 1
+                if in_place:
+                    state.apply(branch)
+                    child = state
+                else:
+                    child = branch
+                try:
+                    if stats is not None:
+                        ply, start = stats.visit(child), time.perf_counter()
+                    if child.player == player:
+                        value, outcome = search(child, alpha, beta)
+                    else:
+                        value, outcome = search(child, -beta, -alpha)
+                        value = -value
+                    if stats is not None:
+                        stats.timed(ply, start)
+                finally:
+                    if in_place:
+                        state.undo(branch)
+
+                branch_index = index[branch if in_place else branch.history[-1]]
+                if best_value is None or value > best_value or (value == best_value and branch_index < best_index):
+                    best_value, best_index, best_outcome = value, branch_index, outcome
+                if best_value > beta:
+                    break
+                alpha = max(alpha, best_value)
 
-            if state.history is None:
-                new_history: tuple[GameMove, ...] = (GameMove(),)
-            else:
-                new_history = state.history + (GameMove(),)
+            if stats is not None:
+                stats.expand(searched)
+            assert best_value is not None and best_outcome is not None
+            return best_value, best_outcome
 
-            return GameOutcome(expected_payoffs, new_history)
+        def pruned_strategy(state: GameState) -> GameOutcome:
+            """
 
-        return weighted_strategy
+            :return: the outcome resulting from taking the rational max-min strategy
+            """
+            _, outcome = search(state, -math.inf, math.inf)
+            return outcome
+
+        return pruned_strategy
 
     @staticmethod
     def monte_carlo_strategy(weights: Callable) -> Callable:
@@ -232,6 +820,907 @@ class GameState:
 
         return weighted_strategy
 
+    @staticmethod
+    def random_rollout(state: "GameState") -> GameOutcome:
+        """
+        The default rollout policy for mcts_strategy().
+        States that implement the in-place protocol are played through their moves, and then restored.
+
+        :param state: the state from which to play
+        :return: the outcome of taking uniformly random branches until the game is over
+        """
+        if not state.searchable_in_place:
+            while not state.game_over:
+                state = random.choice(_mcts_branches(state, False))
+            return state.compute_outcome()
+
+        moves = []
+        try:
+            while not state.game_over:
+                move = random.choice(_mcts_branches(state, True))
+                state.apply(move)
+                moves.append(move)
+            return state.compute_outcome()
+        finally:
+            for move in reversed(moves):
+                state.undo(move)
+
+    @staticmethod
+    def mcts_strategy(
+        rank: Callable,
+        iterations: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        exploration: float = math.sqrt(2),
+        rollout: Optional[Callable] = None,
+    ) -> Callable:
+        """
+        Monte Carlo Tree Search, choosing branches by UCT (upper confidence bounds applied to trees).
+        Within the search tree every player is assumed to maximize rank, so the other players' strategies are not used.
+        States that implement the in-place protocol are searched through their moves, otherwise through branch_states.
+
+        The search stops after the given number of iterations or seconds (whichever comes first, but after at least
+        one iteration), so it can be used on trees far too large for rational_strategy.
+
+        :param rank: the function ranking the outcomes for a player (its scale sets the scale for exploration)
+        :param iterations: the number of iterations to search (1000 if neither this nor the time budget is given)
+        :param time_budget: the number of seconds to search
+        :param exploration: the weight of the exploration term in UCT
+        :param rollout: rollout(state) returns the outcome of playing from the state (random_rollout by default),
+            leaving a state searched in place as it was
+        :return: the outcome with the mean payoffs of the most visited branch and the most visited moves in the tree
+        """
+        if iterations is None and time_budget is None:
+            iterations = 1000
+        rollout_policy = GameState.random_rollout if rollout is None else rollout
+
+        def searching_strategy(state: GameState) -> GameOutcome:
+            """
+
+            :param state: this is the state of the game before the move
+            :return: the outcome found by the search
+            """
+            deadline = None if time_budget is None else time.perf_counter() + time_budget
+            in_place = state.searchable_in_place
+            root = _MctsNode(state, None)
+            iteration = 0
+            # the first iteration runs whatever the budget, so that the root has a branch to choose
+            while iteration == 0 or (
+                (iterations is None or iteration < iterations) and (deadline is None or time.perf_counter() < deadline)
+            ):
+                iteration += 1
+                path = []
+                current = state
+                try:
+                    # selection
+                    node = root
+                    while node.expanded and node.children:
+                        node = max(node.children, key=lambda child: child.uct(exploration))
+                        current = node.enter(current, in_place)
+                        path.append(node)
+
+                    # expansion
+                    if not node.game_over:
+                        node, current = node.expand(current, in_place)
+                        path.append(node)
+
+                    # simulation
+                    outcome = rollout_policy(current)
+                finally:
+                    if in_place:
+                        for node in reversed(path):
+                            state.undo(node.branch)
+
+                # backpropagation
+                (path[-1] if path else root).backpropagate(rank, outcome)
+
+            best = max(root.children, key=lambda child: child.visits)
+            line = [best]
+            while line[-1].children:
+                line.append(max(line[-1].children, key=lambda child: child.visits))
+            current = state
+            for node in line:
+                current = node.enter(current, in_place)
+            history = current.history
+            if in_place:
+                for node in reversed(line):
+                    state.undo(node.branch)
+            assert best.payoffs is not None
+            numeric = backend()
+            share = numeric.rational(1, best.visits)
+            payoffs = tuple(share * payoff for payoff in best.payoffs)
+            trace(TRACE_INFO, "{} iterations visit the chosen branch {} times", iteration, best.visits)
+            return GameOutcome(payoffs, history)
+
+        return searching_strategy
+
+    @staticmethod
+    def depth_limited_strategy(
+        rank: Callable,
+        evaluation: Callable,
+        depth: int,
+        order: Optional[Callable] = None,
+    ) -> Callable:
+        """
+        Searches depth moves ahead as rational_strategy(rank) would, then scores the states that are not over
+        with the evaluation rather than searching to the end of the game.
+        Within the search every player is assumed to maximize rank, so the other players' strategies are not used.
+
+        :param rank: the function ranking the outcomes for a player
+        :param evaluation: evaluation(state) returns the estimated payoffs of a state whose game is not over
+        :param depth: the number of moves to search
+        :param order: given the state and a list of its moves (or branch states), returns them in the order to search
+        :return: the outcome with the (estimated) payoffs and the moves of the best line found
+        """
+        return DepthLimitedStrategy(rank, evaluation, depth=depth, order=order)
+
+    @staticmethod
+    def iterative_deepening_strategy(
+        rank: Callable,
+        evaluation: Callable,
+        time_budget: float,
+        max_depth: Optional[int] = None,
+        order: Optional[Callable] = None,
+    ) -> Callable:
+        """
+        Repeats depth_limited_strategy() one move deeper each time until the time budget runs out,
+        searching the best move so far first. When the time runs out during a search, its result is used
+        if the best move so far was searched again, otherwise the result of the previous search is used.
+        The first search (one move deep) always finishes, and the search stops early when it reaches the end of the game.
+
+        :param rank: the function ranking the outcomes for a player
+        :param evaluation: evaluation(state) returns the estimated payoffs of a state whose game is not over
+        :param time_budget: the number of seconds to search
+        :param max_depth: the deepest search to try (None for no limit)
+        :param order: given the state and a list of its moves (or branch states), returns them in the order to search
+        :return: the outcome with the (estimated) payoffs and the moves of the best line found
+        """
+        return DepthLimitedStrategy(rank, evaluation, depth=max_depth, time_budget=time_budget, order=order)
+
+
+# region Strategies
+
+class RationalStrategy:
+    """ The strategy returned by GameState.rational_strategy() """
+
+    def __init__(self, rank: Callable, table: Optional[TranspositionTable] = None) -> None:
+        """
+
+        :param rank: the function ranking the outcomes for a player
+        :param table: a table shared by the strategies to reuse the outcomes of transposed positions
+        """
+        self.rank = rank
+        self.table = table
+
+    def __call__(self, state: GameState) -> GameOutcome:
+        """
+
+        :return: the outcome resulting from taking the rational max-min strategy
+        """
+        optimal_outcome = max(
+            (outcome for _, outcome in state.branch_outcomes(self.table)),
+            key=lambda o: self.rank(state.player, o),
+        )
+        trace(TRACE_DETAIL, "{}: chooses payoffs {}", state.player, optimal_outcome.payoffs)
+        return optimal_outcome
+
+
+class BayesianStrategy:
+    """ The strategy returned by GameState.bayesian_strategy() """
+
+    def __init__(self, weights: Callable, table: Optional[TranspositionTable] = None) -> None:
+        """
+
+        :param weights: the probability of choosing each move
+        :param table: a table shared by the strategies to reuse the outcomes of transposed positions
+        """
+        self.weights = weights
+        self.table = table
+
+    def __call__(self, state: GameState) -> GameOutcome:
+        """
+
+        :param state: this is the state of the game before the move
+        :return: the outcome with the expected payoffs of the moves
+        """
+        numeric = backend()
+        expected_payoffs = tuple(numeric.integer(0) for _ in range(state.players))
+        for move, outcome in state.branch_outcomes(self.table):
+            weight = numeric.convert(self.weights(state, move))
+            expected_payoffs = tuple(
+                weight * outcome.payoffs[p]
+                + expected_payoffs[p]
+                for p in range(state.players)
+            )
+
+        if state.history is None:
+            new_history: tuple[GameMove, ...] = (GameMove(),)
+        else:
+            new_history = state.history + (GameMove(),)
+
+        return GameOutcome(expected_payoffs, new_history)
+
+
+class VectorBayesianStrategy(BayesianStrategy):
+    """ The strategy returned by GameState.vector_bayesian_strategy() """
+
+    def __init__(self, weights: Callable, table: TranspositionTable) -> None:
+        """
+
+        :param weights: the probability of choosing each move
+        :param table: the table remembering the outcomes of the positions evaluated and their branches
+        """
+        super().__init__(weights, table)
+        self.table: TranspositionTable = table
+
+    def __call__(self, state: GameState) -> GameOutcome:
+        """
+
+        :param state: this is the state of the game before the move
+        :return: the outcome with the expected payoffs of the moves
+        """
+        outcome = self.table.lookup(state)
+        if outcome is not None:
+            return outcome
+
+        # the branches are not looked up here: those this strategy evaluates look themselves up in the table,
+        # so each is looked up once
+        moves = []
+        payoffs = []
+        for move, branch_outcome in state.branch_outcomes():
+            moves.append(move)
+            payoffs.append(branch_outcome.payoffs)
+        weights = [self.weights(state, move) for move in moves]
+
+        numeric = backend()
+        if numeric.exact:
+            # Fractions add much faster than sympy numbers, and give the same sums
+            fractions = [FRACTION.convert(weight) for weight in weights]
+            sums = [
+                sum(weight * FRACTION.convert(branch_payoffs[p]) for weight, branch_payoffs in zip(fractions, payoffs))
+                for p in range(state.players)
+            ]
+            expected_payoffs = tuple(numeric.rational(int(value.numerator), int(value.denominator)) for value in sums)
+        else:
+            vector = np.array(weights, dtype=float) @ np.array(payoffs, dtype=float).reshape(len(moves), state.players)
+            expected_payoffs = tuple(vector.tolist())
+
+        history = state.history if state.history else ()
+        outcome = GameOutcome(expected_payoffs, history + (GameMove(),))
+        self.table.store(state, outcome)
+        return outcome
+
+
+class _SearchTimeout(Exception):
+    """ Abandons a search of DepthLimitedStrategy when its time budget runs out """
+
+
+class DepthLimitedStrategy:
+    """ The strategy returned by GameState.depth_limited_strategy() and GameState.iterative_deepening_strategy() """
+
+    def __init__(
+        self,
+        rank: Callable,
+        evaluation: Callable,
+        depth: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        order: Optional[Callable] = None,
+    ) -> None:
+        """
+
+        :param rank: the function ranking the outcomes for a player
+        :param evaluation: evaluation(state) returns the estimated payoffs of a state whose game is not over
+        :param depth: the number of moves to search (the deepest search to try with a time budget)
+        :param time_budget: the number of seconds for iterative deepening (None searches to the depth once)
+        :param order: given the state and a list of its moves (or branch states), returns them in the order to search
+        """
+        assert depth is not None or time_budget is not None
+        self.rank = rank
+        self.evaluation = evaluation
+        self.depth = depth
+        self.time_budget = time_budget
+        self.order = order
+        self.completed_depth = 0
+        """ the depth of the search whose result was returned most recently """
+        self._deadline: Optional[float] = None
+        self._truncated = False
+
+    def __call__(self, state: GameState) -> GameOutcome:
+        """
+
+        :param state: this is the state of the game before the move
+        :return: the outcome with the (estimated) payoffs and the moves of the best line found
+        """
+        if self.time_budget is None:
+            assert self.depth is not None
+            self._deadline = None
+            outcome = self._search(state, self.depth)
+            self.completed_depth = self.depth
+            return outcome
+
+        deadline = time.perf_counter() + self.time_budget
+        ply = len(state.history) if state.history else 0
+        best: Optional[GameOutcome] = None
+        depth = 0
+        while self.depth is None or depth < self.depth:
+            depth += 1
+            self._deadline = None if best is None else deadline
+            self._truncated = False
+            first = None if best is None or best.moves is None else best.moves[ply]
+            searched = self._search_root(state, depth, first)
+            if searched is None:
+                break
+            best, self.completed_depth = searched, depth
+            if not self._truncated or time.perf_counter() >= deadline:
+                break
+        assert best is not None
+        stats = _SEARCH_STATS
+        if stats is not None:
+            stats.label("depth", self.completed_depth)
+        trace(TRACE_INFO, "{}: depth {} chooses payoffs {}", state.player, self.completed_depth, best.payoffs)
+        return best
+
+    def _branches(self, state: GameState) -> list:
+        """
+
+        :param state: a state whose game is not over
+        :return: its moves (or branch states) in the order to search
+        """
+        branches = list(state.moves if state.searchable_in_place else state.branch_states)
+        if self.order is not None:
+            branches = list(self.order(state, branches))
+        return branches
+
+    def _branch_outcome(self, state: GameState, branch, depth: int) -> GameOutcome:
+        """
+
+        :param state: the state being searched
+        :param branch: one of its moves (or branch states)
+        :param depth: the number of moves to search from the branch
+        :return: the outcome of the branch
+        """
+        stats = _SEARCH_STATS
+        in_place = state.searchable_in_place
+        if in_place:
+            state.apply(branch)
+            child = state
+        else:
+            child = branch
+        try:
+            if stats is not None:
+                ply, start = stats.visit(child), time.perf_counter()
+            outcome = self._search(child, depth)
+            if stats is not None:
+                stats.timed(ply, start)
+        finally:
+            if in_place:
+                state.undo(branch)
+        return outcome
+
+    def _search(self, state: GameState, depth: int) -> GameOutcome:
+        """
+
+        :param state: the state to search
+        :param depth: the number of moves to search
+        :raise _SearchTimeout: if the deadline passes
+        :return: the outcome of the best line for the player to move
+        """
+        if state.game_over:
+            if _SEARCH_STATS is not None:
+                _SEARCH_STATS.terminal_evaluations += 1
+            return state.compute_outcome()
+        if depth == 0:
+            self._truncated = True
+            return GameOutcome(tuple(self.evaluation(state)), state.history)
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise _SearchTimeout
+
+        player = state.player
+        best_value = None
+        best_outcome = None
+        branches = self._branches(state)
+        for branch in branches:
+            outcome = self._branch_outcome(state, branch, depth - 1)
+            value = self.rank(player, outcome)
+            if best_value is None or value > best_value:
+                best_value, best_outcome = value, outcome
+        if _SEARCH_STATS is not None:
+            _SEARCH_STATS.expand(len(branches))
+        assert best_outcome is not None
+        return best_outcome
+
+    def _search_root(self, state: GameState, depth: int, first: Optional[GameMove]) -> Optional[GameOutcome]:
+        """
+        Searches the branch with the first move before the others.
+
+        :param state: the state to search, whose game is not over
+        :param depth: the number of moves to search
+        :param first: the best move of the previous search (None if there is none)
+        :return: the outcome of the best line for the player to move, or None if the time ran out first
+        """
+        in_place = state.searchable_in_place
+        branches = self._branches(state)
+        if first is not None:
+            branches.sort(key=lambda branch: (branch if in_place else branch.history[-1]) != first)
+
+        player = state.player
+        best_value = None
+        best_outcome = None
+        searched = 0
+        try:
+            for branch in branches:
+                outcome = self._branch_outcome(state, branch, depth - 1)
+                searched += 1
+                value = self.rank(player, outcome)
+                if best_value is None or value > best_value:
+                    best_value, best_outcome = value, outcome
+        except _SearchTimeout:
+            pass
+        # the root is expanded here rather than in _search(), so it is counted here too
+        if _SEARCH_STATS is not None:
+            _SEARCH_STATS.expand(searched)
+        return best_outcome
+
+# endregion
+
+# region Iterative Evaluation
+
+class _Frame:
+    """ A state on the explicit stack of GameState.outcome_iteratively(), combining the outcomes of its branches """
+
+    def __init__(self, state: GameState, strategy: RationalStrategy | BayesianStrategy) -> None:
+        """
+
+        :param state: the state whose branches are combined (for in-place searches, the state being searched)
+        :param strategy: the strategy of the state's player
+        """
+        self.state = state
+        self.player = state.player
+        self.strategy = strategy
+        self.in_place = state.searchable_in_place
+        self.branches: Iterator = iter(list(state.moves) if self.in_place else state.branch_states)
+        self.pending: Optional[Any] = None
+        """ the move (or branch state) whose outcome is being computed """
+        self.pending_stored = False
+        """ True if the pending outcome came from the transposition table """
+        self.grouped = self.in_place and state.groups_moves
+        self.group_key: Optional[Hashable] = None
+        self.group_best: Optional[tuple[GameMove, GameOutcome]] = None
+        self.best: Optional[GameOutcome] = None
+        numeric = backend()
+        self.expected = [numeric.integer(0) for _ in range(state.players)]
+        self.combined = 0
+        """ the number of branches combined """
+        self.stats = _SEARCH_STATS
+        if self.stats is not None:
+            self.ply, self.start = self.stats.visit(state), time.perf_counter()
+
+    def receive(self, move: GameMove, outcome: GameOutcome) -> None:
+        """
+
+        :param move: a move from the state
+        :param outcome: the outcome of that move
+        """
+        if not self.grouped:
+            self.combine(move, outcome)
+            return
+        key = self.state.move_group(move)
+        if self.group_best is not None and key == self.group_key:
+            if self.state.group_rank(self.player, outcome) > self.state.group_rank(self.player, self.group_best[1]):
+                self.group_best = (move, outcome)
+        else:
+            self.flush()
+            self.group_key = key
+            self.group_best = (move, outcome)
+
+    def flush(self) -> None:
+        """ combines the optimal move of the current group """
+        if self.group_best is not None:
+            self.combine(*self.group_best)
+            self.group_best = None
+
+    def combine(self, move: GameMove, outcome: GameOutcome) -> None:
+        """
+
+        :param move: a branch's move
+        :param outcome: the outcome of that branch
+        """
+        self.combined += 1
+        if isinstance(self.strategy, RationalStrategy):
+            if self.best is None or self.strategy.rank(self.player, outcome) > self.strategy.rank(self.player, self.best):
+                self.best = outcome
+        else:
+            weight = backend().convert(self.strategy.weights(self.state, move))
+            for p in range(len(self.expected)):
+                self.expected[p] = weight * outcome.payoffs[p] + self.expected[p]
+
+    def finish(self) -> GameOutcome:
+        """
+
+        :return: the outcome of the state
+        """
+        self.flush()
+        if self.stats is not None:
+            self.stats.expand(self.combined)
+            self.stats.timed(self.ply, self.start)
+        if isinstance(self.strategy, RationalStrategy):
+            assert self.best is not None
+            return self.best
+        history = self.state.history if self.state.history else ()
+        return GameOutcome(tuple(self.expected), history + (GameMove(),))
+
+
+def _evaluate_iteratively(root: GameState) -> GameOutcome:
+    """
+
+    :param root: the state to evaluate
+    :return: the outcome of the state, evaluated as described in GameState.outcome_iteratively()
+    """
+    root_strategy = root.strategies[root.player]
+    if root.game_over or not isinstance(root_strategy, (RationalStrategy, BayesianStrategy)):
+        return root.evaluate()
+
+    stack = [_Frame(root, root_strategy)]
+    outcome: Optional[GameOutcome] = None
+    while stack:
+        frame = stack[-1]
+        table = frame.strategy.table
+
+        if frame.pending is not None:
+            # the outcome of the pending branch has been computed
+            assert outcome is not None
+            state = frame.state if frame.in_place else frame.pending
+            if table is not None and not frame.pending_stored:
+                table.store(state, outcome)
+            if frame.in_place:
+                move = frame.pending
+                frame.state.undo(move)
+            else:
+                move = frame.pending.history[-1]
+            frame.pending = None
+            frame.receive(move, outcome)
+
+        branch = next(frame.branches, None)
+        if branch is None:
+            stack.pop()
+            outcome = frame.finish()
+            continue
+
+        frame.pending = branch
+        if frame.in_place:
+            frame.state.apply(branch)
+            state = frame.state
+        else:
+            state = branch
+        outcome = None if table is None else table.lookup(state)
+        frame.pending_stored = outcome is not None
+        if outcome is None:
+            strategy = state.strategies[state.player]
+            if not state.game_over and isinstance(strategy, (RationalStrategy, BayesianStrategy)):
+                stack.append(_Frame(state, strategy))
+            else:
+                outcome = state.evaluate()
+
+    assert outcome is not None
+    return outcome
+
+# endregion
+
+# region Monte Carlo Tree Search
+
+def _mcts_branches(state: GameState, in_place: bool) -> list:
+    """
+
+    :param state: a state whose game is not over
+    :param in_place: True if the state is searched in place
+    :return: its moves (or branch states)
+    """
+    branches = list(state.moves if in_place else state.branch_states)
+    if not branches:
+        raise ValueError(f"the game is not over but there are no branches from {state}")
+    return branches
+
+
+class _MctsNode:
+    """ A node in the tree searched by GameState.mcts_strategy() """
+
+    def __init__(self, state: GameState, parent: Optional["_MctsNode"], branch=None) -> None:
+        """
+
+        :param state: the state at this node
+        :param parent: the node whose branch this is (None for the root)
+        :param branch: the move (or branch state) that leads from the parent to this node (None for the root)
+        """
+        self.parent = parent
+        self.branch = branch
+        self.player = state.player
+        self.game_over = state.game_over
+        self.children: list[_MctsNode] = []
+        self.untried: Optional[list] = None
+        """ the moves (or branch states) that do not yet have nodes (None until the node is first expanded) """
+        self.visits = 0
+        self.reward = 0.0
+        """ the total rank of the rollouts through this node for the player who chose it """
+        self.payoffs: Optional[tuple] = None
+        """ the total payoffs of the rollouts through this node """
+
+    @property
+    def expanded(self) -> bool:
+        """ True once every branch of this node has a child node """
+        return self.untried is not None and not self.untried
+
+    def uct(self, exploration: float) -> float:
+        """
+
+        :param exploration: the weight of the exploration term
+        :return: the upper confidence bound of this node's reward
+        """
+        assert self.parent is not None and self.visits > 0
+        return self.reward / self.visits + exploration * math.sqrt(math.log(self.parent.visits) / self.visits)
+
+    def enter(self, state: GameState, in_place: bool) -> GameState:
+        """
+
+        :param state: the state at the parent node
+        :param in_place: True if the state is searched in place, in which case this node's move is applied to it
+        :return: the state at this node
+        """
+        if in_place:
+            state.apply(self.branch)
+            return state
+        return self.branch
+
+    def expand(self, state: GameState, in_place: bool) -> tuple["_MctsNode", GameState]:
+        """
+
+        :param state: the state at this node
+        :param in_place: True if the state is searched in place, in which case the new node's move is applied to it
+        :return: a new child node for one of the untried branches, and the state at that node
+        """
+        if self.untried is None:
+            self.untried = _mcts_branches(state, in_place)
+        branch = self.untried.pop(0)
+        if in_place:
+            state.apply(branch)
+            child_state = state
+        else:
+            child_state = branch
+        child = _MctsNode(child_state, self, branch)
+        self.children.append(child)
+        return child, child_state
+
+    def backpropagate(self, rank: Callable, outcome: GameOutcome) -> None:
+        """
+
+        :param rank: the function ranking the outcomes for a player
+        :param outcome: the outcome of a rollout from this node
+        """
+        node: Optional[_MctsNode] = self
+        while node is not None:
+            node.visits += 1
+            if node.payoffs is None:
+                node.payoffs = outcome.payoffs
+            else:
+                node.payoffs = tuple(total + payoff for total, payoff in zip(node.payoffs, outcome.payoffs))
+            if node.parent is not None:
+                node.reward += float(rank(node.parent.player, outcome))
+            node = node.parent
+
+# endregion
+
+# region Rollouts
+
+@dataclass
+class RolloutSummary:
+    """ The mean payoffs of a number of rollouts (playing a game to the end with its strategies) """
+    trials: int
+    """ the number of rollouts """
+    means: tuple[float, ...]
+    """ the mean payoff for each player """
+    standard_errors: tuple[float, ...]
+    """ the standard error of each mean payoff """
+
+    def __repr__(self) -> str:
+        estimates = ", ".join(f"{mean} ± {error}" for mean, error in zip(self.means, self.standard_errors))
+        return f"Trials: {self.trials}\nPayoffs: ({estimates})"
+
+
+_ROLLOUT_FACTORY: Optional[Callable] = None
+""" the state factory used by iterate_rollouts(), which the forked worker processes inherit """
+
+
+def _rollout_batch(factory: Callable, trials: int, seed: Optional[int]) -> tuple[int, list[float], list[float]]:
+    """
+    Accumulates the payoffs with Welford's algorithm, which stays accurate when the variance is small
+    compared to the mean (unlike the sums of squares).
+
+    :param factory: returns a new GameState for each rollout
+    :param trials: the number of rollouts
+    :param seed: the seed for the random number generator (None leaves it as it is)
+    :return: the number of rollouts, and the means and sums of squared deviations of each player's payoffs
+    """
+    if seed is not None:
+        random.seed(seed)
+    means: list[float] = []
+    deviations: list[float] = []
+    for count in range(1, trials + 1):
+        payoffs = [float(payoff) for payoff in factory().outcome.payoffs]
+        if not means:
+            means = [0.0 for _ in payoffs]
+            deviations = [0.0 for _ in payoffs]
+        for player, payoff in enumerate(payoffs):
+            delta = payoff - means[player]
+            means[player] += delta / count
+            deviations[player] += delta * (payoff - means[player])
+    return trials, means, deviations
+
+
+def _merge_batches(
+    a: tuple[int, list[float], list[float]], b: tuple[int, list[float], list[float]]
+) -> tuple[int, list[float], list[float]]:
+    """
+    Chan et al.'s parallel formula for combining the moments of two batches.
+
+    :param a: the count, means, and sums of squared deviations of a batch (as returned by _rollout_batch())
+    :param b: those of another batch
+    :return: those of both batches together
+    """
+    count_a, means_a, deviations_a = a
+    count_b, means_b, deviations_b = b
+    if count_a == 0:
+        return b
+    count = count_a + count_b
+    deltas = [mean_b - mean_a for mean_a, mean_b in zip(means_a, means_b)]
+    means = [mean_a + delta * count_b / count for mean_a, delta in zip(means_a, deltas)]
+    deviations = [
+        deviation_a + deviation_b + delta * delta * count_a * count_b / count
+        for deviation_a, deviation_b, delta in zip(deviations_a, deviations_b, deltas)
+    ]
+    return count, means, deviations
+
+
+def _rollout_worker_batch(trials: int, seed: Optional[int]) -> tuple[int, list[float], list[float]]:
+    """ Runs _rollout_batch() in a worker process. """
+    assert _ROLLOUT_FACTORY is not None
+    return _rollout_batch(_ROLLOUT_FACTORY, trials, seed)
+
+
+def iterate_rollouts(
+    factory: Callable,
+    trials: int,
+    batch_size: int = 1_000,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Generator[RolloutSummary, None, None]:
+    """
+    Plays factory().outcome in batches, yielding the summary of every rollout so far after each batch.
+
+    With a seed, each batch seeds the random number generator from the seed and its index,
+    so the results do not depend on the number of workers.
+    The workers are forked from this process, so they need the "fork" start method.
+
+    :param factory: returns a new GameState for each rollout
+    :param trials: the number of rollouts
+    :param batch_size: the number of rollouts between summaries
+    :param workers: the number of worker processes (None plays the rollouts in this process)
+    :param seed: the seed for the random number generator (None leaves it as it is)
+    :return: the summary of the rollouts so far
+    """
+    batches = [min(batch_size, trials - start) for start in range(0, trials, batch_size)]
+    seeds = [None if seed is None else hash((seed, index)) for index in range(len(batches))]
+
+    total: tuple[int, list[float], list[float]] = (0, [], [])
+
+    def summary(batch: tuple[int, list[float], list[float]]) -> RolloutSummary:
+        nonlocal total
+        total = _merge_batches(total, batch)
+        count, means, deviations = total
+        if count > 1:
+            errors = tuple(math.sqrt(deviation / (count - 1) / count) for deviation in deviations)
+        else:
+            errors = tuple(math.inf for _ in means)
+        return RolloutSummary(count, tuple(means), errors)
+
+    if workers is None:
+        for batch_trials, batch_seed in zip(batches, seeds):
+            result = summary(_rollout_batch(factory, batch_trials, batch_seed))
+            trace(TRACE_INFO, "{} rollouts have means {}", result.trials, result.means)
+            yield result
+        return
+
+    global _ROLLOUT_FACTORY
+    _ROLLOUT_FACTORY = factory
+    try:
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for batch in executor.map(_rollout_worker_batch, batches, seeds):
+                result = summary(batch)
+                trace(TRACE_INFO, "{} rollouts have means {}", result.trials, result.means)
+                yield result
+    finally:
+        _ROLLOUT_FACTORY = None
+
+
+def run_rollouts(
+    factory: Callable,
+    trials: int,
+    batch_size: int = 1_000,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> RolloutSummary:
+    """
+    See iterate_rollouts() for the parameters.
+
+    :return: the summary of all the rollouts
+    """
+    result = None
+    for result in iterate_rollouts(factory, trials, batch_size, workers, seed):
+        pass
+    assert result is not None
+    return result
+
+# endregion
+
+# region Parallel Search
+
+_PARALLEL_ROOT: Optional[GameState] = None
+""" the state searched by GameState.parallel_outcome(), which the forked worker processes inherit """
+
+
+def _parallel_branch_count(state: GameState) -> int:
+    """
+
+    :param state: the state whose branches we want
+    :return: the number of branches of the state
+    """
+    if state.searchable_in_place:
+        return sum(1 for _ in state.moves)
+    return sum(1 for _ in state.branch_states)
+
+
+def _parallel_branch(state: GameState, index: int) -> GameState:
+    """
+    For states that implement the in-place protocol, the branch is the state itself after the move is applied,
+    and _parallel_return() must be called to undo it.
+
+    :param state: the state whose branch we want
+    :param index: the index of the branch
+    :return: the branch of the state
+    """
+    if state.searchable_in_place:
+        state.apply(next(it.islice(state.moves, index, None)))
+        return state
+    return next(it.islice(state.branch_states, index, None))
+
+
+def _parallel_return(state: GameState, branch: GameState) -> None:
+    """
+
+    :param state: the state passed to _parallel_branch()
+    :param branch: the branch returned by _parallel_branch()
+    """
+    if state.searchable_in_place:
+        assert state.history is not None
+        state.undo(state.history[-1])
+
+
+def _parallel_path_outcome(path: tuple[int, ...]) -> GameOutcome:
+    """
+    Runs in a worker process.
+
+    :param path: the index of a branch of the root state, and possibly the index of one of that branch's branches
+    :return: the outcome of that branch
+    """
+    assert _PARALLEL_ROOT is not None
+    states = [_PARALLEL_ROOT]
+    for index in path:
+        states.append(_parallel_branch(states[-1], index))
+    outcome = states[-1].outcome_in_place() if states[-1].searchable_in_place else states[-1].outcome
+    for state, branch in reversed(list(zip(states, states[1:]))):
+        _parallel_return(state, branch)
+    return outcome
+
+# endregion
+
 
 @dataclass(frozen=True)
 class TreeMove(GameMove):
@@ -286,7 +1775,8 @@ class BinTreeState(GameState):
         """
         assert self.history is not None
         history = tuple(tree_move_from_game_move(move) for move in self.history)
-        return GameOutcome(self.payoffs[history], self.history)
+        numeric = backend()
+        return GameOutcome(tuple(numeric.convert(payoff) for payoff in self.payoffs[history]), self.history)
 
     @property
     def branch_states(self):
@@ -296,12 +1786,39 @@ class BinTreeState(GameState):
         """
         for move in (BinTreeState.LEFT, BinTreeState.RIGHT):
             new_player = (self.player + 1) % self.players
-            new_strategies = copy.deepcopy(self.strategies)
-            new_payoffs = copy.deepcopy(self.payoffs)
             new_history = self.history + (move,)
-            new_state = BinTreeState(new_player, new_strategies, new_payoffs, new_history)
+            # the strategies and payoffs are never modified, so the branches can share them
+            new_state = BinTreeState(new_player, self.strategies, self.payoffs, new_history)
             yield new_state
 
+    @property
+    def moves(self):
+        """
+
+        :return: either the LEFT or RIGHT branch
+        """
+        yield BinTreeState.LEFT
+        yield BinTreeState.RIGHT
+
+    def apply(self, move: GameMove) -> None:
+        """
+
+        :param move: the LEFT or RIGHT branch to follow
+        """
+        self._history = self._history + (move,)
+        self._player = (self.player + 1) % self.players
+        self._key = None
+
+    def undo(self, move: GameMove) -> None:
+        """
+
+        :param move: the branch most recently followed
+        """
+        assert self._history[-1] == move
+        self._history = self._history[:-1]
+        self._player = (self.player - 1) % self.players
+        self._key = None
+
     @staticmethod
     def rank(player: int, outcome: GameOutcome) -> sp.Rational:
         """
@@ -1,3 +1,11 @@
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Callable, Container, Hashable, Iterable, Optional, Sequence
+
+import math
+from collections import deque
+
+import numpy as np
 import sympy as sp
 from icecream import ic  # type: ignore
 
@@ -13,12 +21,9 @@ def rat_mat(mat: list[list[int]], q: int, *, exact=True) -> sp.Matrix:
 
 
 def transition_matrix(states, transition_distribution):
-    return sp.Matrix(
-        [
-            [col[row] if row in col else 0 for row in range(1, 1 + states)]
-            for col in [transition_distribution(i) for i in range(1, 1 + states)]
-        ]
-    ).transpose()
+    # the transitions to states out of range are left out
+    in_range = range(1, 1 + states)
+    return SparseChain(transition_distribution, in_range, within=in_range).to_matrix(in_range)
 
 
 def markov(q, r) -> sp.Matrix:
@@ -42,11 +47,12 @@ def markov_n(q: sp.Matrix) -> sp.Matrix:
 
 
 def to_infinity(mat: sp.Matrix) -> sp.Matrix:
-    and_beyond = sp.Symbol("and_beyond")
-    matoo = (mat**and_beyond).applyfunc(
-        lambda expr: sp.limit(expr, and_beyond, sp.oo)
-    )
-    return matoo
+    """
+
+    :param mat: a transition matrix (column j holds the probabilities of moving from state j)
+    :return: the limit of its powers, exact when its entries are rational (see long_run)
+    """
+    return sp.Matrix(long_run(mat))
 
 
 def distribution_to_column(state_count, distribution):
@@ -61,3 +67,585 @@ def is_distribution(dist):
 
 def zero():
     return sp.Rational(0, 1)
+
+
+@dataclass
+class AbsorbingChain:
+    """ The result of absorbing_chain(): sympy Matrices when solved exactly, NumPy arrays otherwise """
+    absorption: Any
+    """ entry (i, j) is the probability of ending in absorbing state i from transient state j (R * N) """
+    expected_steps: Any
+    """ entry (0, j) is the expected number of steps before absorption from transient state j (ones * N) """
+    step_variance: Any
+    """ entry (0, j) is the variance of the number of steps before absorption from transient state j """
+
+
+def _is_exact(matrix) -> bool:
+    if isinstance(matrix, sp.MatrixBase):
+        return all(isinstance(entry, sp.Rational) for entry in matrix)
+    return all(isinstance(entry, (int, Fraction)) for entry in np.asarray(matrix, dtype=object).flat)
+
+
+def _fraction(value) -> Fraction:
+    if isinstance(value, sp.Rational):
+        return Fraction(int(value.p), int(value.q))
+    return Fraction(value)
+
+
+def _rational(value: Fraction) -> sp.Rational:
+    return sp.Rational(value.numerator, value.denominator)
+
+
+def _solve_exact(a: list[list[Fraction]], b: list[list[Fraction]]) -> list[list[Fraction]]:
+    """
+    Solves a x = b by Gauss-Jordan elimination, skipping the zero entries.
+
+    :param a: a square matrix (as rows), which is overwritten
+    :raises ValueError: if a is singular
+    :param b: the right hand sides (as rows), which are overwritten
+    :return: x (as rows)
+    """
+    size = len(a)
+    for col in range(size):
+        pivot = next((row for row in range(col, size) if a[row][col] != 0), None)
+        if pivot is None:
+            raise ValueError("I - Q is singular: some transient states never reach an absorbing state")
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        scale = a[col][col]
+        pivot_row = [(k, value / scale) for k, value in enumerate(a[col]) if value != 0]
+        pivot_rhs = [(k, value / scale) for k, value in enumerate(b[col]) if value != 0]
+        for k, value in pivot_row:
+            a[col][k] = value
+        for k, value in pivot_rhs:
+            b[col][k] = value
+        for row in range(size):
+            factor = a[row][col]
+            if row != col and factor != 0:
+                for k, value in pivot_row:
+                    a[row][k] -= factor * value
+                for k, value in pivot_rhs:
+                    b[row][k] -= factor * value
+    return b
+
+
+def absorbing_chain(q, r, *, exact: Optional[bool] = None) -> AbsorbingChain:
+    """
+    Like markov() and markov_n(), but solves (I - Q)^T x = b rather than inverting I - Q.
+
+    :param q: the transitions between the transient states (a sympy Matrix, NumPy array, or list of rows)
+    :param r: the transitions from the transient states to the absorbing states
+    :param exact: True for Fractions, False for floats (None: exact when every entry is rational)
+    :return: the absorption probabilities, and the mean and variance of the number of steps before absorption
+    """
+    q_shape = np.shape(q)
+    r_shape = np.shape(r)
+    if len(q_shape) != 2 or q_shape[0] != q_shape[1]:
+        raise sp.ShapeError(f"The matrix q is not square ({q_shape})")
+    if len(r_shape) != 2 or r_shape[1] != q_shape[1]:
+        raise sp.ShapeError(f"The matrices have incompatible number of cols ({q_shape[1]} and {r_shape[1]})")
+    if exact is None:
+        exact = _is_exact(q) and _is_exact(r)
+    return _exact_chain(q, r) if exact else _float_chain(q, r)
+
+
+def _float_chain(q, r) -> AbsorbingChain:
+    size, absorbing = np.shape(q)[0], np.shape(r)[0]
+    a = np.eye(size) - np.asarray(q, dtype=float).T
+    solution = np.linalg.solve(a, np.column_stack((np.asarray(r, dtype=float).T, np.ones(size))))
+    steps = solution[:, absorbing]
+    steps_n = np.linalg.solve(a, steps)
+    return AbsorbingChain(
+        solution[:, :absorbing].T,
+        steps[np.newaxis, :],
+        (2 * steps_n - steps - steps * steps)[np.newaxis, :],
+    )
+
+
+def _rows(matrix, exact: bool) -> list[list]:
+    """
+
+    :param matrix: a sympy Matrix, NumPy array, or list of rows
+    :param exact: True for Fraction entries, False for float entries
+    :return: the matrix as a list of rows
+    """
+    rows, cols = np.shape(matrix)
+    convert = _fraction if exact else float
+    if isinstance(matrix, sp.MatrixBase):
+        return [[convert(matrix[i, j]) for j in range(cols)] for i in range(rows)]
+    return [[convert(matrix[i][j]) for j in range(cols)] for i in range(rows)]
+
+
+def _exact_chain(q, r) -> AbsorbingChain:
+    size, absorbing = np.shape(q)[0], np.shape(r)[0]
+    q_rows = _rows(q, True)
+    r_rows = _rows(r, True)
+
+    def coefficients() -> list[list[Fraction]]:
+        return [[int(i == j) - q_rows[j][i] for j in range(size)] for i in range(size)]
+
+    rhs = [[r_rows[k][i] for k in range(absorbing)] + [Fraction(1)] for i in range(size)]
+    solution = _solve_exact(coefficients(), rhs)
+    steps = [row[absorbing] for row in solution]
+    steps_n = [row[0] for row in _solve_exact(coefficients(), [[step] for step in steps])]
+
+    return AbsorbingChain(
+        sp.Matrix(absorbing, size, lambda i, j: _rational(solution[j][i])),
+        sp.Matrix(1, size, lambda _, j: _rational(steps[j])),
+        sp.Matrix(1, size, lambda _, j: _rational(2 * steps_n[j] - steps[j] - steps[j] * steps[j])),
+    )
+
+
+def _closed_classes(p: list[list]) -> list[list[int]]:
+    """
+
+    :param p: a transition matrix as rows (column j holds the probabilities of moving from state j)
+    :return: the closed communicating classes (the recurrent states), each in increasing order
+    """
+    size = len(p)
+    successors = [[i for i in range(size) if p[i][j] != 0] for j in range(size)]
+    reachable = []
+    for start in range(size):
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            for state in successors[queue.popleft()]:
+                if state not in seen:
+                    seen.add(state)
+                    queue.append(state)
+        reachable.append(seen)
+
+    classes = []
+    assigned: set[int] = set()
+    for state in range(size):
+        if state not in assigned:
+            members = sorted(other for other in reachable[state] if state in reachable[other])
+            assigned.update(members)
+            if reachable[state] == set(members):
+                classes.append(members)
+    return classes
+
+
+def _period(p: list[list], members: list[int]) -> int:
+    """
+
+    :param p: a transition matrix as rows
+    :param members: a closed communicating class
+    :return: the period of the class (the gcd of the lengths of its cycles)
+    """
+    levels = {members[0]: 0}
+    queue = deque([members[0]])
+    period = 0
+    while queue:
+        state = queue.popleft()
+        for other in members:
+            if p[other][state] != 0:
+                if other in levels:
+                    period = math.gcd(period, levels[state] + 1 - levels[other])
+                else:
+                    levels[other] = levels[state] + 1
+                    queue.append(other)
+    return period
+
+
+def _stationary(p: list[list], members: list[int], exact: bool) -> list:
+    """
+
+    :param p: a transition matrix as rows
+    :param members: a closed communicating class
+    :param exact: True to solve with Fractions, False with floats
+    :return: the stationary distribution of the class (in the order of its members)
+    """
+    size = len(members)
+    # (P - I) pi = 0 on the class, with the last equation replaced by sum(pi) = 1
+    a = [[p[i][j] - int(i == j) for j in members] for i in members[:-1]] + [[1] * size]
+    b = [[0] for _ in range(size - 1)] + [[1]]
+    if not exact:
+        return list(np.linalg.solve(np.array(a, dtype=float), np.array(b, dtype=float))[:, 0])
+    solution = _solve_exact([[Fraction(x) for x in row] for row in a], [[Fraction(x) for x in row] for row in b])
+    return [row[0] for row in solution]
+
+
+def long_run(p, *, exact: Optional[bool] = None):
+    """
+    The limit of the powers of p, from the stationary distributions of its closed classes.
+
+    :param p: the transition matrix (a sympy Matrix, NumPy array, or list of rows)
+    :param exact: True for Fractions, False for floats (None: exact when every entry is rational)
+    :raise ValueError: if a closed class is periodic, so that the powers do not converge
+    :return: the limit, a sympy Matrix when solved exactly and a NumPy array otherwise
+    """
+    shape = np.shape(p)
+    if len(shape) != 2 or shape[0] != shape[1]:
+        raise sp.ShapeError(f"The matrix p is not square ({shape})")
+    if exact is None:
+        exact = _is_exact(p)
+    rows = _rows(p, exact)
+    size = len(rows)
+    zero = Fraction(0) if exact else 0.0
+    limit: list[list[Any]] = [[zero] * size for _ in range(size)]
+
+    classes = _closed_classes(rows)
+    distributions = []
+    for members in classes:
+        if _period(rows, members) > 1:
+            raise ValueError(f"The powers do not converge: the states {members} are periodic")
+        distribution = _stationary(rows, members, exact)
+        distributions.append(distribution)
+        for j in members:
+            for i, probability in zip(members, distribution):
+                limit[i][j] = probability
+
+    recurrent = {state for members in classes for state in members}
+    transient = [state for state in range(size) if state not in recurrent]
+    if transient:
+        q = [[rows[i][j] for j in transient] for i in transient]
+        r = [[sum((rows[i][j] for i in members), zero) for j in transient] for members in classes]
+        chain = _exact_chain(q, r) if exact else _float_chain(q, r)
+        absorption = _rows(chain.absorption, exact)
+        for column, j in enumerate(transient):
+            for k, (members, distribution) in enumerate(zip(classes, distributions)):
+                for i, probability in zip(members, distribution):
+                    limit[i][j] += absorption[k][column] * probability
+
+    if not exact:
+        return np.array(limit, dtype=float)
+    return sp.Matrix(size, size, lambda i, j: _rational(limit[i][j]))
+
+
+class SparseChain:
+    """ A Markov chain whose states are discovered from start states, keeping only the possible transitions """
+
+    def __init__(
+        self,
+        transition_distribution: Callable[[Any], dict],
+        starts: Iterable[Hashable] = (),
+        within: Optional[Container[Hashable]] = None,
+    ) -> None:
+        """
+
+        :param transition_distribution: returns the probability mass function of the next state given a state
+        :param starts: the states from which to explore
+        :param within: if given, the only states kept, so the transitions to other states are left out
+        """
+        self._transition_distribution = transition_distribution
+        self._within = within
+        self.transitions: dict[Hashable, dict[Hashable, Any]] = {}
+        """ the distribution of the next state for each state discovered """
+        self._states: list[Hashable] = []
+        self.explore(starts)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, state: Hashable) -> bool:
+        return state in self.transitions
+
+    @property
+    def states(self) -> list[Hashable]:
+        """ the states in the order they were discovered """
+        return list(self._states)
+
+    def explore(self, starts: Iterable[Hashable]) -> None:
+        """
+        Adds the states reachable from the start states, breadth first.
+
+        :param starts: the states from which to explore
+        """
+        queue: deque[Hashable] = deque()
+        for state in starts:
+            if state not in self.transitions:
+                self.transitions[state] = {}
+                queue.append(state)
+        while queue:
+            state = queue.popleft()
+            self._states.append(state)
+            distribution = {
+                next_state: probability
+                for next_state, probability in self._transition_distribution(state).items()
+                if probability != 0 and (self._within is None or next_state in self._within)
+            }
+            self.transitions[state] = distribution
+            for next_state in distribution:
+                if next_state not in self.transitions:
+                    self.transitions[next_state] = {}
+                    queue.append(next_state)
+
+    def distribution(self, state: Hashable) -> dict[Hashable, Any]:
+        """
+
+        :param state: a state (which is explored if it has not been discovered)
+        :return: the probability mass function of the next state
+        """
+        if state not in self.transitions:
+            self.explore((state,))
+        return self.transitions[state]
+
+    def is_absorbing(self, state: Hashable) -> bool:
+        """
+
+        :param state: a discovered state
+        :return: True if the chain never leaves the state
+        """
+        return list(self.transitions[state]) == [state]
+
+    def to_matrix(self, states: Optional[Iterable[Hashable]] = None) -> sp.Matrix:
+        """
+
+        :param states: the order of the states (the order they were discovered by default)
+        :return: the dense sympy transition matrix (column j holds the probabilities of moving from state j)
+        """
+        order = self._states if states is None else list(states)
+        index = {state: i for i, state in enumerate(order)}
+        matrix = sp.zeros(len(order), len(order))
+        for j, state in enumerate(order):
+            for next_state, probability in self.transitions[state].items():
+                matrix[index[next_state], j] = probability
+        return matrix
+
+    def to_csr(self, states: Optional[Iterable[Hashable]] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The transitions from each state as float compressed sparse rows (the transpose of to_matrix()).
+
+        :param states: the order of the states (the order they were discovered by default)
+        :return: the probabilities, the indices of the next states, and the row starts
+        """
+        order = self._states if states is None else list(states)
+        index = {state: i for i, state in enumerate(order)}
+        probabilities = []
+        next_states = []
+        row_starts = [0]
+        for state in order:
+            for next_state, probability in self.transitions[state].items():
+                probabilities.append(float(probability))
+                next_states.append(index[next_state])
+            row_starts.append(len(next_states))
+        return (
+            np.array(probabilities, dtype=float),
+            np.array(next_states, dtype=np.int64),
+            np.array(row_starts, dtype=np.int64),
+        )
+
+
+@dataclass
+class ChainSimulation:
+    """ The results of simulating many independent runs of an absorbing chain with simulate() """
+    trials: int
+    """ the number of runs """
+    terminal_counts: dict[Hashable, int]
+    """ the number of runs ending in each absorbing state """
+    duration_counts: dict[int, int]
+    """ the number of runs absorbed after each number of steps """
+    unfinished: int = 0
+    """ the number of runs not absorbed within the maximum number of steps """
+
+    def terminal_distribution(self) -> dict[Hashable, float]:
+        """
+
+        :return: the fraction of the finished runs ending in each absorbing state
+        """
+        finished = self.trials - self.unfinished
+        return {state: count / finished for state, count in self.terminal_counts.items()}
+
+    def mean_duration(self) -> float:
+        """
+
+        :return: the mean number of steps of the finished runs
+        """
+        finished = self.trials - self.unfinished
+        return sum(steps * count for steps, count in self.duration_counts.items()) / finished
+
+
+def _dense_csr(p) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+
+    :param p: a transition matrix (column j holds the probabilities of moving from state j)
+    :return: the transitions from each state as float compressed sparse rows (as SparseChain.to_csr())
+    """
+    matrix = np.asarray(np.array(p, dtype=float))
+    probabilities: list[float] = []
+    next_states: list[int] = []
+    row_starts = [0]
+    for j in range(matrix.shape[1]):
+        (rows,) = np.nonzero(matrix[:, j])
+        probabilities.extend(matrix[rows, j])
+        next_states.extend(rows)
+        row_starts.append(len(next_states))
+    return np.array(probabilities), np.array(next_states, dtype=np.int64), np.array(row_starts, dtype=np.int64)
+
+
+def simulate(
+    transitions,
+    starts: Sequence,
+    trials: int = 1,
+    *,
+    absorbing: Optional[Iterable[int]] = None,
+    seed: Optional[int] = None,
+    max_steps: int = 100_000,
+) -> ChainSimulation:
+    """
+    Runs independent copies of a chain until they are absorbed, advancing every run at once.
+
+    :param transitions: a SparseChain, a transition matrix (column j holds the probabilities of moving from state j),
+        or a sampler: sampler(states, rng) returns an array of next states for an array of (integer) states
+        using the numpy.random.Generator rng
+    :param starts: the sequence of start states, even for a single start (states of a SparseChain, otherwise indices)
+    :param trials: the number of runs from each start state
+    :param absorbing: the absorbing states of a sampler (found from the transitions otherwise)
+    :param seed: the seed for the random number generator (None for a random seed)
+    :param max_steps: the number of steps after which the remaining runs are left unfinished
+    :return: the number of runs ending in each absorbing state, and the number absorbed after each number of steps
+    """
+    rng = np.random.default_rng(seed)
+    start_list = list(starts)
+    labels: Optional[list[Hashable]] = None
+
+    if callable(transitions) and not isinstance(transitions, SparseChain):
+        if absorbing is None:
+            raise ValueError("The absorbing states of a sampler must be given")
+        sampler = transitions
+        current = np.repeat(np.array(start_list, dtype=np.int64), trials)
+        absorbing_states = set(absorbing)
+
+        def is_absorbing(states: np.ndarray) -> np.ndarray:
+            return np.isin(states, list(absorbing_states))
+    else:
+        if isinstance(transitions, SparseChain):
+            labels = transitions.states
+            index = {state: i for i, state in enumerate(labels)}
+            start_list = [index[state] for state in start_list]
+            probabilities, next_states, row_starts = transitions.to_csr()
+        else:
+            probabilities, next_states, row_starts = _dense_csr(transitions)
+        size = len(row_starts) - 1
+        # each row is summed on its own and ends at exactly 1, so rounding does not build up from row to row
+        cumulative = np.empty_like(probabilities)
+        for start, stop in zip(row_starts[:-1], row_starts[1:]):
+            cumulative[start:stop] = np.cumsum(probabilities[start:stop])
+            cumulative[stop - 1] = 1.0
+        row_last = row_starts[1:] - 1
+        absorbing_mask = np.array(
+            [row_starts[j + 1] - row_starts[j] == 1 and next_states[row_starts[j]] == j for j in range(size)]
+        )
+        current = np.repeat(np.array(start_list, dtype=np.int64), trials)
+
+        def sampler(states: np.ndarray, generator: np.random.Generator) -> np.ndarray:
+            targets = generator.random(len(states))
+            # a binary search within the row of each state for the first cumulative probability above its target
+            low, high = row_starts[states], row_last[states]
+            while np.any(low < high):
+                middle = (low + high) // 2
+                above = cumulative[middle] > targets
+                low, high = np.where(above, low, middle + 1), np.where(above, middle, high)
+            return next_states[low]
+
+        def is_absorbing(states: np.ndarray) -> np.ndarray:
+            return absorbing_mask[states]
+
+    durations = np.zeros(len(current), dtype=np.int64)
+    active = np.flatnonzero(~is_absorbing(current))
+    steps = 0
+    while len(active) > 0 and steps < max_steps:
+        steps += 1
+        current[active] = sampler(current[active], rng)
+        durations[active] += 1
+        active = active[~is_absorbing(current[active])]
+
+    finished = np.ones(len(current), dtype=bool)
+    finished[active] = False
+    terminal_states, terminal_counts = np.unique(current[finished], return_counts=True)
+    duration_counts = np.bincount(durations[finished])
+    return ChainSimulation(
+        len(current),
+        {
+            (int(state) if labels is None else labels[state]): int(count)
+            for state, count in zip(terminal_states, terminal_counts)
+        },
+        {steps: int(count) for steps, count in enumerate(duration_counts) if count > 0},
+        len(active),
+    )
+
+
+@dataclass
+class AbsorptionTimes:
+    """ The distribution of the number of steps until an absorbing chain is absorbed, found by absorption_times() """
+    duration_pmf: np.ndarray
+    """ entry k is the probability of being absorbed at step k """
+    arrivals: dict[Hashable, np.ndarray]
+    """ entry k for an absorbing state is the probability of being absorbed in that state at step k """
+    remaining: float
+    """ the probability of not being absorbed after the last step computed """
+
+    def survival(self, steps: int) -> float:
+        """
+
+        :param steps: a number of steps
+        :return: the probability that the chain lasts more than that many steps
+        """
+        return float(self.duration_pmf[steps + 1:].sum()) + self.remaining
+
+    def cumulative_arrivals(self, state: Hashable) -> np.ndarray:
+        """
+
+        :param state: an absorbing state
+        :return: entry k is the probability of being absorbed in the state by step k
+        """
+        return np.cumsum(self.arrivals[state])
+
+    def mean(self) -> float:
+        """
+
+        :return: the expected number of steps until absorption (ignoring the remaining probability)
+        """
+        return float(np.arange(len(self.duration_pmf)) @ self.duration_pmf)
+
+
+def absorption_times(transitions, start, *, epsilon: float = 1e-12, max_steps: int = 100_000) -> AbsorptionTimes:
+    """
+    Steps the distribution forward one sparse product at a time until at most epsilon is not absorbed.
+
+    :param transitions: a SparseChain or a transition matrix (column j holds the probabilities of moving from state j)
+    :param start: the start state (a state of a SparseChain, otherwise an index), or a dict of start probabilities
+    :param epsilon: the probability of not being absorbed at which to stop
+    :param max_steps: the number of steps at which to stop regardless
+    :return: the probability of being absorbed at each step, overall and in each absorbing state
+    """
+    if isinstance(transitions, SparseChain):
+        labels: list[Hashable] = transitions.states
+        probabilities, next_states, row_starts = transitions.to_csr()
+    else:
+        probabilities, next_states, row_starts = _dense_csr(transitions)
+        labels = list(range(len(row_starts) - 1))
+    index = {state: i for i, state in enumerate(labels)}
+    size = len(labels)
+    sources = np.repeat(np.arange(size), np.diff(row_starts))
+    absorbing = np.array(
+        [row_starts[j + 1] - row_starts[j] == 1 and next_states[row_starts[j]] == j for j in range(size)], dtype=bool
+    )
+    absorbing_indices = np.flatnonzero(absorbing)
+
+    distribution: np.ndarray = np.zeros(size)
+    for state, probability in (start.items() if isinstance(start, dict) else ((start, 1),)):
+        distribution[index[state]] += float(probability)
+
+    durations = [float(distribution[absorbing].sum())]
+    arrivals = [distribution[absorbing_indices]]
+    distribution[absorbing] = 0
+    remaining = float(distribution.sum())
+    while remaining > epsilon and len(durations) <= max_steps:
+        active = distribution[sources] != 0
+        distribution = np.bincount(
+            next_states[active], weights=distribution[sources[active]] * probabilities[active], minlength=size
+        )
+        arrivals.append(distribution[absorbing_indices])
+        durations.append(float(arrivals[-1].sum()))
+        distribution[absorbing] = 0
+        remaining = float(distribution.sum())
+
+    arrival_matrix = np.array(arrivals)
+    return AbsorptionTimes(
+        np.array(durations),
+        {labels[state]: arrival_matrix[:, column] for column, state in enumerate(absorbing_indices)},
+        remaining,
+    )
+
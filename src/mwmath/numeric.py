@@ -0,0 +1,114 @@
+import numbers
+from contextlib import contextmanager
+from fractions import Fraction
+from typing import Any, Callable
+
+import sympy as sp
+
+
+class NumericBackend:
+    """ The arithmetic type used for payoffs, scores, and probabilities """
+
+    def __init__(self, name: str, integer: Callable, rational: Callable, exact: bool) -> None:
+        """
+
+        :param name: the name of the backend
+        :param integer: converts an int into the backend's type
+        :param rational: converts a numerator and denominator into the backend's type
+        :param exact: True if the backend's arithmetic is exact
+        """
+        self._name = name
+        self._integer = integer
+        self._rational = rational
+        self._exact = exact
+
+    def __repr__(self) -> str:
+        return f"NumericBackend({self.name})"
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def exact(self) -> bool:
+        return self._exact
+
+    def integer(self, value: int) -> Any:
+        """
+
+        :param value: an integer
+        :return: the integer in the backend's type
+        """
+        return self._integer(value)
+
+    def rational(self, numerator: int, denominator: int) -> Any:
+        """
+
+        :param numerator: the numerator of the rational number
+        :param denominator: the denominator of the rational number
+        :return: the rational number in the backend's type
+        """
+        return self._rational(numerator, denominator)
+
+    def convert(self, value: Any) -> Any:
+        """
+
+        :param value: an int, float, Fraction, or sympy number
+        :return: the value in the backend's type
+        """
+        if self is SYMPY:
+            return value if isinstance(value, sp.Basic) else sp.nsimplify(value)
+        if self is FLOAT:
+            return float(value)
+        if isinstance(value, (int, sp.Integer)):
+            return int(value)
+        if isinstance(value, (numbers.Rational, sp.Rational)):
+            return Fraction(int(value.numerator), int(value.denominator))
+        return Fraction(value)
+
+
+SYMPY = NumericBackend("sympy", sp.Integer, sp.Rational, True)
+""" exact sympy Integer and Rational arithmetic (the default) """
+FRACTION = NumericBackend("fraction", int, Fraction, True)
+""" exact int and fractions.Fraction arithmetic, giving the same values as sympy much faster """
+FLOAT = NumericBackend("float", float, lambda numerator, denominator: numerator / denominator, False)
+""" floating point arithmetic, the fastest """
+
+BACKENDS = {backend.name: backend for backend in (SYMPY, FRACTION, FLOAT)}
+""" the backends by name """
+
+_BACKEND = SYMPY
+
+
+def backend() -> NumericBackend:
+    """
+
+    :return: the backend currently used for arithmetic
+    """
+    return _BACKEND
+
+
+def set_backend(name: str) -> NumericBackend:
+    """
+
+    :param name: the name of the backend to use ("sympy", "fraction", or "float")
+    :return: the backend that was being used
+    """
+    global _BACKEND
+    previous = _BACKEND
+    _BACKEND = BACKENDS[name]
+    return previous
+
+
+@contextmanager
+def numeric_backend(name: str):
+    """
+    Uses the named backend within a with statement.
+
+    :param name: the name of the backend to use ("sympy", "fraction", or "float")
+    """
+    previous = set_backend(name)
+    try:
+        yield _BACKEND
+    finally:
+        set_backend(previous.name)
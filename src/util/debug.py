@@ -1,9 +1,48 @@
+import inspect
+import os
+from contextlib import contextmanager
 from functools import wraps
+from typing import Callable, Union
 
 from icecream import ic  # type: ignore
 
 IC_DEPTH = 0
 
+TRACE_OFF = 0
+""" trace level showing no messages """
+TRACE_INFO = 1
+""" trace level showing messages about whole searches and scoring phases """
+TRACE_DETAIL = 2
+""" trace level also showing messages about every state searched or tile scored """
+
+_TRACE_LEVEL = TRACE_DETAIL
+""" the most detailed level of the messages shown (while ic is enabled) """
+
+VALIDATION_OFF = "off"
+""" checkup leaves methods undecorated, so they run without checks or wrapper overhead """
+VALIDATION_BOUNDARY = "boundary"
+""" checkup checks only around the outermost decorated call, not around the calls it makes to other ones """
+VALIDATION_FULL = "full"
+""" checkup checks before and after every decorated call """
+VALIDATION_LEVELS = (VALIDATION_OFF, VALIDATION_BOUNDARY, VALIDATION_FULL)
+
+VALIDATION_ENVIRONMENT = "MW_VALIDATION"
+""" the environment variable setting the validation level at import (full if it is not set) """
+
+
+def _environment_validation_level() -> str:
+    level = os.environ.get(VALIDATION_ENVIRONMENT, VALIDATION_FULL).strip().lower()
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"{VALIDATION_ENVIRONMENT}={level!r} is not one of {VALIDATION_LEVELS}")
+    return level
+
+
+_VALIDATION_LEVEL = _environment_validation_level()
+""" the validation level used when checkup decorates a method """
+
+_CHECK_DEPTH = 0
+""" the number of boundary-checked calls in progress """
+
 
 def undebug(func):
 
@@ -56,13 +95,63 @@ def debug(func):
     return wrapper_func
 
 
+def set_validation_level(level: str) -> str:
+    """
+    Sets the validation level for the methods checkup decorates from now on.
+    Methods are decorated when their module is imported, so set this before importing them
+    (or set the MW_VALIDATION environment variable).
+
+    :param level: VALIDATION_OFF, VALIDATION_BOUNDARY, or VALIDATION_FULL
+    :return: the previous level
+    """
+    global _VALIDATION_LEVEL
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"{level!r} is not one of {VALIDATION_LEVELS}")
+    previous = _VALIDATION_LEVEL
+    _VALIDATION_LEVEL = level
+    return previous
+
+
+def validation_level() -> str:
+    """
+
+    :return: the validation level used when checkup decorates a method
+    """
+    return _VALIDATION_LEVEL
+
+
 def checkup(func):
     """
     calls an object's "check()" method before and after executing the decorated method
+    (how often depends on the validation level when the method is decorated, see VALIDATION_LEVELS)
 
     :param func: function to be wrapped
-    :return: the wrapped function
+    :return: the wrapped function (or the function itself when validation is off)
     """
+    if _VALIDATION_LEVEL == VALIDATION_OFF:
+        return func
+
+    if inspect.isgeneratorfunction(func):
+        return _generator_checkup(func)
+
+    if _VALIDATION_LEVEL == VALIDATION_BOUNDARY:
+
+        @wraps(func)
+        def boundary_func(*arg, **kwargs):
+            global _CHECK_DEPTH
+            if _CHECK_DEPTH > 0:
+                return func(*arg, **kwargs)
+
+            arg[0].check()
+            _CHECK_DEPTH += 1
+            try:
+                res = func(*arg, **kwargs)
+            finally:
+                _CHECK_DEPTH -= 1
+            arg[0].check()
+            return res
+
+        return boundary_func
 
     @wraps(func)
     def wrapper_func(*arg, **kwargs):
@@ -76,10 +165,91 @@ def checkup(func):
     return wrapper_func
 
 
+def _generator_checkup(func):
+    """
+    checkup for generator functions, whose bodies run while they are iterated rather than when they are called,
+    so the checks come before the first item and after the last (and the boundary spans every step in between)
+
+    :param func: generator function to be wrapped
+    :return: the wrapped generator function
+    """
+    boundary = _VALIDATION_LEVEL == VALIDATION_BOUNDARY
+
+    @wraps(func)
+    def generator_func(*arg, **kwargs):
+        global _CHECK_DEPTH
+        checked = not boundary or _CHECK_DEPTH == 0
+        if checked:
+            arg[0].check()
+
+        generator = func(*arg, **kwargs)
+        while True:
+            if boundary:
+                _CHECK_DEPTH += 1
+            try:
+                item = next(generator)
+            except StopIteration as stop:
+                res = stop.value
+                break
+            finally:
+                if boundary:
+                    _CHECK_DEPTH -= 1
+            yield item
+
+        if checked:
+            arg[0].check()
+        return res
+
+    return generator_func
+
+
 def icp(message):
     ic(message)
 
 
+def set_trace_level(level: int) -> int:
+    """
+
+    :param level: the most detailed level of trace messages to show (TRACE_OFF, TRACE_INFO, or TRACE_DETAIL)
+    :return: the previous level
+    """
+    global _TRACE_LEVEL
+    previous = _TRACE_LEVEL
+    _TRACE_LEVEL = level
+    return previous
+
+
+@contextmanager
+def trace_level(level: int):
+    """
+    Uses the trace level within a with statement.
+
+    :param level: the most detailed level of trace messages to show
+    """
+    previous = set_trace_level(level)
+    try:
+        yield level
+    finally:
+        set_trace_level(previous)
+
+
+def trace(level: int, message: Union[str, Callable[[], str]], *args) -> None:
+    """
+    Shows a message through ic while ic is enabled (see debug and icprint) and the level is at most the trace level.
+    The message is only built when it is shown, so tracing costs little more than the call when it is off.
+
+    :param level: the level of the message (TRACE_INFO or TRACE_DETAIL)
+    :param message: a format string for the args, or a function returning the message
+    :param args: the values for the format string
+    """
+    if ic.enabled and level <= _TRACE_LEVEL:
+        if callable(message):
+            text = message()
+        else:
+            text = message.format(*args) if args else message
+        ic(text)
+
+
 class icprint:
     def __init__(self, output=False):
         self.output = output
@@ -114,3 +284,11 @@ if __name__ == "__main__":
     with icprint(False):
         icp("HIDDEN 4")
     icp("HIDDEN 5")
+
+    with icprint(True):
+        trace(TRACE_INFO, "DISPLAYED {}", 6)
+        with trace_level(TRACE_OFF):
+            trace(TRACE_INFO, "HIDDEN {}", 7)
+        with trace_level(TRACE_INFO):
+            trace(TRACE_DETAIL, lambda: "HIDDEN 8")
+    trace(TRACE_INFO, "HIDDEN {}", 9)
@@ -1,12 +1,19 @@
+import os
+import random
+import subprocess
+import sys
+import time
+
 import sympy as sp
-import copy
 
 from pytest import mark
 from pytest_check import check  # type: ignore
 
-from mwmath.monte_carlo import set_seed
-from mwmath.extensive_form import GameMove
-from mwgame.azul import AzulTiles, AzulBoard, AzulState, AzulMove
+from util.debug import VALIDATION_ENVIRONMENT, VALIDATION_OFF
+from mwmath.monte_carlo import set_seed, bad_seed_message
+from mwmath.numeric import numeric_backend
+from mwmath.extensive_form import GameMove, TranspositionTable, VectorBayesianStrategy, run_rollouts, search_stats
+from mwgame.azul import AzulTiles, AzulBoard, AzulState, AzulMove, AzulBag, AzulGame, AzulTablebase, azul_tablebase
 
 class TestAzul:
 
@@ -129,6 +136,91 @@ class TestAzul:
                 AzulMove(AzulTiles.BLUE, 3, 5, 0)
             )
 
+    @staticmethod
+    def test_rational_transposition_table() -> None:
+        table = TranspositionTable()
+        state = TestAzul.state(
+            (
+                AzulState.rational_strategy(AzulState.rank, table),
+                AzulState.rational_strategy(AzulState.rank, table),
+            )
+        )
+        outcome = state.outcome
+        with check:
+            assert outcome.payoffs == (28, 25)
+        with check:
+            assert outcome.moves == (
+                AzulMove(AzulTiles.RED, 3, 5, 3),
+                AzulMove(AzulTiles.CYAN, 1, 5, 2),
+                AzulMove(AzulTiles.BLUE, 3, 5, 0)
+            )
+        with check:
+            assert table.misses == len(table)
+
+        table.hits = 0
+        state = TestAzul.state(
+            (
+                AzulState.rational_strategy(AzulState.rank, table),
+                AzulState.rational_strategy(AzulState.rank, table),
+            )
+        )
+        with check:
+            assert state.outcome == outcome
+        with check:
+            assert table.hits > 0
+
+        table = TranspositionTable(max_size=2)
+        state = TestAzul.state(
+            (
+                AzulState.rational_strategy(AzulState.rank, table),
+                AzulState.rational_strategy(AzulState.rank, table),
+            )
+        )
+        with check:
+            assert state.outcome == outcome
+        with check:
+            assert len(table) == 2
+
+    @staticmethod
+    def test_alphabeta() -> None:
+        expected_moves = (
+            AzulMove(AzulTiles.RED, 3, 5, 3),
+            AzulMove(AzulTiles.CYAN, 1, 5, 2),
+            AzulMove(AzulTiles.BLUE, 3, 5, 0)
+        )
+        for order in (None, lambda state, moves: list(reversed(moves))):
+            state = TestAzul.state(
+                (
+                    AzulState.alphabeta_strategy(AzulState.rank, order),
+                    AzulState.alphabeta_strategy(AzulState.rank, order),
+                )
+            )
+            outcome = state.outcome
+            with check:
+                assert outcome.payoffs == (28, 25)
+            with check:
+                assert outcome.moves == expected_moves
+
+    @staticmethod
+    @mark.parametrize("workers, second_ply", [(1, False), (2, False), (3, True)])
+    def test_parallel(workers, second_ply) -> None:
+        state = TestAzul.state(
+            (AzulState.rational_strategy(AzulState.rank), AzulState.rational_strategy(AzulState.rank))
+        )
+        with search_stats() as stats:
+            outcome = state.parallel_outcome(AzulState.rank, workers, second_ply)
+        with check:
+            assert outcome.payoffs == (28, 25)
+        # only the plies split among the workers are expanded in this process
+        with check:
+            assert stats.expanded > 1 if second_ply else stats.expanded == 1
+        with check:
+            assert outcome.moves == (
+                AzulMove(AzulTiles.RED, 3, 5, 3),
+                AzulMove(AzulTiles.CYAN, 1, 5, 2),
+                AzulMove(AzulTiles.BLUE, 3, 5, 0)
+            )
+
     @staticmethod
     def test_bayesian() -> None:
 
@@ -150,79 +242,420 @@ class TestAzul:
             )
 
     @staticmethod
-    @mark.parametrize("trials", [10_000])
-    def test_monte_carlo(trials) -> None:
-        seed = set_seed()
-        blue_cummulative = (0, 0)
-        red_cummulative = (0, 0)
-        cyan_cummulative = (0, 0)
-        for _ in range(trials):
+    @mark.parametrize("name", ["sympy", "fraction", "float"])
+    def test_vector_bayesian(name) -> None:
+        with numeric_backend(name):
+            expected = TestAzul.state(
+                (AzulState.rational_strategy(AzulState.rank), AzulState.bayesian_strategy(TestAzul.weights))
+            ).outcome
+            vector = AzulState.vector_bayesian_strategy(TestAzul.weights)
+            assert isinstance(vector, VectorBayesianStrategy)
+            strategies = (AzulState.rational_strategy(AzulState.rank), vector)
+            with check:
+                assert TestAzul.state(strategies).outcome == expected
+            with check:
+                assert TestAzul.state(strategies).outcome_in_place() == expected
+            with check:
+                assert vector.table.hits > 0
+            # every position is looked up once before its outcome is stored, and found after that
+            with check:
+                assert vector.table.misses == len(vector.table)
 
-            state = TestAzul.state(
-                (
-                    AzulState.rational_strategy(AzulState.rank),
-                    AzulState.monte_carlo_strategy(TestAzul.weights),
-                )
-            )
+    @staticmethod
+    def test_in_place() -> None:
+        for strategies in (
+            (AzulState.rational_strategy(AzulState.rank), AzulState.rational_strategy(AzulState.rank)),
+            (AzulState.rational_strategy(AzulState.rank), AzulState.bayesian_strategy(TestAzul.weights)),
+        ):
+            state = TestAzul.state(strategies)
+            key = state.position_key()
+            outcome = state.outcome_in_place()
+            with check:
+                assert state.position_key() == key
+            with check:
+                assert state.history == ()
+            with check:
+                assert outcome == TestAzul.state(strategies).outcome
 
-            # try blue
-            blue_state = copy.deepcopy(state)
-            blue_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.BLUE] = 0
-            blue_state.boards[0].patterns[0] = AzulBoard.PatternLine(
-                1, AzulTiles.BLUE, 1
-            )
-            blue_state.boards[0].broken_tiles += 2
-            blue_state.player = 1
-            blue_state.clear_stashed_outcome()
-            blue_outcome = blue_state.outcome
-            blue_cummulative = tuple(
-                blue_cummulative[i] + blue_outcome.payoffs[i] for i in range(2)
-            )
+    @staticmethod
+    def test_scoring() -> None:
+        wall = sp.Matrix([
+            [1, 1, 0, 1, 1],
+            [0, 0, 1, 0, 0],
+            [0, 0, 1, 0, 0],
+            [0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0],
+        ])
+        board = AzulBoard(0, wall)
+        with check:
+            assert board.wall == wall
+        board.score_tile(0, 2)
+        with check:
+            assert board.score == 8
 
-            # try red
-            red_state = copy.deepcopy(state)
-            red_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.RED] = 0
-            red_state.boards[0].patterns[4] = AzulBoard.PatternLine(
-                5, AzulTiles.RED, 4
-            )
-            red_state.boards[0].broken_tiles += 0
-            red_state.player = 1
-            red_state.clear_stashed_outcome()
-            red_outcome = red_state.outcome
-            red_cummulative = tuple(
-                red_cummulative[i] + red_outcome.payoffs[i] for i in range(2)
-            )
+        board = AzulBoard(0, sum(1 << cell for cell in range(5)) | sum(1 << (6 * row) for row in range(5)))
+        board.score_tile(4, 4)
+        with check:
+            assert board.score == 1
+        board.score_game()
+        with check:
+            assert board.score == 1 + 2 + 10
 
-            # try cyan
-            cyan_state = copy.deepcopy(state)
-            cyan_state.tiles.piles[AzulTiles.CENTER_PILE][AzulTiles.CYAN] = 0
-            cyan_state.boards[0].patterns[1] = AzulBoard.PatternLine(
-                2, AzulTiles.CYAN, 1
-            )
-            cyan_state.boards[0].broken_tiles += 0
-            cyan_state.player = 1
-            cyan_state.clear_stashed_outcome()
-            cyan_outcome = cyan_state.outcome
-            cyan_cummulative = tuple(
-                cyan_cummulative[i] + cyan_outcome.payoffs[i] for i in range(2)
+    @staticmethod
+    def symmetric_state(strategies, dedupe: bool) -> AzulState:
+        state = TestAzul.state(strategies)
+        tiles = AzulTiles(
+            [  # b, y, r, k, c, 1 #
+                [0, 0, 0, 0, 0, 0],
+                [1, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [1, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 1, 0, 0, 0],
+            ]
+        )
+        return AzulState(0, tiles, state.boards, strategies, dedupe=dedupe)
+
+    @staticmethod
+    def test_dedupe() -> None:
+        strategies = (AzulState.rational_strategy(AzulState.rank),) * 2
+        state = TestAzul.symmetric_state(strategies, False)
+        with check:
+            assert len(list(state.branch_states)) == 3
+        with search_stats() as stats:
+            outcome = state.outcome
+
+        state = TestAzul.symmetric_state(strategies, True)
+        with check:
+            assert len(list(state.branch_states)) == 2
+        with check:
+            assert len(list(state.moves)) == 2 * AzulBoard.ROW_COUNT
+        with search_stats() as deduped_stats:
+            deduped_outcome = state.outcome
+        with check:
+            assert deduped_outcome.payoffs == outcome.payoffs
+        with check:
+            assert sum(deduped_stats.nodes.values()) < sum(stats.nodes.values())
+        with check:
+            assert state.outcome_in_place().payoffs == outcome.payoffs
+
+        canonical = state.canonical()
+        with check:
+            assert canonical.tiles.piles[0] == [1, 0, 0, 0, 0, 0] and canonical.tiles.piles[1] == [1, 0, 0, 0, 0, 0]
+        with check:
+            assert canonical.canonical_key == state.canonical_key
+        with check:
+            assert canonical.key != state.key
+
+    @staticmethod
+    @mark.parametrize("players", [2, 4])
+    def test_game(players: int) -> None:
+        policies = (AzulGame.greedy_policy,) + (AzulGame.random_policy,) * (players - 1)
+        game = AzulGame(policies, seed=7)
+        game_over = False
+        while not game_over:
+            game_over = game.play_round()
+            for color in range(AzulTiles.FIRST_PLAYER):
+                tiles = game.bag.bag[color] + game.bag.lid[color]
+                for board in game.boards:
+                    tiles += sum(board.has_tile(row, AzulBoard.column(color=color, row=row)) for row in range(5))
+                    tiles += sum(pattern.count for pattern in board.patterns if pattern.color == color)
+                with check:
+                    assert tiles == AzulBag.TILES_PER_COLOR
+        result = game.play()
+        with check:
+            assert any(board.wall_tiles & mask == mask for board in game.boards for mask in AzulBoard.ROW_MASKS)
+        with check:
+            assert result.moves is not None and len(result.moves) == result.rounds
+        with check:
+            assert max(result.scores) == result.scores[result.winners[0]]
+
+        compact = AzulGame(policies, seed=7, compact=True).play()
+        with check:
+            assert compact.scores == result.scores and compact.moves is None
+
+    @staticmethod
+    def test_exhausted_bag() -> None:
+        game = AzulGame((AzulGame.random_policy,) * 2, seed=7, compact=True)
+        board = game.boards[0]
+        for row, pattern in enumerate(board.patterns):
+            pattern.color = AzulBoard.color(row=row, column=0)
+            pattern.count = pattern.capacity
+        board.score_round()
+        score = board.score
+        game.bag.bag = [0 for _ in range(AzulTiles.FIRST_PLAYER)]
+        game.bag.lid = [0 for _ in range(AzulTiles.FIRST_PLAYER)]
+        with check:
+            assert game.play_round()
+        with check:
+            assert board.score == score + 7
+        with check:
+            assert game.play().rounds == 0
+
+    @staticmethod
+    def test_throughput() -> None:
+        # checkup is applied at import, so the games are timed in a fresh interpreter with validation off
+        # each game is timed at its fastest of a few plays, which leaves out most of the noise of a busy machine
+        script = """
+import time
+from mwgame.azul import AzulGame
+seconds = 0.0
+for seed in range(100):
+    fastest = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        AzulGame((AzulGame.random_policy,) * 2, seed=seed, compact=True).play()
+        fastest = min(fastest, time.perf_counter() - start)
+    seconds += fastest
+print(100 / seconds)
+"""
+        environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        environment[VALIDATION_ENVIRONMENT] = VALIDATION_OFF
+        result = subprocess.run([sys.executable, "-c", script], env=environment, capture_output=True, text=True)
+        with check:
+            assert result.returncode == 0, result.stderr
+        # about 1000 games a second on a quiet core, with room left for a busy one
+        with check:
+            assert float(result.stdout) >= 500
+
+    @staticmethod
+    def test_win_rates() -> None:
+        summary = AzulGame.win_rates((AzulGame.greedy_policy, AzulGame.random_policy), 50, seed=1, batch_size=20)
+        with check:
+            assert summary.trials == 50
+        with check:
+            assert summary.means[0] > 0.9
+        with check:
+            assert abs(sum(summary.means) - 1) < 1e-9
+
+    @staticmethod
+    def test_deepening() -> None:
+        strategies = (AzulState.rational_strategy(AzulState.rank),) * 2
+        outcome = TestAzul.state(strategies).outcome
+        assert outcome.moves is not None
+        limited = AzulState.depth_limited_strategy(AzulState.rank, AzulState.heuristic_evaluation, len(outcome.moves))
+        with check:
+            assert TestAzul.state((limited,) * 2).outcome.payoffs == outcome.payoffs
+
+        with check:
+            assert AzulBoard(0).projected_score() == 0
+        board = TestAzul.state(strategies).boards[1]
+        with check:
+            assert board.projected_score() > board.score
+
+        budget = 0.1
+        deepening = AzulState.iterative_deepening_strategy(AzulState.rank, AzulState.heuristic_evaluation, budget)
+        state = AzulState(0, AzulBag(random.Random(1)).fill(5), (AzulBoard(0), AzulBoard(1)), (deepening,) * 2)
+        start = time.perf_counter()
+        moves = deepening(state).moves
+        with check:
+            assert time.perf_counter() - start < 3 * budget
+        with check:
+            assert deepening.completed_depth >= 1
+        with check:
+            assert moves is not None and moves[0] in list(state.moves)
+
+    @staticmethod
+    def test_row_policy() -> None:
+        strategies = (AzulState.rational_strategy(AzulState.rank),) * 2
+        exhaustive = TestAzul.state(strategies)
+        with search_stats() as exhaustive_stats:
+            outcome = exhaustive.outcome
+        with check:
+            assert exhaustive_stats.labels == {"row_policy": "exhaustive"}
+
+        def state(row_policy: str, row_candidates: int = 2) -> AzulState:
+            state = TestAzul.state(strategies)
+            return AzulState(0, state.tiles, state.boards, strategies, row_policy=row_policy, row_candidates=row_candidates)
+
+        with search_stats() as stats:
+            top_k_outcome = state("top_k", AzulBoard.ROW_COUNT).outcome
+        with check:
+            assert top_k_outcome == outcome
+        with check:
+            assert stats.labels == {"row_policy": "top_k", "row_candidates": AzulBoard.ROW_COUNT}
+
+        with search_stats() as stats:
+            state("top_k").outcome
+        with check:
+            assert stats.counters["searched_rows"] < exhaustive_stats.counters["searched_rows"]
+
+        with search_stats() as stats:
+            heuristic = state("heuristic")
+            heuristic_outcome = heuristic.outcome
+        with check:
+            assert "searched_rows" not in stats.counters
+        with check:
+            assert sum(stats.nodes.values()) < sum(exhaustive_stats.nodes.values())
+        with check:
+            assert heuristic_outcome == heuristic.outcome_in_place()
+
+    @staticmethod
+    def test_tablebase(tmp_path) -> None:
+        strategies = (AzulState.rational_strategy(AzulState.rank),) * 2
+        outcome = TestAzul.state(strategies).outcome
+
+        tablebase = AzulTablebase(max_tiles=7)
+        with azul_tablebase(tablebase):
+            with check:
+                assert TestAzul.state(strategies).outcome == outcome
+        with check:
+            assert len(tablebase) > 0
+        path = str(tmp_path / "azul.tablebase")
+        tablebase.save(path)
+
+        loaded = AzulTablebase.load(path)
+        with azul_tablebase(loaded):
+            with search_stats() as stats:
+                loaded_outcome = TestAzul.state(strategies).outcome
+            with check:
+                assert TestAzul.state((AzulState.rational_strategy(AzulState.rank),) * 2).outcome == outcome
+        with check:
+            assert loaded_outcome == outcome
+        with check:
+            assert loaded.hits == 2 and loaded.misses == 0 and sum(stats.nodes.values()) == 0
+
+        small = AzulTablebase(max_tiles=2)
+        small.build(TestAzul.state(strategies).boards, colors=(AzulTiles.BLUE, AzulTiles.RED))
+        with check:
+            # each of 5 centers, with or without the first player tile, for either player to move
+            assert len(small) >= 5 * 2 * 2
+
+    @staticmethod
+    def test_bytes() -> None:
+        strategies = (AzulState.rational_strategy(AzulState.rank),) * 2
+        state = TestAzul.state(strategies)
+        data = state.to_bytes()
+        with check:
+            assert len(data) == AzulState.SIZE
+        decoded = AzulState.from_bytes(data, strategies)
+        with check:
+            assert decoded.to_bytes() == data
+        with check:
+            assert decoded.key == state.key
+        with check:
+            assert decoded.outcome == state.outcome
+
+        game = AzulGame((AzulGame.greedy_policy,) * 4, seed=3)
+        game.play_round()
+        state = AzulState(1, AzulTiles([[1, 2, 0, 0, 1, 0]] * 9 + [[0, 0, 3, 0, 0, 1]]), game.boards, strategies)
+        decoded = AzulState.from_bytes(state.to_bytes(), strategies, row_policy="heuristic")
+        with check:
+            assert len(state.to_bytes()) == AzulState.SIZE
+        with check:
+            assert decoded.key == state.key and decoded.tiles.piles == state.tiles.piles
+        with check:
+            assert decoded.row_policy == "heuristic"
+
+    @staticmethod
+    def test_key() -> None:
+        state = TestAzul.state((AzulState.rational_strategy(AzulState.rank),) * 2)
+        key = state.key
+        for move in list(state.moves):
+            state.apply(move)
+            with check:
+                assert state.key == state.position_key()
+            for reply in list(state.moves):
+                state.apply(reply)
+                with check:
+                    assert state.key == state.position_key()
+                state.undo(reply)
+            state.undo(move)
+            with check:
+                assert state.key == key
+
+    @staticmethod
+    def test_iteratively() -> None:
+        for strategies in (
+            (AzulState.rational_strategy(AzulState.rank), AzulState.rational_strategy(AzulState.rank)),
+            (AzulState.rational_strategy(AzulState.rank), AzulState.bayesian_strategy(TestAzul.weights)),
+        ):
+            state = TestAzul.state(strategies)
+            key = state.position_key()
+            outcome = state.outcome_iteratively()
+            with check:
+                assert state.position_key() == key
+            with check:
+                assert outcome == TestAzul.state(strategies).outcome
+
+    @staticmethod
+    @mark.parametrize("name", ["fraction", "float"])
+    def test_numeric_backend(name) -> None:
+        expected_rational = TestAzul.state(
+            (AzulState.rational_strategy(AzulState.rank), AzulState.rational_strategy(AzulState.rank))
+        ).outcome
+        expected_bayesian = TestAzul.state(
+            (AzulState.rational_strategy(AzulState.rank), AzulState.bayesian_strategy(TestAzul.weights))
+        ).outcome
+        with numeric_backend(name) as numeric:
+            rational = TestAzul.state(
+                (AzulState.rational_strategy(AzulState.rank), AzulState.rational_strategy(AzulState.rank))
+            ).outcome
+            bayesian = TestAzul.state(
+                (AzulState.rational_strategy(AzulState.rank), AzulState.bayesian_strategy(TestAzul.weights))
+            ).outcome
+        with check:
+            assert all(not isinstance(payoff, sp.Basic) for payoff in rational.payoffs + bayesian.payoffs)
+        for outcome, expected in ((rational, expected_rational), (bayesian, expected_bayesian)):
+            with check:
+                assert outcome.moves == expected.moves
+            if numeric.exact:
+                with check:
+                    assert outcome.payoffs == expected.payoffs
+            else:
+                with check:
+                    assert all(abs(payoff - value) < 1e-9 for payoff, value in zip(outcome.payoffs, expected.payoffs))
+
+    @staticmethod
+    def monte_carlo_state(color: int) -> AzulState:
+        """
+
+        :param color: the color player 0 takes from the center pile before the monte carlo player moves
+        :return: the state after player 0 takes that color
+        """
+        state = TestAzul.state(
+            (
+                AzulState.rational_strategy(AzulState.rank),
+                AzulState.monte_carlo_strategy(TestAzul.weights),
             )
+        )
+        state.tiles.piles[AzulTiles.CENTER_PILE][color] = 0
+        if color == AzulTiles.BLUE:
+            state.boards[0].patterns[0] = AzulBoard.PatternLine(1, AzulTiles.BLUE, 1)
+            state.boards[0].broken_tiles += 2
+        elif color == AzulTiles.RED:
+            state.boards[0].patterns[4] = AzulBoard.PatternLine(5, AzulTiles.RED, 4)
+        else:
+            assert color == AzulTiles.CYAN
+            state.boards[0].patterns[1] = AzulBoard.PatternLine(2, AzulTiles.CYAN, 1)
+        state.player = 1
+        state.clear_stashed_outcome()
+        return state
 
-        blue_mean = tuple(blue_cummulative[i] / trials for i in range(2))
-        red_mean = tuple(red_cummulative[i] / trials for i in range(2))
-        cyan_mean = tuple(cyan_cummulative[i] / trials for i in range(2))
+    @staticmethod
+    @mark.parametrize("trials", [10_000])
+    def test_monte_carlo(trials) -> None:
+        seed = set_seed()
+        for color, expected in ((AzulTiles.BLUE, 2.0), (AzulTiles.RED, 3.2), (AzulTiles.CYAN, 3.4)):
+            summary = run_rollouts(lambda: TestAzul.monte_carlo_state(color), trials)
+            with check:
+                # Figure 6.10, p. 128
+                assert (
+                    abs((summary.means[0] - summary.means[1]) - expected) < 1e-1
+                ), bad_seed_message(seed, trials)
 
+    @staticmethod
+    @mark.parametrize("workers", [None, 2])
+    def test_rollouts(workers) -> None:
+        trials = 100
+        summary = run_rollouts(
+            lambda: TestAzul.monte_carlo_state(AzulTiles.CYAN), trials, batch_size=30, workers=workers, seed=0
+        )
         with check:
-            # Figure 6.10, p. 128
-            assert (
-                abs((blue_mean[0] - blue_mean[1]) - 2.0) < 1e-1
-            ), bad_seed_message(seed, trials)
+            assert summary == run_rollouts(
+                lambda: TestAzul.monte_carlo_state(AzulTiles.CYAN), trials, batch_size=30, seed=0
+            )
         with check:
-            # Figure 6.10, p. 128
-            assert (
-                abs((red_mean[0] - red_mean[1]) - 3.2) < 1e-1
-            ), bad_seed_message(seed, trials)
+            assert summary.trials == trials
         with check:
-            # Figure 6.10, p. 128
-            assert (
-                abs((cyan_mean[0] - cyan_mean[1]) - 3.4) < 1e-1
-            ), bad_seed_message(seed, trials)
+            assert all(error < 1 for error in summary.standard_errors)
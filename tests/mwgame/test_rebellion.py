@@ -1,7 +1,8 @@
 from collections import defaultdict
 
+import numpy as np
 import sympy as sp
-from pytest import mark
+from pytest import mark, raises
 
 from mwmath.monte_carlo import set_seed, bad_seed_message
 from mwmath.markov import (
@@ -10,6 +11,11 @@ from mwmath.markov import (
     to_infinity,
     markov,
     markov_n,
+    absorbing_chain,
+    long_run,
+    SparseChain,
+    simulate,
+    absorption_times,
     is_distribution, distribution_to_column,
 )
 
@@ -67,6 +73,64 @@ class TestSimple:
         # Example, p. 116
         assert on == rat_mat([[12]], 7)
 
+    @staticmethod
+    def test_long_run() -> None:
+        # state 0 is transient, states 1 and 2 are an ergodic class, and state 3 is absorbing
+        p = sp.Matrix(
+            [
+                [sp.Rational(1, 2), 0, 0, 0],
+                [sp.Rational(1, 4), sp.Rational(1, 2), sp.Rational(1, 3), 0],
+                [0, sp.Rational(1, 2), sp.Rational(2, 3), 0],
+                [sp.Rational(1, 4), 0, 0, 1],
+            ]
+        )
+        expected = rat_mat([[0, 0, 0, 0], [2, 4, 4, 0], [3, 6, 6, 0], [5, 0, 0, 10]], 10)
+        assert to_infinity(p) == expected
+        assert mat_max(to_infinity(p.applyfunc(sp.Float)) - expected) < 1e-12
+        assert mat_max(p**200 - expected) < 1e-12
+        with raises(ValueError):
+            long_run(sp.Matrix([[0, 1], [1, 0]]))
+
+    @staticmethod
+    def test_tie_y_absorption_times() -> None:
+        p = TestSimple.TIE_Y_MAT
+        times = absorption_times(p, 0)
+        assert times.remaining < 1e-12
+        assert times.duration_pmf[0] == 0
+        for k in range(1, 10):
+            # the battle lasts exactly k rounds with probability (5/12)^(k-1) (7/12)
+            assert abs(times.duration_pmf[k] - float(sp.Rational(5, 12) ** (k - 1) * sp.Rational(7, 12))) < 1e-15
+        for k in (2, 10):
+            assert abs(times.survival(k) - float((p**k)[0, 0])) < 1e-12
+            for state in (1, 2, 3):
+                assert abs(times.cumulative_arrivals(state)[k] - float((p**k)[state, 0])) < 1e-12
+
+    @staticmethod
+    def test_tie_y_absorbing_chain() -> None:
+        q = rat_mat([[5]], 12)
+        r = rat_mat([[5], [1], [1]], 12)
+        chain = absorbing_chain(q, r)
+        assert chain.absorption == rat_mat([[5], [1], [1]], 7)
+        assert chain.expected_steps == rat_mat([[12]], 7)
+        # the number of rounds is geometric with p = 7 / 12, whose variance is (1 - p) / p^2
+        assert chain.step_variance == sp.Matrix([[sp.Rational(60, 49)]])
+
+        # the second transient state only returns to itself, so it is never absorbed
+        with raises(ValueError):
+            absorbing_chain(rat_mat([[5, 0], [0, 12]], 12), rat_mat([[7, 0]], 12))
+
+    @staticmethod
+    def test_transition_matrix_range() -> None:
+        # the walk from state 2 can leave states 1 to 2, which is left out of the matrix
+        def distribution(state):
+            return {state: sp.Rational(1, 2), state + 1: sp.Rational(1, 2)}
+
+        assert transition_matrix(2, distribution) == rat_mat([[1, 0], [1, 1]], 2)
+
+        chain = SparseChain(distribution, [1], within=range(1, 3))
+        assert chain.states == [1, 2] and 3 not in chain
+        assert chain.distribution(2) == {2: sp.Rational(1, 2)}
+
     @staticmethod
     @mark.parametrize("power", [5])
     def test_tie_y_markov_powers(power: int) -> None:
@@ -687,6 +751,70 @@ class TestExciting:
         # Example, p. 119
         assert mat_max(sp.ones(1, n.rows) * n - TestExciting.EXPECTED_EXCITING_ONER) < 1e-15
 
+    @staticmethod
+    def test_exciting_sparse_chain():
+        calls = defaultdict(int)
+
+        def counted_distribution(state):
+            calls[state] += 1
+            return exciting_transition_distribution(state)
+
+        chain = SparseChain(counted_distribution, [1])
+        assert set(chain.states) == set(range(1, 15))
+        assert chain.to_matrix(range(1, 15)) == TestExciting.EXPECTED_EXCITING_P
+        assert chain.to_matrix(range(1, 15)) == chain.to_matrix(range(1, 15))
+        assert all(count == 1 for count in calls.values())
+        assert [state for state in range(1, 15) if chain.is_absorbing(state)] == [11, 12, 13, 14]
+
+        probabilities, next_states, row_starts = chain.to_csr(range(1, 15))
+        assert np.allclose(np.add.reduceat(probabilities, row_starts[:-1]), 1)
+        assert all(next_states[row_starts[10]:row_starts[11]] == [10])
+
+    @staticmethod
+    def test_large_sparse_chain():
+        # a gambler's ruin from 5_000 with absorbing states 0 and 10_000
+        size = 10_000
+
+        def distribution(state):
+            if state in (0, size):
+                return {state: 1}
+            return {state - 1: sp.Rational(1, 2), state + 1: sp.Rational(1, 2)}
+
+        chain = SparseChain(distribution, [size // 2])
+        assert len(chain) == size + 1
+        probabilities, next_states, row_starts = chain.to_csr()
+        assert len(row_starts) == size + 2 and len(probabilities) == 2 * size
+
+    @staticmethod
+    def test_exciting_absorption_times():
+        chain = SparseChain(exciting_transition_distribution, range(1, 15))
+        p_3 = TestExciting.EXPECTED_EXCITING_P**3
+        for initial_state in range(1, 11):
+            times = absorption_times(chain, initial_state)
+            assert times.remaining < 1e-12
+            absorbed = sp.Matrix([[times.arrivals[state].sum()] for state in range(11, 15)])
+            assert mat_max(absorbed - TestExciting.EXPECTED_EXCITING_RN[:, initial_state - 1]) < 1e-10
+            assert abs(times.mean() - TestExciting.EXPECTED_EXCITING_ONER[0, initial_state - 1]) < 1e-10
+            assert abs(times.survival(3) - sum(p_3[0:10, initial_state - 1])) < 1e-12
+
+    @staticmethod
+    def test_exciting_absorbing_chain():
+        p = transition_matrix(14, exciting_transition_distribution)
+        q = p[0:10, 0:10]
+        r = p[10:14, 0:10]
+        chain = absorbing_chain(q, r)
+        assert chain.absorption == TestExciting.EXPECTED_EXCITING_RN
+        assert to_infinity(p)[10:14, 0:10] == TestExciting.EXPECTED_EXCITING_RN
+        assert chain.expected_steps == TestExciting.EXPECTED_EXCITING_ONER
+        n = markov_n(q)
+        ones = sp.ones(1, n.rows)
+        assert chain.step_variance == ones * n * (2 * n - sp.eye(n.rows)) - (ones * n).applyfunc(lambda t: t**2)
+
+        numeric_chain = absorbing_chain(np.array(q, dtype=float), np.array(r, dtype=float))
+        assert np.allclose(numeric_chain.absorption, np.array(chain.absorption, dtype=float), rtol=0, atol=1e-12)
+        assert np.allclose(numeric_chain.expected_steps, np.array(chain.expected_steps, dtype=float), rtol=0, atol=1e-12)
+        assert np.allclose(numeric_chain.step_variance, np.array(chain.step_variance, dtype=float), rtol=0, atol=1e-12)
+
     @staticmethod
     @mark.parametrize(
         "initial_state, trials", [(i, 100_000) for i in range(1, 15)]
@@ -732,3 +860,64 @@ class TestExciting:
         assert (
             abs(duration - expected_duration) < 0.005
         ), bad_seed_message(seed, trials)
+
+    @staticmethod
+    @mark.parametrize(
+        "initial_state, trials", [(i, 100_000) for i in range(1, 11)]
+    )
+    def test_exciting_outcomes_simulated(initial_state, trials):
+        seed = set_seed()
+        chain = SparseChain(exciting_transition_distribution, range(1, 15))
+        simulation = simulate(chain, [initial_state], trials, seed=seed)
+        assert simulation.trials == trials and simulation.unfinished == 0
+        assert sum(simulation.duration_counts.values()) == trials
+        distribution = simulation.terminal_distribution()
+        column = distribution_to_column(len(EXCITING_BATTLE_STATES), distribution)[10:14, 0]
+        expected_column = TestExciting.EXPECTED_EXCITING_RN[:, initial_state - 1]
+        assert (
+            mat_max(column - expected_column) < 0.005
+        ), bad_seed_message(seed, trials)
+        expected_duration = TestExciting.EXPECTED_EXCITING_ONER[:, initial_state - 1][0]
+        assert (
+            abs(simulation.mean_duration() - expected_duration) < 0.01
+        ), bad_seed_message(seed, trials)
+
+        matrix_simulation = simulate(chain.to_matrix(range(1, 15)), [initial_state - 1], trials, seed=seed)
+        matrix_distribution = {state + 1: p for state, p in matrix_simulation.terminal_distribution().items()}
+        column = distribution_to_column(len(EXCITING_BATTLE_STATES), matrix_distribution)[10:14, 0]
+        assert (
+            mat_max(column - expected_column) < 0.005
+        ), bad_seed_message(seed, trials)
+
+
+class TestSimulate:
+
+    @staticmethod
+    def test_sampler() -> None:
+        # a gambler's ruin from 5 with absorbing states 0 and 10, which ends at 10 half of the time after 25 steps
+        def sampler(states, rng):
+            return states + 2 * (rng.random(len(states)) < 0.5) - 1
+
+        simulation = simulate(sampler, [5], 20_000, absorbing=(0, 10), seed=1)
+        assert set(simulation.terminal_counts) == {0, 10}
+        assert abs(simulation.terminal_distribution()[10] - 0.5) < 0.02
+        assert abs(simulation.mean_duration() - 25) < 1
+        assert min(simulation.duration_counts) == 5
+
+        short = simulate(sampler, [5, 9], 10, absorbing=(0, 10), seed=1, max_steps=1)
+        assert short.trials == 20 and short.unfinished + short.terminal_counts.get(10, 0) == 20
+
+    @staticmethod
+    def test_tuple_states() -> None:
+        # a walk on (row, column) cells that stops at either end of the row
+        def distribution(cell):
+            row, column = cell
+            if column in (0, 2):
+                return {cell: 1}
+            return {(row, column - 1): sp.Rational(1, 2), (row, column + 1): sp.Rational(1, 2)}
+
+        chain = SparseChain(distribution, [(0, 1)])
+        simulation = simulate(chain, [(0, 1)], 1_000, seed=1)
+        assert simulation.trials == 1_000 and set(simulation.terminal_counts) == {(0, 0), (0, 2)}
+        assert simulation.duration_counts == {1: 1_000}
+
@@ -0,0 +1,313 @@
+import copy
+import json
+import math
+import random
+import time
+
+import sympy as sp
+from pytest import raises
+from pytest_check import check  # type: ignore
+
+from mwmath.numeric import numeric_backend
+from mwmath.extensive_form import (
+    BinTreeState,
+    GameMove,
+    GameOutcome,
+    GameState,
+    TranspositionTable,
+    run_rollouts,
+    search_stats,
+)
+
+LEFT = BinTreeState.LEFT
+RIGHT = BinTreeState.RIGHT
+
+PAYOFFS = {
+    (LEFT, LEFT): (sp.Integer(3), sp.Integer(-3)),
+    (LEFT, RIGHT): (sp.Integer(2), sp.Integer(-2)),
+    (RIGHT, LEFT): (sp.Integer(9), sp.Integer(-9)),
+    (RIGHT, RIGHT): (sp.Integer(-5), sp.Integer(5)),
+}
+""" a zero-sum game where the first player should go LEFT and the second player should then go RIGHT """
+
+
+def state(strategy) -> GameState:
+    return BinTreeState(0, (strategy, strategy), PAYOFFS)
+
+
+class BranchingTreeState(BinTreeState):
+    """ a BinTreeState searched through its branch states rather than in place """
+
+    @property
+    def searchable_in_place(self) -> bool:
+        return False
+
+
+class CountdownState(GameState):
+    """ a game where the players take turns counting down, and the player who reaches zero scores a point """
+
+    def __init__(self, count: int, strategies) -> None:
+        super().__init__(0, strategies)
+        self.count = count
+
+    @property
+    def game_over(self) -> bool:
+        return self.count == 0
+
+    def compute_outcome(self) -> GameOutcome:
+        winner = (self.player - 1) % self.players
+        return GameOutcome(tuple(sp.Integer(int(p == winner)) for p in range(self.players)), self.history)
+
+    def position_key(self):
+        return self.player, self.count
+
+    @property
+    def moves(self):
+        yield from (GameMove(),)
+
+    def apply(self, move: GameMove) -> None:
+        self.count -= 1
+        self._player = (self.player + 1) % self.players
+        self._history = self._history + (move,)
+        self.invalidate_key()
+
+    def undo(self, move: GameMove) -> None:
+        self.count += 1
+        self._player = (self.player - 1) % self.players
+        self._history = self._history[:-1]
+        self.invalidate_key()
+
+
+class StuckState(CountdownState):
+    """ a countdown in which no one can move """
+
+    @property
+    def moves(self):
+        yield from ()
+
+
+class CoinState(GameState):
+    """ a game that is over before it starts, paying a large amount plus a coin flip """
+
+    def __init__(self) -> None:
+        super().__init__(0, (None,))
+
+    @property
+    def game_over(self) -> bool:
+        return True
+
+    def compute_outcome(self) -> GameOutcome:
+        return GameOutcome((1e9 + random.randrange(2),), self.history)
+
+    def position_key(self):
+        return self.player
+
+
+class TestRational:
+
+    @staticmethod
+    def test_rational() -> None:
+        outcome = state(GameState.rational_strategy(BinTreeState.rank)).outcome
+        with check:
+            assert outcome.payoffs == (2, -2)
+        with check:
+            assert outcome.moves == (LEFT, RIGHT)
+
+    @staticmethod
+    def test_iteratively() -> None:
+        for strategy in (
+            GameState.rational_strategy(BinTreeState.rank),
+            GameState.rational_strategy(BinTreeState.rank, TranspositionTable()),
+            GameState.bayesian_strategy(lambda state, move: sp.Rational(1, 2)),
+        ):
+            with check:
+                assert state(strategy).outcome_iteratively() == state(strategy).outcome
+
+        count = 5_000
+        rank = BinTreeState.rank
+        outcome = CountdownState(count, (GameState.rational_strategy(rank),) * 2).outcome_iteratively()
+        with check:
+            assert outcome.payoffs == (0, 1)
+        with check:
+            assert len(outcome.moves) == count
+
+
+class TestSearchStats:
+
+    @staticmethod
+    def test_report() -> None:
+        for evaluate in (lambda s: s.outcome, lambda s: s.outcome_iteratively()):
+            root = state(GameState.rational_strategy(BinTreeState.rank))
+            with search_stats() as stats:
+                evaluate(root)
+            report = json.loads(stats.to_json())
+            with check:
+                assert report["nodes_per_depth"] == {"0": 1, "1": 2, "2": 4}
+            with check:
+                assert report["terminal_evaluations"] == 4
+            with check:
+                assert report["average_branching_factor"] == 2.0
+            with check:
+                assert set(report["seconds_per_depth"]) == {"0", "1", "2"}
+
+        root = state(GameState.rational_strategy(BinTreeState.rank))
+        root.outcome
+        with search_stats() as stats:
+            root.outcome
+        with check:
+            assert stats.stash_hits == 1 and stats.report()["nodes"] == 0
+        root.clear_stashed_outcome()
+        root.outcome
+        with check:
+            assert stats.stash_hits == 1 and stats.report()["nodes"] == 0
+
+        with search_stats() as stats:
+            state(GameState.alphabeta_strategy(BinTreeState.rank)).outcome
+        with check:
+            assert stats.nodes[0] == 1 and stats.terminal_evaluations <= 4
+
+
+class TestAlphabeta:
+
+    @staticmethod
+    def test_order() -> None:
+        # copies of the branches are matched to the branches generated by their moves
+        def reversed_copies(_state: GameState, branches: list) -> list:
+            return [copy.copy(branch) for branch in reversed(branches)]
+
+        for order in (None, reversed_copies):
+            strategy = GameState.alphabeta_strategy(BinTreeState.rank, order)
+            with check:
+                assert state(strategy).outcome.moves == (LEFT, RIGHT)
+            with check:
+                assert BranchingTreeState(0, (strategy, strategy), PAYOFFS).outcome.moves == (LEFT, RIGHT)
+
+    @staticmethod
+    def test_undo() -> None:
+        def failing_rank(player: int, outcome: GameOutcome) -> sp.Rational:
+            raise ArithmeticError
+
+        root = state(GameState.alphabeta_strategy(failing_rank))
+        with raises(ArithmeticError):
+            root.outcome
+        with check:
+            assert root.history == () and root.player == 0
+
+
+class TestTranspositionTable:
+
+    @staticmethod
+    def test_transposition_hits() -> None:
+        table = TranspositionTable()
+        state(GameState.rational_strategy(BinTreeState.rank, table)).outcome
+        with search_stats() as stats:
+            state(GameState.rational_strategy(BinTreeState.rank, table)).outcome
+        with check:
+            assert stats.transposition_hits == 2
+
+    @staticmethod
+    def test_vector_bayesian() -> None:
+        def weights(_state: GameState, move: GameMove) -> sp.Rational:
+            return sp.Rational(1, 3) if move == LEFT else sp.Rational(2, 3)
+
+        vector = GameState.vector_bayesian_strategy(weights)
+        with numeric_backend("float"):
+            outcome = state(vector).outcome
+        with check:
+            assert abs(outcome.payoffs[0] - 5 / 9) < 1e-12 and isinstance(outcome.payoffs[0], float)
+        # the states where the vector strategy chooses are looked up once each, and the final states not at all
+        with check:
+            assert vector.table.misses == len(vector.table) == 3
+
+    @staticmethod
+    def test_default_key() -> None:
+        # BinTreeState keeps the default key, the player to move and the moves leading to the position
+        game = state(GameState.rational_strategy(BinTreeState.rank))
+        with check:
+            assert game.key == (0, ())
+        game.apply(LEFT)
+        with check:
+            assert game.key == game.position_key() == (1, (LEFT,))
+        game.undo(LEFT)
+        with check:
+            assert game.key == (0, ())
+
+
+class TestDepthLimited:
+
+    @staticmethod
+    def test_depth_limited() -> None:
+        rational = state(GameState.rational_strategy(BinTreeState.rank)).outcome
+
+        def evaluation(tree: GameState) -> tuple:
+            """ a misleading evaluation favoring RIGHT """
+            assert tree.history is not None
+            branch = tree.history[-1].branch
+            return sp.Integer(branch), sp.Integer(-branch)
+
+        outcome = state(GameState.depth_limited_strategy(BinTreeState.rank, evaluation, 1)).outcome
+        with check:
+            assert outcome.moves == (RIGHT,) and outcome.payoffs == (1, -1)
+        with check:
+            assert state(GameState.depth_limited_strategy(BinTreeState.rank, evaluation, 2)).outcome == rational
+
+        deepening = GameState.iterative_deepening_strategy(BinTreeState.rank, evaluation, time_budget=10)
+        start = time.perf_counter()
+        with search_stats() as stats:
+            with check:
+                assert state(deepening).outcome == rational
+        with check:
+            assert deepening.completed_depth == 2 and time.perf_counter() - start < 1
+        # the root is expanded at depths 1 and 2, and its two branches at depth 2
+        with check:
+            assert stats.expanded == 4 and stats.branches == 8
+
+
+class TestMcts:
+
+    @staticmethod
+    def test_mcts() -> None:
+        root = state(GameState.mcts_strategy(BinTreeState.rank, iterations=500))
+        outcome = root.outcome
+        with check:
+            assert outcome.moves == (LEFT, RIGHT)
+        with check:
+            assert abs(outcome.payoffs[0] - 2) < 1
+        with check:
+            assert root.history == ()
+
+        strategy = GameState.mcts_strategy(BinTreeState.rank, iterations=500)
+        outcome = BranchingTreeState(0, (strategy, strategy), PAYOFFS).outcome
+        with check:
+            assert outcome.moves == (LEFT, RIGHT)
+
+    @staticmethod
+    def test_without_budget() -> None:
+        for strategy in (
+            GameState.mcts_strategy(BinTreeState.rank, iterations=0),
+            GameState.mcts_strategy(BinTreeState.rank, time_budget=0.0),
+        ):
+            # the single iteration expands one branch of the root and rolls out from it
+            outcome = state(strategy).outcome
+            with check:
+                assert len(outcome.moves) == 1 and outcome.payoffs in PAYOFFS.values()
+
+    @staticmethod
+    def test_without_branches() -> None:
+        strategy = GameState.mcts_strategy(BinTreeState.rank, iterations=10)
+        with raises(ValueError):
+            StuckState(3, (strategy, strategy)).outcome
+        with raises(ValueError):
+            GameState.random_rollout(StuckState(3, (strategy, strategy)))
+
+
+class TestRollouts:
+
+    @staticmethod
+    def test_standard_errors() -> None:
+        # the sums of squares would lose the variance of the coin flip to rounding
+        summary = run_rollouts(CoinState, 1_000, batch_size=300, seed=1)
+        with check:
+            assert summary.trials == 1_000 and abs(summary.means[0] - 1e9 - 0.5) < 0.1
+        with check:
+            assert abs(summary.standard_errors[0] - 0.5 / math.sqrt(1_000)) < 0.001
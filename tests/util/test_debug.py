@@ -0,0 +1,206 @@
+import os
+import subprocess
+import sys
+
+from pytest import raises
+from pytest_check import check  # type: ignore
+
+from util.debug import (
+    TRACE_DETAIL,
+    TRACE_INFO,
+    TRACE_OFF,
+    VALIDATION_BOUNDARY,
+    VALIDATION_ENVIRONMENT,
+    VALIDATION_FULL,
+    VALIDATION_OFF,
+    checkup,
+    ic,
+    icprint,
+    set_trace_level,
+    set_validation_level,
+    trace,
+    trace_level,
+    undebug,
+    validation_level,
+)
+
+
+def checked_class(level: str) -> type:
+    """ a class whose methods are decorated at the validation level, counting the checks made """
+    previous = set_validation_level(level)
+    try:
+
+        class Checked:
+            def __init__(self) -> None:
+                self.checks = 0
+
+            def check(self) -> None:
+                self.checks += 1
+
+            @checkup
+            def inner(self) -> int:
+                return 1
+
+            @checkup
+            def outer(self) -> int:
+                return self.inner() + self.inner()
+
+            @checkup
+            def items(self):
+                for _ in range(3):
+                    yield self.inner()
+
+    finally:
+        set_validation_level(previous)
+    return Checked
+
+
+class TestValidation:
+
+    @staticmethod
+    def test_levels() -> None:
+        checked = checked_class(VALIDATION_OFF)()
+        with check:
+            assert checked.outer() == 2 and sum(checked.items()) == 3
+        with check:
+            assert checked.checks == 0
+
+        checked = checked_class(VALIDATION_BOUNDARY)()
+        with check:
+            assert checked.outer() == 2
+        with check:
+            assert checked.checks == 2
+        checked.inner()
+        with check:
+            assert checked.checks == 4
+
+        checked = checked_class(VALIDATION_FULL)()
+        with check:
+            assert checked.outer() == 2
+        with check:
+            assert checked.checks == 2 + 2 * 2
+
+    @staticmethod
+    def test_generators() -> None:
+        checked = checked_class(VALIDATION_BOUNDARY)()
+        items = checked.items()
+        with check:
+            assert checked.checks == 0
+        with check:
+            assert next(items) == 1 and checked.checks == 1
+        with check:
+            assert list(items) == [1, 1] and checked.checks == 2
+
+        checked = checked_class(VALIDATION_FULL)()
+        with check:
+            assert sum(checked.items()) == 3
+        with check:
+            assert checked.checks == 2 + 3 * 2
+
+    @staticmethod
+    def test_set_validation_level() -> None:
+        previous = set_validation_level(VALIDATION_BOUNDARY)
+        try:
+            with check:
+                assert validation_level() == VALIDATION_BOUNDARY
+            with check:
+                assert set_validation_level(VALIDATION_OFF) == VALIDATION_BOUNDARY
+            with raises(ValueError):
+                set_validation_level("sometimes")
+            with check:
+                assert validation_level() == VALIDATION_OFF
+        finally:
+            set_validation_level(previous)
+
+    @staticmethod
+    def test_environment() -> None:
+        def imported_level(level: str) -> subprocess.CompletedProcess:
+            environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            environment[VALIDATION_ENVIRONMENT] = level
+            return subprocess.run(
+                [sys.executable, "-c", "from util.debug import validation_level; print(validation_level())"],
+                env=environment,
+                capture_output=True,
+                text=True,
+            )
+
+        for level in (VALIDATION_OFF, VALIDATION_BOUNDARY, VALIDATION_FULL):
+            with check:
+                assert imported_level(f" {level.upper()} ").stdout.strip() == level
+        result = imported_level("sometimes")
+        with check:
+            assert result.returncode != 0 and "ValueError" in result.stderr
+
+
+class TestTrace:
+
+    @staticmethod
+    def traced(level: int) -> tuple[list[str], int]:
+        """
+
+        :param level: the trace level
+        :return: the messages shown at the level, and the number of lazy messages built
+        """
+        messages: list[str] = []
+        built = 0
+
+        def lazy() -> str:
+            nonlocal built
+            built += 1
+            return "lazy detail"
+
+        output = ic.outputFunction
+        ic.configureOutput(outputFunction=messages.append)
+        try:
+            with icprint(True), trace_level(level):
+                trace(TRACE_INFO, "info {}", 1)
+                trace(TRACE_DETAIL, "detail {}", 2)
+                trace(TRACE_DETAIL, lazy)
+        finally:
+            ic.configureOutput(outputFunction=output)
+        return messages, built
+
+    @staticmethod
+    def test_levels() -> None:
+        messages, built = TestTrace.traced(TRACE_OFF)
+        with check:
+            assert messages == [] and built == 0
+
+        messages, built = TestTrace.traced(TRACE_INFO)
+        with check:
+            assert len(messages) == 1 and "info 1" in messages[0]
+        with check:
+            assert built == 0
+
+        messages, built = TestTrace.traced(TRACE_DETAIL)
+        with check:
+            assert len(messages) == 3 and "detail 2" in messages[1] and "lazy detail" in messages[2]
+        with check:
+            assert built == 1
+
+    @staticmethod
+    def test_disabled() -> None:
+        built = []
+
+        @undebug
+        def quiet() -> None:
+            trace(TRACE_INFO, lambda: built.append(1) or "hidden")
+
+        with icprint(True), trace_level(TRACE_DETAIL):
+            quiet()
+        with check:
+            assert built == []
+
+    @staticmethod
+    def test_set_trace_level() -> None:
+        previous = set_trace_level(TRACE_INFO)
+        try:
+            with trace_level(TRACE_OFF) as level:
+                with check:
+                    assert level == TRACE_OFF
+                with check:
+                    assert set_trace_level(TRACE_DETAIL) == TRACE_OFF
+            with check:
+                assert set_trace_level(TRACE_INFO) == TRACE_INFO
+        finally:
+            set_trace_level(previous)